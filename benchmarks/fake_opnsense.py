@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeOpnSense:
+    """
+    An in-process stand-in for the OPNsense API, covering the model endpoints the plugins use:
+    /api/<module>/<controller>/search_<item>, add_<item>, set_<item>/<uuid>, del_<item>/<uuid>,
+    /api/<module>/service/reconfigure|reload and the config backup history used as change token.
+
+    Every request sleeps for `latency` seconds to model the firewall's response time.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        # (module, item) -> uuid -> row
+        self.tables = {}
+        self.calls = Counter()
+        self.reconfigures = Counter()
+        self.revision = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        handler = type('Handler', (_Handler,), {'fake': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.reconfigures.clear()
+
+    def rows(self, module, item):
+        with self._lock:
+            return list(self.tables.get((module, _table_name(item)), {}).values())
+
+    def handle(self, method, path, body):
+        """
+        Applies one API call to the in-memory tables. Returns (status, response body).
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) < 4 or parts[0] != 'api':
+            return 404, {'errorMessage': 'Endpoint not found'}
+        module, controller, command, args = parts[1], parts[2], parts[3], parts[4:]
+
+        with self._lock:
+            self.calls[f"{method} /api/{module}/{controller}/{command}"] += 1
+
+            if (module, controller, command) == ('core', 'backup', 'backups'):
+                return 200, {'items': [{'time': self.revision}]}
+            if controller == 'service' and command in ('reconfigure', 'reload'):
+                self.reconfigures[module] += 1
+                return 200, {'status': 'ok'}
+            if controller == 'diagnostics' and command in ('dumpcache', 'loadcache'):
+                return 200, {'data': []}
+
+            action, _, item = command.partition('_')
+            table = self.tables.setdefault((module, _table_name(item)), {})
+            if action == 'search':
+                rows = list(table.values())
+                return 200, {'rows': rows, 'rowCount': len(rows), 'total': len(rows), 'current': 1}
+            if action == 'get' and args:
+                row = table.get(args[0])
+                return (200, {item: row}) if row else (404, {'errorMessage': 'not found'})
+            if action == 'add':
+                row_uuid = str(uuid.uuid4())
+                table[row_uuid] = {**_payload(body, item), 'uuid': row_uuid}
+                self.revision += 1
+                return 200, {'result': 'saved', 'uuid': row_uuid}
+            if action == 'set' and args:
+                if args[0] not in table:
+                    return 404, {'errorMessage': 'not found'}
+                table[args[0]].update(_payload(body, item))
+                self.revision += 1
+                return 200, {'result': 'saved'}
+            if action == 'del' and args:
+                if table.pop(args[0], None) is None:
+                    return 200, {'result': 'not found'}
+                self.revision += 1
+                return 200, {'result': 'deleted'}
+        return 404, {'errorMessage': 'Endpoint not found'}
+
+def _table_name(item):
+    # The plugins search some tables by plural name (search_acls) but write them by singular name (add_acl)
+    return item[:-1] if item.endswith('s') else item
+
+def _payload(body, item):
+    """
+    Unwraps {'<item>': {...}} request bodies; the wrapper key does not always match the item name.
+    """
+    if isinstance(body, dict) and len(body) == 1:
+        value = next(iter(body.values()))
+        if isinstance(value, dict):
+            return {k: _flatten(v) for k, v in value.items()}
+    return {}
+
+def _flatten(value):
+    # Search rows return lists as comma-separated strings, like OPNsense does
+    if isinstance(value, list):
+        return ",".join(str(v) for v in value)
+    return value
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, Nagle's algorithm would delay every response by ~40ms
+    disable_nagle_algorithm = True
+
+    def _dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        body = json.loads(raw) if raw else None
+        status, response = self.fake.handle(method, self.path, body)
+        payload = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass
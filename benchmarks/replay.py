@@ -0,0 +1,277 @@
+"""
+Replays a recording made with CONTROLLER_RECORD_FILE against the controller's watch pipeline:
+watch events are fed through the work queue at their recorded times (divided by --speed) while
+OPNsense calls are answered with the recorded responses. Reports throughput, event-to-apply
+latency, reconcile runs and OPNsense calls.
+
+    python -m benchmarks.replay recording.jsonl.gz --config config.yaml --speed 10
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+import requests
+import yaml
+from collections import Counter, deque
+from kubernetes import watch
+from benchmarks.synthetic import FakeCoreV1Api, FakeNetworkingV1Api
+from src import main as controller
+from src import metrics, recording
+from src.clients.opnsense import OpnSenseClient
+from src.workqueue import WorkQueue
+
+# Kubernetes model of the objects of each watched resource type
+_MODELS = {'node': 'V1Node', 'service': 'V1Service', 'ingress': 'V1Ingress', 'config_map': 'V1ConfigMap'}
+
+# A watch starts with an ADDED event for every existing object; the leading ADDED events of a resource
+# type within this many seconds of its first event are treated as the cluster's state before the recording
+_INITIAL_LIST_WINDOW = 5.0
+
+class ReplayCluster:
+    """
+    The cluster state rebuilt from recorded watch events, served like the Kubernetes APIs.
+    """
+    def __init__(self):
+        # Decodes recorded objects the same way the watch did when they were received
+        self._watch = watch.Watch()
+        self._objects = {resource_type: {} for resource_type in _MODELS}
+        self._lock = threading.Lock()
+        self.core_v1 = FakeCoreV1Api(self)
+        self.networking_v1 = FakeNetworkingV1Api(self)
+
+    def apply(self, record):
+        """
+        Applies a recorded watch event and returns the deserialized object.
+        """
+        event = json.dumps({'type': record['type'], 'object': record['object']})
+        obj = self._watch.unmarshal_event(event, _MODELS[record['resource']])['object']
+        key = (obj.metadata.namespace, obj.metadata.name)
+        with self._lock:
+            if record['type'] == 'DELETED':
+                self._objects[record['resource']].pop(key, None)
+            else:
+                self._objects[record['resource']][key] = obj
+        return obj
+
+    def _list(self, resource_type):
+        with self._lock:
+            return list(self._objects[resource_type].values())
+
+    @property
+    def nodes(self):
+        return self._list('node')
+
+    @property
+    def services(self):
+        return self._list('service')
+
+    @property
+    def ingresses(self):
+        return self._list('ingress')
+
+    @property
+    def configmaps(self):
+        return self._list('config_map')
+
+class _ReplayResponse:
+    def __init__(self, status, body):
+        self.status_code = status
+        self._body = body
+
+    def raise_for_status(self):
+        if self.status_code is None:
+            raise requests.exceptions.ConnectionError('no response was recorded')
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} (recorded)", response=self)
+
+    def json(self):
+        return self._body
+
+class ReplaySession:
+    """
+    Stands in for the OpnSenseClient's requests session and answers each call with the next recorded
+    response for the same method and endpoint (without UUIDs). Once those run out the last one is repeated;
+    calls that were never recorded are answered with an empty search result or a successful write.
+    Recorded latencies are reproduced, divided by speed (0 skips them).
+    """
+    def __init__(self, records, speed=0.0):
+        self.verify = False
+        self.speed = speed
+        self.calls = Counter()
+        self.unmatched = Counter()
+        self._responses = {}
+        self._last = {}
+        self._lock = threading.Lock()
+        for record in records:
+            if record['kind'] == 'opnsense':
+                key = (record['method'], metrics.endpoint_label(record['endpoint']))
+                self._responses.setdefault(key, deque()).append(record)
+
+    def _send(self, method, url):
+        key = (method, metrics.endpoint_label(url))
+        with self._lock:
+            self.calls[key] += 1
+            pending = self._responses.get(key)
+            record = pending.popleft() if pending else self._last.get(key)
+            if record is None:
+                self.unmatched[key] += 1
+            else:
+                self._last[key] = record
+
+        if record is None:
+            return _ReplayResponse(200, {'rows': []} if '/search' in url else {'result': 'saved'})
+        if self.speed:
+            time.sleep(record.get('duration', 0) / self.speed)
+        return _ReplayResponse(record['status'], record['response'])
+
+    def get(self, url, **kwargs):
+        return self._send('GET', url)
+
+    def post(self, url, **kwargs):
+        return self._send('POST', url)
+
+    def put(self, url, **kwargs):
+        return self._send('PUT', url)
+
+    def delete(self, url, **kwargs):
+        return self._send('DELETE', url)
+
+def _initial_list(events):
+    """
+    Returns the indexes of the events that make up the initial watch list of each resource type.
+    """
+    initial = set()
+    first_seen = {}
+    done = set()
+    for index, event in enumerate(events):
+        resource = event['resource']
+        first_seen.setdefault(resource, event['t'])
+        if resource in done:
+            continue
+        if event['type'] == 'ADDED' and event['t'] - first_seen[resource] <= _INITIAL_LIST_WINDOW:
+            initial.add(index)
+        else:
+            done.add(resource)
+    return initial
+
+def _histogram_totals(histogram):
+    """
+    Returns (count, sum, {upper bound: cumulative count}) of a histogram, summed over all label values.
+    """
+    count = total = 0
+    buckets = Counter()
+    for family in histogram.collect():
+        for sample in family.samples:
+            if sample.name.endswith('_count'):
+                count += sample.value
+            elif sample.name.endswith('_sum'):
+                total += sample.value
+            elif sample.name.endswith('_bucket'):
+                buckets[float(sample.labels['le'])] += sample.value
+    return count, total, buckets
+
+def _histogram_delta(before, after):
+    return after[0] - before[0], after[1] - before[1], {le: after[2][le] - before[2].get(le, 0) for le in after[2]}
+
+def _quantile(buckets, count, q):
+    """
+    Returns the upper bound of the bucket holding the q-quantile.
+    """
+    for le in sorted(buckets):
+        if buckets[le] >= q * count:
+            return le
+    return float('inf')
+
+def replay(records, controller_config, speed=0.0, timeout=600):
+    """
+    Replays a recording through the controller's work queue and plugins. Returns a report.
+    """
+    events = [r for r in records if r['kind'] == 'event' and r['resource'] in _MODELS]
+    cluster = ReplayCluster()
+    session = ReplaySession(records, speed)
+    opnsense_client = OpnSenseClient('', 'replay', 'replay')
+    opnsense_client.session = session
+
+    initial = _initial_list(events)
+    for index in initial:
+        cluster.apply(events[index])
+
+    plugins, watch_map = controller.load_plugins(controller_config, cluster.core_v1, cluster.networking_v1, opnsense_client)
+    queue = WorkQueue()
+    plugin_locks = {p: threading.Lock() for p in plugins}
+    latency_before = _histogram_totals(metrics.EVENT_TO_APPLY_DURATION)
+    runs_before = _histogram_totals(metrics.RECONCILE_DURATION)
+
+    for _ in plugins:
+        threading.Thread(target=controller.process_queue, args=(queue, plugin_locks), daemon=True).start()
+
+    start = time.monotonic()
+    for plugin in plugins:
+        queue.add(plugin)
+    for event in events:
+        if speed:
+            delay = event['t'] / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        # Re-applying an initial ADDED event is a no-op, later events for the same object come after it
+        obj = cluster.apply(event)
+        controller.dispatch_event(event['resource'], event['type'], obj.metadata, watch_map.get(event['resource'], []), queue)
+    drained = queue.wait_idle(timeout)
+    wall = time.monotonic() - start
+    queue.shutdown()
+
+    latency_count, latency_sum, latency_buckets = _histogram_delta(latency_before, _histogram_totals(metrics.EVENT_TO_APPLY_DURATION))
+    runs = _histogram_delta(runs_before, _histogram_totals(metrics.RECONCILE_DURATION))[0]
+    recorded_calls = Counter((r['method'], metrics.endpoint_label(r['endpoint'])) for r in records if r['kind'] == 'opnsense')
+    return {
+        'drained': drained,
+        'wall_seconds': round(wall, 3),
+        'events': len(events),
+        'initial_objects': len(initial),
+        'events_per_second': round(len(events) / wall, 1) if wall else None,
+        'reconcile_runs': int(runs),
+        'event_to_apply': {
+            'count': int(latency_count),
+            'mean_seconds': round(latency_sum / latency_count, 4) if latency_count else None,
+            'p50_seconds_at_most': _quantile(latency_buckets, latency_count, 0.5) if latency_count else None,
+            'p95_seconds_at_most': _quantile(latency_buckets, latency_count, 0.95) if latency_count else None,
+        },
+        'opnsense_calls': {
+            'recorded': sum(recorded_calls.values()),
+            'replayed': sum(session.calls.values()),
+            'unmatched': sum(session.unmatched.values()),
+            'by_endpoint': {f"{method} {label}": {'recorded': recorded_calls.get((method, label), 0), 'replayed': count}
+                            for (method, label), count in sorted(session.calls.items())},
+        },
+    }
+
+def _load_config(path):
+    with open(path) as f:
+        loaded = yaml.safe_load(f)
+    # Accept the controller's ConfigMap manifest as well as its 'config' contents
+    if isinstance(loaded, dict) and 'config' in (loaded.get('data') or {}):
+        loaded = yaml.safe_load(loaded['data']['config'])
+    return loaded
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='file written with CONTROLLER_RECORD_FILE')
+    parser.add_argument('--config', required=True, help='controller configuration, as in the ConfigMap\'s config key')
+    parser.add_argument('--speed', type=float, default=0.0, help='replay speed-up, e.g. 10 for ten times faster; 0 replays as fast as possible')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for the queue to drain after the last event')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--verbose', action='store_true', help='show the controller\'s log output')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+    report = replay(recording.load(args.recording), _load_config(args.config), args.speed, args.timeout)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report['drained'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
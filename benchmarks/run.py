@@ -0,0 +1,212 @@
+"""
+Runs the plugins against a synthetic cluster and an in-process fake OPNsense API, and reports
+wall time, API calls, service reconfigures and peak memory for each plugin and scenario.
+
+    python -m benchmarks.run --scale 0.1
+    python -m benchmarks.run --json results.json
+    python -m benchmarks.run --baseline results.json --tolerance 0.25
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from benchmarks.fake_opnsense import FakeOpnSense
+from benchmarks.synthetic import SyntheticCluster
+from src.clients.opnsense import OpnSenseClient
+from src.registry import FileStore, ManagedObjectRegistry
+from src.plugins.metallb import MetalLBPlugin
+from src.plugins.haproxy_declarative import HAProxyDeclarativePlugin
+from src.plugins.haproxy_ingress_proxy import HAProxyIngressProxyPlugin
+from src.plugins.dns_services import DNSServicesPlugin
+from src.plugins.dns_ingresses import DNSIngressesPlugin
+from src.plugins.dns_haproxy_ingress_proxy import DNSHAProxyIngressProxyPlugin
+
+_DNS_BACKENDS = {'unbound': {'enabled': True}, 'dnsmasq': {'enabled': True}}
+_INGRESS_PROXY_CONFIG = {'enabled': True, 'defaultFrontend': 'http-80', 'defaultBackend': 'traefik'}
+
+# Plugin name -> (class, Kubernetes API attribute of SyntheticCluster, config, extra constructor arguments)
+PLUGINS = {
+    'metallb': (MetalLBPlugin, 'core_v1', {
+        'enabled': True, 'bgp-implementation': 'openbgp',
+        'options': {'openbgp': {'template': {'groupname': 'metallb'}}},
+    }, {}),
+    'haproxy-declarative': (HAProxyDeclarativePlugin, 'core_v1', {'enabled': True, 'maxConcurrency': 4}, {}),
+    'haproxy-ingress-proxy': (HAProxyIngressProxyPlugin, 'networking_v1', _INGRESS_PROXY_CONFIG, {}),
+    'dns-services': (DNSServicesPlugin, 'core_v1', {'enabled': True, 'dnsBackends': _DNS_BACKENDS}, {}),
+    'dns-ingresses': (DNSIngressesPlugin, 'networking_v1', {'enabled': True, 'dnsBackends': _DNS_BACKENDS}, {}),
+    'dns-haproxy-ingress-proxy': (DNSHAProxyIngressProxyPlugin, 'networking_v1', {
+        'enabled': True, 'dnsBackends': _DNS_BACKENDS, 'frontends': {'http-80': {'hostname': 'http-80.k8s'}},
+    }, {'haproxy_ingress_proxy_config': _INGRESS_PROXY_CONFIG}),
+}
+
+# Metrics compared against a baseline; API and reconfigure counts are deterministic, time and memory are not
+_EXACT_METRICS = ('api_calls', 'writes', 'reconfigures')
+_TOLERANT_METRICS = ('wall_seconds', 'peak_memory_bytes')
+
+class _Measurement:
+    """
+    Measures one scenario: wall time, peak traced memory and the fake API's call counters.
+    """
+    def __init__(self, fake, memory):
+        self.fake = fake
+        self.memory = memory
+        self.result = None
+
+    def __enter__(self):
+        self.fake.reset_counters()
+        if self.memory:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self._start
+        peak = None
+        if self.memory:
+            # Includes the fake server's allocations, which scale with the same number of calls
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        by_method = Counter()
+        for call, count in self.fake.calls.items():
+            by_method[call.split(' ', 1)[0]] += count
+        writes = sum(count for call, count in self.fake.calls.items()
+                     if call.startswith('POST') and call.rsplit('/', 1)[-1].split('_', 1)[0] in ('add', 'set', 'del'))
+        self.result = {
+            'wall_seconds': round(wall, 4),
+            'api_calls': sum(self.fake.calls.values()),
+            'api_calls_by_method': dict(by_method),
+            'writes': writes,
+            'reconfigures': sum(self.fake.reconfigures.values()),
+            'peak_memory_bytes': peak,
+        }
+        return False
+
+def _new_plugin(name, cluster, opnsense_client, registry):
+    plugin_class, api, config, extra = PLUGINS[name]
+    return plugin_class(getattr(cluster, api), opnsense_client, dict(config), registry=registry, **extra)
+
+def benchmark_plugin(name, cluster, latency=0.0, mutate_fraction=0.01, memory=True):
+    """
+    Runs one plugin through the cold start, warm no-op, incremental and restart scenarios.
+    Returns {scenario: measurement}.
+    """
+    fake = FakeOpnSense(latency)
+    url = fake.start()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            registry_path = os.path.join(tmp, 'registry.json')
+            registry = ManagedObjectRegistry(FileStore(registry_path))
+            plugin = _new_plugin(name, cluster, OpnSenseClient(url, 'key', 'secret'), registry)
+
+            # Empty OPNsense, everything is created
+            with _Measurement(fake, memory) as m:
+                plugin.run()
+            results['cold'] = m.result
+
+            # Nothing changed since the last run
+            with _Measurement(fake, memory) as m:
+                plugin.run()
+            results['warm_noop'] = m.result
+
+            # A small fraction of the objects changed
+            cluster.mutate(mutate_fraction)
+            with _Measurement(fake, memory) as m:
+                plugin.run()
+            results['incremental'] = m.result
+
+            # A new controller process against the populated firewall and the persisted registry
+            registry = ManagedObjectRegistry(FileStore(registry_path))
+            registry.load()
+            plugin = _new_plugin(name, cluster, OpnSenseClient(url, 'key', 'secret'), registry)
+            with _Measurement(fake, memory) as m:
+                plugin.run()
+            results['restart'] = m.result
+    finally:
+        fake.stop()
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of regressions of results against a baseline with the same plugins and scenarios.
+    """
+    regressions = []
+    for plugin, scenarios in results.items():
+        for scenario, current in scenarios.items():
+            previous = baseline.get(plugin, {}).get(scenario)
+            if not previous:
+                continue
+            for metric in _EXACT_METRICS:
+                if current[metric] > previous[metric]:
+                    regressions.append(f"{plugin}/{scenario}: {metric} {previous[metric]} -> {current[metric]}")
+            for metric in _TOLERANT_METRICS:
+                if current.get(metric) is None or previous.get(metric) is None:
+                    continue
+                if current[metric] > previous[metric] * (1 + tolerance):
+                    regressions.append(f"{plugin}/{scenario}: {metric} {previous[metric]} -> {current[metric]} (more than {tolerance:.0%} worse)")
+    return regressions
+
+def _format_table(results):
+    header = f"{'plugin':<28}{'scenario':<13}{'wall s':>9}{'calls':>8}{'GET':>7}{'POST':>7}{'writes':>8}{'reconf':>8}{'peak MiB':>10}"
+    lines = [header, '-' * len(header)]
+    for plugin, scenarios in results.items():
+        for scenario, r in scenarios.items():
+            peak = f"{r['peak_memory_bytes'] / 2**20:.1f}" if r['peak_memory_bytes'] is not None else '-'
+            by_method = r['api_calls_by_method']
+            lines.append(f"{plugin:<28}{scenario:<13}{r['wall_seconds']:>9.3f}{r['api_calls']:>8}{by_method.get('GET', 0):>7}"
+                         f"{by_method.get('POST', 0):>7}{r['writes']:>8}{r['reconfigures']:>8}{peak:>10}")
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=500)
+    parser.add_argument('--services', type=int, default=5000)
+    parser.add_argument('--ingresses', type=int, default=10000)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the object counts, e.g. 0.01 for a quick run')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='simulated OPNsense latency per request')
+    parser.add_argument('--mutate', type=float, default=0.01, help='fraction of objects changed in the incremental scenario')
+    parser.add_argument('--plugins', default=','.join(PLUGINS), help='comma-separated plugins to run')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, which slows runs down considerably')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against results written earlier with --json, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative increase of wall time and memory')
+    parser.add_argument('--verbose', action='store_true', help='show the plugins\' log output')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    plugins = [p.strip() for p in args.plugins.split(',') if p.strip()]
+    unknown = [p for p in plugins if p not in PLUGINS]
+    if unknown:
+        parser.error(f"unknown plugins: {', '.join(unknown)} (available: {', '.join(PLUGINS)})")
+
+    counts = {k: max(1, int(getattr(args, k) * args.scale)) for k in ('nodes', 'services', 'ingresses')}
+    results = {}
+    for name in plugins:
+        # Every plugin gets a fresh cluster, so the incremental mutations of one do not leak into the next
+        cluster = SyntheticCluster(**counts)
+        print(f"Benchmarking {name} with {cluster.object_counts()}...", file=sys.stderr)
+        results[name] = benchmark_plugin(name, cluster, args.latency_ms / 1000, args.mutate, not args.no_memory)
+
+    print(_format_table(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'parameters': {**counts, 'latency_ms': args.latency_ms, 'mutate': args.mutate}, 'results': results}, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline.get('results', {}), args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
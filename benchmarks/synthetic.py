@@ -0,0 +1,159 @@
+import ipaddress
+import yaml
+from kubernetes import client
+
+class SyntheticCluster:
+    """
+    Generates Kubernetes objects at a given scale and serves them through the subset of the
+    CoreV1Api and NetworkingV1Api the plugins call.
+    """
+    def __init__(self, nodes=500, services=5000, ingresses=10000, configmaps=None, domain='bench.example'):
+        self.domain = domain
+        self._version = 0
+        self.nodes = [self._node(i) for i in range(nodes)]
+        self.services = [self._service(i) for i in range(services)]
+        self.ingresses = [self._ingress(i) for i in range(ingresses)]
+        # One declarative ConfigMap per 50 services by default, each with a backend and frontend per service
+        configmaps = max(1, services // 50) if configmaps is None else configmaps
+        self.configmaps = [self._configmap(i, services) for i in range(configmaps)]
+        self.core_v1 = FakeCoreV1Api(self)
+        self.networking_v1 = FakeNetworkingV1Api(self)
+
+    def object_counts(self):
+        return {
+            'nodes': len(self.nodes),
+            'services': len(self.services),
+            'ingresses': len(self.ingresses),
+            'configmaps': len(self.configmaps),
+        }
+
+    def mutate(self, fraction, generation=1):
+        """
+        Changes roughly the given fraction of every object type, the way rolling updates and
+        re-scheduled LoadBalancers do: node and LoadBalancer IPs move, ingress hosts are renamed
+        and declarative ConfigMaps are edited. Returns the number of changed objects.
+        """
+        changed = 0
+        for objects, change in ((self.nodes, self._move_node), (self.services, self._move_service),
+                                (self.ingresses, self._rename_ingress), (self.configmaps, self._edit_configmap)):
+            if not objects:
+                continue
+            step = max(1, round(1 / fraction)) if fraction > 0 else None
+            if step is None:
+                continue
+            for index in range(0, len(objects), step):
+                change(objects[index], generation)
+                objects[index].metadata.resource_version = self._next_version()
+                changed += 1
+        return changed
+
+    def _next_version(self):
+        self._version += 1
+        return str(self._version)
+
+    def _node(self, index):
+        return client.V1Node(
+            metadata=client.V1ObjectMeta(name=f"node-{index:05d}", labels={'kubernetes.io/hostname': f"node-{index:05d}"},
+                                         resource_version=self._next_version()),
+            status=client.V1NodeStatus(addresses=[
+                client.V1NodeAddress(type='InternalIP', address=_ip('10.0.0.0', index)),
+                client.V1NodeAddress(type='Hostname', address=f"node-{index:05d}"),
+            ]),
+        )
+
+    def _service(self, index):
+        namespace = f"ns-{index % 100:03d}"
+        return client.V1Service(
+            metadata=client.V1ObjectMeta(name=f"svc-{index:05d}", namespace=namespace, resource_version=self._next_version(),
+                                         annotations={'dns.opnsense.org/hostname': f"svc-{index:05d}.{self.domain}"}),
+            spec=client.V1ServiceSpec(type='LoadBalancer', ports=[client.V1ServicePort(port=80, node_port=30000 + index % 2000)]),
+            status=client.V1ServiceStatus(load_balancer=client.V1LoadBalancerStatus(
+                ingress=[client.V1LoadBalancerIngress(ip=_ip('172.16.0.0', index))])),
+        )
+
+    def _ingress(self, index):
+        namespace = f"ns-{index % 100:03d}"
+        return client.V1Ingress(
+            metadata=client.V1ObjectMeta(name=f"ing-{index:05d}", namespace=namespace, resource_version=self._next_version(), annotations={}),
+            spec=client.V1IngressSpec(rules=[client.V1IngressRule(host=f"app-{index:05d}.{self.domain}")]),
+            status=client.V1IngressStatus(load_balancer=client.V1IngressLoadBalancerStatus(
+                ingress=[client.V1IngressLoadBalancerIngress(ip=_ip('192.168.0.0', index % 250))])),
+        )
+
+    def _configmap(self, index, services):
+        namespace = f"ns-{index % 100:03d}"
+        per_configmap = 50
+        resources = []
+        for svc in range(index * per_configmap, min((index + 1) * per_configmap, max(services, per_configmap))):
+            name = f"cm{index:04d}-svc-{svc:05d}"
+            resources.append({'type': 'backend', 'definition': {'name': name, 'mode': 'http', 'linkedServers': []},
+                              'ha_servers': [{'type': 'node-static', 'definition': {'name': f"{name}-static", 'address': _ip('10.1.0.0', svc), 'port': 8080}}]})
+            resources.append({'type': 'frontend', 'definition': {'name': f"{name}-fe", 'bind': f"0.0.0.0:{10000 + svc % 50000}",
+                                                                  'mode': 'http', 'defaultBackend': name}})
+        return client.V1ConfigMap(
+            metadata=client.V1ObjectMeta(name=f"haproxy-{index:04d}", namespace=namespace, resource_version=self._next_version(),
+                                         labels={'pfsense.org/type': 'declarative'}),
+            data={'data': yaml.safe_dump({'resources': resources})},
+        )
+
+    def _move_node(self, node, generation):
+        node.status.addresses[0].address = _ip('10.128.0.0', int(node.metadata.name.split('-')[1]) + generation)
+
+    def _move_service(self, service, generation):
+        index = int(service.metadata.name.split('-')[1])
+        service.status.load_balancer.ingress[0].ip = _ip('172.24.0.0', index + generation)
+
+    def _rename_ingress(self, ingress, generation):
+        index = int(ingress.metadata.name.split('-')[1])
+        ingress.spec.rules[0].host = f"app-{index:05d}-g{generation}.{self.domain}"
+
+    def _edit_configmap(self, cm, generation):
+        config = yaml.safe_load(cm.data['data'])
+        for resource in config['resources']:
+            if resource['type'] == 'frontend':
+                resource['definition']['description'] = f"generation {generation}"
+        cm.data['data'] = yaml.safe_dump(config)
+
+def _ip(base, index):
+    return str(ipaddress.ip_address(base) + index + 1)
+
+def _matches_labels(labels, label_selector):
+    if not label_selector:
+        return True
+    for term in label_selector.split(','):
+        key, _, value = term.partition('=')
+        if (labels or {}).get(key.strip()) != value.strip():
+            return False
+    return True
+
+class FakeCoreV1Api:
+    """
+    Serves the objects of a cluster (anything with nodes, services and configmaps lists) like CoreV1Api.
+    """
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def list_node(self, label_selector=None, field_selector=None, **kwargs):
+        return client.V1NodeList(items=[n for n in self.cluster.nodes if _matches_labels(n.metadata.labels, label_selector)])
+
+    def list_service_for_all_namespaces(self, **kwargs):
+        return client.V1ServiceList(items=list(self.cluster.services))
+
+    def list_config_map_for_all_namespaces(self, label_selector=None, **kwargs):
+        return client.V1ConfigMapList(items=[cm for cm in self.cluster.configmaps if _matches_labels(cm.metadata.labels, label_selector)])
+
+    def read_namespaced_service(self, name, namespace, **kwargs):
+        for service in self.cluster.services:
+            if service.metadata.name == name and service.metadata.namespace == namespace:
+                return service
+        raise client.ApiException(status=404, reason='Not Found')
+
+class FakeNetworkingV1Api:
+    """
+    Serves the ingresses of a cluster like NetworkingV1Api.
+    """
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def list_ingress_for_all_namespaces(self, **kwargs):
+        return client.V1IngressList(items=list(self.cluster.ingresses))
@@ -0,0 +1,207 @@
+import logging
+import uuid as uuidlib
+
+# Deletes are always sent item by item, OPNsense does not drop array items left out of a model set
+_COMMANDS = ('add', 'set')
+
+class BulkWriteError(Exception):
+    """
+    Raised when staged changes fail local validation or the model save, when per-item fallback calls fail,
+    or when it cannot be told whether a failed model save was applied.
+    """
+
+class BulkModel:
+    """
+    Where the array items of an OPNsense settings controller live in its model.
+
+    controller is the API path of the settings controller, e.g. '/api/unbound/settings', and model the
+    key its get/set endpoints wrap the model in. items maps the item name of the add_/set_ commands
+    to the path of its array in the model, e.g. {'host_override': ('hosts', 'host')}.
+    """
+    def __init__(self, controller, model, items):
+        self.controller = controller
+        self.model = model
+        self.items = items
+
+def _is_options(value):
+    # Select fields come back from get as {option: {'value': label, 'selected': 0|1}}
+    return isinstance(value, dict) and value and all(isinstance(v, dict) and 'selected' in v for v in value.values())
+
+def flatten_model(node):
+    """
+    Converts a model as returned by a get endpoint into the shape its set endpoint accepts:
+    select fields become their comma-separated selected options, empty arrays empty dicts.
+    """
+    if _is_options(node):
+        return ",".join(option for option, v in node.items() if v.get('selected') in (1, '1', True))
+    if isinstance(node, dict):
+        return {key: flatten_model(value) for key, value in node.items()}
+    if isinstance(node, list) and not node:
+        return {}
+    return node
+
+class BulkModelWriter:
+    """
+    Stands in for an OpnSenseClient while a reconcile issues its writes. The add_/set_ calls of the
+    items of a BulkModel are staged; every other call, including del_, goes straight to the client.
+    flush() then applies the staged changes with a single get and set of the whole model, so OPNsense
+    validates and writes config.xml once instead of once per item. If the changes fail local validation
+    or the set, they are sent item by item as they were staged, except those the model shows applied.
+    """
+    def __init__(self, opnsense_client, bulk_model):
+        self.opnsense_client = opnsense_client
+        self.bulk_model = bulk_model
+        # (endpoint, data, item name, command, uuid) in call order
+        self.staged = []
+
+    def __getattr__(self, name):
+        return getattr(self.opnsense_client, name)
+
+    def _parse(self, endpoint):
+        """
+        Returns (item name, command, uuid) for a staged command's endpoint, or None.
+        """
+        prefix = self.bulk_model.controller + '/'
+        if not endpoint.startswith(prefix):
+            return None
+        command, _, uuid = endpoint[len(prefix):].partition('/')
+        action, _, item = command.partition('_')
+        if action not in _COMMANDS or item not in self.bulk_model.items:
+            return None
+        return item, action, uuid or None
+
+    def post(self, endpoint, data=None):
+        parsed = self._parse(endpoint)
+        if parsed is None:
+            return self.opnsense_client.post(endpoint, data)
+        self.staged.append((endpoint, data) + parsed)
+        return {'result': 'staged'}
+
+    def flush(self):
+        """
+        Applies the staged changes. Returns the number of model saves it took, 1 for a successful bulk
+        save and one per change after falling back. Raises BulkWriteError if fallback calls failed.
+        """
+        staged, self.staged = self.staged, []
+        if not staged:
+            return 0
+        model_name = self.bulk_model.model
+        existing = None
+        try:
+            model, existing = self._staged_model(staged)
+            response = self.opnsense_client.post(f"{self.bulk_model.controller}/set", {model_name: model})
+            if response.get('result') != 'saved':
+                raise BulkWriteError(f"model save was not accepted: {response.get('validations') or response}")
+            logging.info(f"Applied {len(staged)} {model_name} changes with one model save.")
+            return 1
+        except Exception as e:
+            logging.error(f"Bulk write of {len(staged)} {model_name} changes failed, falling back to per-item calls: {e}")
+
+        if existing is not None:
+            # The set was sent, it may have been saved even though its response was lost
+            staged = self._unapplied(staged, existing)
+        errors = []
+        for endpoint, data, _, _, _ in staged:
+            try:
+                self.opnsense_client.post(endpoint, data)
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise BulkWriteError(f"{len(errors)} of {len(staged)} {model_name} changes failed, first: {errors[0]}")
+        return len(staged)
+
+    def _get_model(self):
+        return flatten_model(self.opnsense_client.get(f"{self.bulk_model.controller}/get")[self.bulk_model.model])
+
+    def _array(self, model, item):
+        for key in self.bulk_model.items[item]:
+            model = model.setdefault(key, {})
+        return model
+
+    def _staged_model(self, staged):
+        """
+        Fetches the model and applies the staged changes to it, validating each against the model.
+        Returns the model and, per item name, the UUIDs it held before the changes.
+        """
+        model = self._get_model()
+        existing = {item: set(self._array(model, item)) for item in self.bulk_model.items}
+        templates = {}
+        for endpoint, data, item, action, uuid in staged:
+            array = self._array(model, item)
+            fields = self._fields(endpoint, data)
+            if action == 'set':
+                if uuid not in array:
+                    raise BulkWriteError(f"{endpoint}: no {item} with UUID {uuid}")
+                base = array[uuid]
+            else:
+                if item not in templates:
+                    templates[item] = self._template(item)
+                base = templates[item]
+            unknown = set(fields) - set(base)
+            if unknown:
+                raise BulkWriteError(f"{endpoint}: unknown {item} fields {sorted(unknown)}")
+            # New items get a placeholder key, OPNsense assigns their UUIDs when saving
+            array[uuid if action == 'set' else f"new-{uuidlib.uuid4()}"] = {**base, **fields}
+        return model, existing
+
+    def _unapplied(self, staged, existing):
+        """
+        Re-fetches the model and returns the staged changes it does not show applied: sets whose item
+        lacks their values, and adds without a matching item that is new since the model was staged.
+        """
+        try:
+            model = self._get_model()
+        except Exception as e:
+            raise BulkWriteError(f"could not tell whether the failed {self.bulk_model.model} model save was applied: {e}") from e
+        claimed = set()
+        unapplied = []
+        for change in staged:
+            endpoint, data, item, action, uuid = change
+            array = self._array(model, item)
+            fields = self._fields(endpoint, data)
+            if action == 'set':
+                applied = uuid in array and _has_fields(array[uuid], fields)
+            else:
+                uuid = next((key for key, obj in array.items() if key not in existing[item] and key not in claimed and _has_fields(obj, fields)), None)
+                applied = uuid is not None
+                claimed.add(uuid)
+            if not applied:
+                unapplied.append(change)
+        if len(unapplied) < len(staged):
+            logging.info(f"{len(staged) - len(unapplied)} of {len(staged)} {self.bulk_model.model} changes were saved despite the error.")
+        return unapplied
+
+    def _fields(self, endpoint, data):
+        if not isinstance(data, dict) or len(data) != 1 or not isinstance(next(iter(data.values())), dict):
+            raise BulkWriteError(f"{endpoint}: expected a payload of one item, got {data!r}")
+        fields = next(iter(data.values()))
+        for field, value in fields.items():
+            if isinstance(value, (dict, list)):
+                raise BulkWriteError(f"{endpoint}: field {field} must be a plain value")
+        return {field: "" if value is None else value for field, value in fields.items()}
+
+    def _template(self, item):
+        """
+        The fields of a new item with their defaults, from the item get endpoint without a UUID.
+        """
+        response = self.opnsense_client.get(f"{self.bulk_model.controller}/get_{item}")
+        template = next(iter(response.values()), None) if isinstance(response, dict) else None
+        if not isinstance(template, dict):
+            raise BulkWriteError(f"no defaults for new {item} items")
+        return flatten_model(template)
+
+def _has_fields(obj, fields):
+    # The model returns every value as a string
+    return all(str(obj.get(field)) == str(int(value) if isinstance(value, bool) else value) for field, value in fields.items())
+
+def writer_for(opnsense_client, bulk_model, enabled):
+    """
+    Returns a BulkModelWriter when bulk writes are enabled, else the client itself.
+    """
+    return BulkModelWriter(opnsense_client, bulk_model) if enabled and bulk_model else opnsense_client
+
+def flush(writer):
+    """
+    Flushes a writer returned by writer_for(); a no-op for a plain client.
+    """
+    return writer.flush() if isinstance(writer, BulkModelWriter) else 0
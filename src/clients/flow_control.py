@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+
+# OPNsense commands that restart or reload a service; slow by nature, so their latency says nothing about load
+_SERVICE_COMMANDS = ('reconfigure', 'reload', 'restart', 'start', 'stop')
+
+def is_service_command(endpoint_label):
+    """
+    Whether an endpoint label (/api/<module>/<controller>/<command>) applies configuration to a service.
+    """
+    return endpoint_label.rsplit('/', 1)[-1].startswith(_SERVICE_COMMANDS)
+
+class AIMDLimiter:
+    """
+    Caps the requests in flight to one firewall, adapting the cap to how the firewall copes. Each
+    healthy, prompt response raises the cap by 1/cap, so by about one per cap's worth of requests.
+    An error, or a response much slower than the usual latency, halves it, at most once per second
+    so the requests already in flight when the firewall slowed down count only once.
+    """
+    def __init__(self, initial=4, minimum=1, maximum=16, tolerance=3.0, min_slow=0.5):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        # A response is slow when it takes tolerance times the usual latency, and at least min_slow seconds
+        self.tolerance = tolerance
+        self.min_slow = min_slow
+        self.baseline = None
+        self.in_flight = 0
+        self._decreased_at = None
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self, healthy, latency=None):
+        """
+        Ends a request. latency is None for requests whose duration does not reflect the firewall's load.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            slow = False
+            if healthy and latency is not None:
+                slow = self.baseline is not None and latency > max(self.min_slow, self.tolerance * self.baseline)
+                # Follows faster responses at once and slower ones gradually, so overload does not become the norm
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += (latency - self.baseline) * 0.01
+
+            now = time.monotonic()
+            if not healthy or slow:
+                if self._decreased_at is None or now - self._decreased_at >= 1:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._decreased_at = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a write while the firewall is considered unhealthy.
+    """
+
+class CircuitBreaker:
+    """
+    Stops writes to a firewall after threshold consecutive failed requests. After a cooldown, one write
+    is let through as a probe: if it succeeds, writes resume, otherwise the cooldown doubles, up to
+    max_cooldown. Reads are never blocked. Callbacks registered with when_writable() run when the probe
+    may be sent and again when writes resume, so the work held back is retried.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold=5, cooldown=30, max_cooldown=300, name=''):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.name = name
+        self.state = self.CLOSED
+        self.cooldown = cooldown
+        self.failures = 0
+        self._probing = False
+        # key -> callback, so work held back several times is resumed once
+        self._waiting = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        return self.state == self.OPEN
+
+    def allow_write(self):
+        """
+        Whether a write may be sent now. In the half-open state, only the first caller gets to probe.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, healthy, write):
+        """
+        Records the outcome of a request; healthy is False for timeouts, connection errors, 429 and 5xx responses.
+        """
+        waiting = []
+        with self._lock:
+            if write and self.state == self.HALF_OPEN:
+                self._probing = False
+            if healthy:
+                self.failures = 0
+                if write and self.state == self.HALF_OPEN:
+                    logging.info(f"OPNsense {self.name} recovered, resuming writes.")
+                    self.state = self.CLOSED
+                    self.cooldown = self.base_cooldown
+                    waiting = self._take_waiting()
+            else:
+                self.failures += 1
+                if self.state == self.HALF_OPEN:
+                    self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                    self._open()
+                elif self.state == self.CLOSED and self.failures >= self.threshold:
+                    self._open()
+        for callback in waiting:
+            callback()
+
+    def _open(self):
+        logging.error(f"OPNsense {self.name} failed {self.failures} requests in a row, pausing writes for {self.cooldown}s.")
+        self.state = self.OPEN
+        self._timer = threading.Timer(self.cooldown, self._half_open)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _half_open(self):
+        with self._lock:
+            if self.state != self.OPEN:
+                return
+            self.state = self.HALF_OPEN
+            waiting = self._take_waiting()
+        for callback in waiting:
+            callback()
+
+    def _take_waiting(self):
+        waiting, self._waiting = list(self._waiting.values()), {}
+        return waiting
+
+    def when_writable(self, key, callback):
+        """
+        Calls callback once writes may be attempted again, right away if writes are not paused.
+        """
+        with self._lock:
+            if self.state != self.CLOSED:
+                self._waiting[key] = callback
+                return
+        callback()
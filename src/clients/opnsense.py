@@ -1,8 +1,22 @@
+import hashlib
+import json
 import requests
 import os
+import threading
+import time
+from src import metrics, recording, tracing
+from src.clients.flow_control import AIMDLimiter, CircuitBreaker, CircuitOpenError, is_service_command
+
+def _healthy(e):
+    """
+    Whether a failed request still shows a firewall that answers normally, e.g. a 404 for a deleted row.
+    """
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    return isinstance(e, requests.exceptions.HTTPError) and status is not None and status < 500 and status != 429
 
 class OpnSenseClient:
-    def __init__(self, base_url, api_key, api_secret, verify=False):
+    def __init__(self, base_url, api_key, api_secret, verify=False, target=None, max_concurrency=16,
+                 breaker_threshold=5, breaker_cooldown=30):
         """
         Initializes the OPNsense API client.
 
@@ -11,11 +25,21 @@ class OpnSenseClient:
             api_key (str): The API key for authentication.
             api_secret (str): The API secret for authentication.
             verify (bool): Whether to verify the SSL certificate. Defaults to False.
+            target (str, optional): Name of the firewall when reconciling several. Defaults to None.
+            max_concurrency (int): Most requests in flight; the actual cap adapts to the firewall's latency and errors.
+            breaker_threshold (int): Consecutive failed requests after which writes are paused. Defaults to 5.
+            breaker_cooldown (float): Seconds writes stay paused before a probe write. Defaults to 30.
         """
         self.base_url = base_url
+        self.target = target
         self.auth = (api_key, api_secret)
         self.session = requests.Session()
         self.session.verify = verify
+        self._change_token = None
+        self._change_token_at = None
+        self._change_token_lock = threading.Lock()
+        self.concurrency = AIMDLimiter(initial=min(4, max_concurrency), maximum=max_concurrency)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown, name=target or base_url)
 
     def get(self, endpoint, params=None):
         """
@@ -28,10 +52,7 @@ class OpnSenseClient:
         Returns:
             dict: The JSON response from the API.
         """
-        url = f"{self.base_url}{endpoint}"
-        response = self.session.get(url, auth=self.auth, params=params)
-        response.raise_for_status()
-        return response.json()
+        return self._send('GET', endpoint, self.session.get, params=params)
 
     def post(self, endpoint, data=None):
         """
@@ -44,10 +65,7 @@ class OpnSenseClient:
         Returns:
             dict: The JSON response from the API.
         """
-        url = f"{self.base_url}{endpoint}"
-        response = self.session.post(url, auth=self.auth, json=data)
-        response.raise_for_status()
-        return response.json()
+        return self._send('POST', endpoint, self.session.post, json=data)
 
     def put(self, endpoint, data=None):
         """
@@ -60,10 +78,7 @@ class OpnSenseClient:
         Returns:
             dict: The JSON response from the API.
         """
-        url = f"{self.base_url}{endpoint}"
-        response = self.session.put(url, auth=self.auth, json=data)
-        response.raise_for_status()
-        return response.json()
+        return self._send('PUT', endpoint, self.session.put, json=data)
 
     def delete(self, endpoint):
         """
@@ -75,10 +90,81 @@ class OpnSenseClient:
         Returns:
             dict: The JSON response from the API.
         """
+        return self._send('DELETE', endpoint, self.session.delete)
+
+    def _send(self, method, endpoint, send, **kwargs):
+        """
+        Sends a request in a trace span and records its latency, errors and, for writes, the kind of change in the metrics.
+        """
         url = f"{self.base_url}{endpoint}"
-        response = self.session.delete(url, auth=self.auth)
-        response.raise_for_status()
-        return response.json()
+        label = metrics.endpoint_label(endpoint)
+        write = method != 'GET'
+        if write and not self.breaker.allow_write():
+            metrics.OPNSENSE_REQUEST_ERRORS.labels(method, label, CircuitOpenError.__name__).inc()
+            raise CircuitOpenError(f"Writes to OPNsense {self.breaker.name} are paused while it is unhealthy")
+
+        self.concurrency.acquire()
+        start = time.monotonic()
+        response = result = None
+        healthy = True
+        try:
+            with tracing.span('opnsense.request', **{'http.method': method, 'opnsense.endpoint': label}) as span:
+                if self.target:
+                    span.set_attribute('opnsense.target', self.target)
+                response = send(url, auth=self.auth, **kwargs)
+                span.set_attribute('http.status_code', response.status_code)
+                response.raise_for_status()
+                result = response.json()
+        except requests.exceptions.HTTPError as e:
+            status = getattr(e.response, 'status_code', None)
+            metrics.OPNSENSE_REQUEST_ERRORS.labels(method, label, str(status or type(e).__name__)).inc()
+            healthy = _healthy(e)
+            raise
+        except Exception as e:
+            metrics.OPNSENSE_REQUEST_ERRORS.labels(method, label, type(e).__name__).inc()
+            healthy = _healthy(e)
+            raise
+        finally:
+            duration = time.monotonic() - start
+            self.concurrency.release(healthy, None if is_service_command(label) else duration)
+            self.breaker.record(healthy, write)
+            metrics.OPNSENSE_REQUEST_DURATION.labels(method, label).observe(duration)
+            recording.record_opnsense(method, endpoint, kwargs.get('json'), getattr(response, 'status_code', None), result, duration)
+
+        if method != 'GET':
+            metrics.record_opnsense_change(endpoint)
+        return result
+
+    def change_token(self, max_age=1.0):
+        """
+        Returns a token that changes whenever the OPNsense configuration is saved, based on the
+        config backup history. Calls within max_age seconds share a single API request, so the
+        plugins triggered by one event cost one call. Returns None if the token is unavailable.
+
+        Args:
+            max_age (float): How old, in seconds, a cached token may be. Use 0 to force a refresh.
+
+        Returns:
+            str: The change token, or None.
+        """
+        with self._change_token_lock:
+            now = time.monotonic()
+            if self._change_token_at is not None and now - self._change_token_at < max_age:
+                return self._change_token
+            try:
+                response = self.get('/api/core/backup/backups/this')
+                self._change_token = hashlib.sha1(json.dumps(response, sort_keys=True).encode()).hexdigest()
+            except Exception:
+                self._change_token = None
+            self._change_token_at = now
+            return self._change_token
+
+def _flow_control_from_env():
+    return {
+        'max_concurrency': int(os.getenv("OPNSENSE_MAX_CONCURRENCY", "16")),
+        'breaker_threshold': int(os.getenv("OPNSENSE_BREAKER_THRESHOLD", "5")),
+        'breaker_cooldown': float(os.getenv("OPNSENSE_BREAKER_COOLDOWN", "30")),
+    }
 
 def from_env():
     """
@@ -91,4 +177,26 @@ def from_env():
     if not all([base_url, api_key, api_secret]):
         raise ValueError("OPNSENSE_URL, OPNSENSE_API_KEY, and OPNSENSE_API_SECRET must be set")
 
-    return OpnSenseClient(base_url, api_key, api_secret)
+    return OpnSenseClient(base_url, api_key, api_secret, **_flow_control_from_env())
+
+def targets_from_env():
+    """
+    Creates one OpnSenseClient per firewall named in OPNSENSE_TARGETS (comma-separated), configured through
+    OPNSENSE_<NAME>_URL, OPNSENSE_<NAME>_API_KEY and OPNSENSE_<NAME>_API_SECRET with NAME upper-cased and
+    dashes replaced by underscores. Keys and secrets default to OPNSENSE_API_KEY and OPNSENSE_API_SECRET.
+    Without OPNSENSE_TARGETS, returns the single client created by from_env().
+    """
+    names = [name.strip() for name in os.getenv("OPNSENSE_TARGETS", "").split(",") if name.strip()]
+    if not names:
+        return [from_env()]
+
+    clients = []
+    for name in names:
+        prefix = f"OPNSENSE_{name.upper().replace('-', '_')}_"
+        base_url = os.getenv(f"{prefix}URL")
+        api_key = os.getenv(f"{prefix}API_KEY") or os.getenv("OPNSENSE_API_KEY")
+        api_secret = os.getenv(f"{prefix}API_SECRET") or os.getenv("OPNSENSE_API_SECRET")
+        if not all([base_url, api_key, api_secret]):
+            raise ValueError(f"{prefix}URL and an API key and secret must be set for OPNsense target '{name}'")
+        clients.append(OpnSenseClient(base_url, api_key, api_secret, target=name, **_flow_control_from_env()))
+    return clients
@@ -0,0 +1,136 @@
+import functools
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from kubernetes.client import ApiException
+from src import metrics
+
+# Request priorities, lowest value first: opening a watch keeps events flowing, single-object requests
+# serve a reconcile in progress, and full lists are the most expensive for the API server
+WATCH, REQUEST, LIST = 0, 1, 2
+PRIORITY_NAMES = {WATCH: 'watch', REQUEST: 'request', LIST: 'list'}
+
+DEFAULT_QPS = 20
+DEFAULT_BURST = 40
+# Seconds to hold back all requests after a 429 response without a Retry-After header
+DEFAULT_RETRY_AFTER = 1
+
+class PriorityTokenBucket:
+    """
+    A token bucket shared by all Kubernetes API requests of the controller: up to burst requests at once,
+    refilled at qps per second. Waiting requests are served by priority, then in arrival order.
+    """
+    def __init__(self, qps, burst):
+        self.qps = qps
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0
+        # Heap of (priority, arrival) of the waiting requests
+        self._waiting = []
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.qps)
+        self._refilled_at = now
+
+    def acquire(self, priority=REQUEST):
+        """
+        Blocks until a request of the given priority may be sent. Returns the seconds it waited.
+        """
+        started = time.monotonic()
+        ticket = (priority, next(self._arrivals))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            waited = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiting[0] != ticket:
+                        # Woken when the request ahead is sent
+                        self._cond.wait()
+                    elif now < self._paused_until:
+                        self._cond.wait(self._paused_until - now)
+                    elif self._tokens < 1:
+                        self._cond.wait((1 - self._tokens) / self.qps)
+                    else:
+                        self._tokens -= 1
+                        return now - started if waited else 0
+                    waited = True
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def pause(self, seconds):
+        """
+        Holds back every request for the given seconds, e.g. when the API server asks to retry later.
+        """
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._cond.notify_all()
+
+def _retry_after(e):
+    try:
+        return float((e.headers or {}).get('Retry-After', DEFAULT_RETRY_AFTER))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+class RateLimitedApi:
+    """
+    Wraps a Kubernetes API client so its requests take tokens from a shared PriorityTokenBucket.
+    Calls with watch=True are watches, list_* calls lists, and everything else single requests.
+    A 429 response pauses all requests for its Retry-After, so an overloaded API server gets room
+    to recover instead of more retries.
+    """
+    def __init__(self, api, limiter):
+        self.api = api
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        # Keeps the signature and docstring, from which watch.Watch reads the type of the watched objects
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            priority = WATCH if kwargs.get('watch') else LIST if name.startswith('list_') else REQUEST
+            waited = self.limiter.acquire(priority)
+            metrics.KUBERNETES_REQUESTS.labels(PRIORITY_NAMES[priority]).inc()
+            if waited:
+                metrics.KUBERNETES_THROTTLED.labels(PRIORITY_NAMES[priority]).inc(waited)
+            try:
+                return attr(*args, **kwargs)
+            except ApiException as e:
+                if e.status == 429:
+                    retry_after = _retry_after(e)
+                    logging.error(f"Kubernetes API server is throttling requests, holding back for {retry_after}s.")
+                    self.limiter.pause(retry_after)
+                raise
+        return call
+
+def limiter_from_env():
+    """
+    Creates the bucket for the requests to one API server from CONTROLLER_KUBE_QPS and CONTROLLER_KUBE_BURST.
+    Returns None when CONTROLLER_KUBE_QPS is 0.
+    """
+    qps = float(os.getenv('CONTROLLER_KUBE_QPS', DEFAULT_QPS))
+    if qps <= 0:
+        return None
+    return PriorityTokenBucket(qps, int(os.getenv('CONTROLLER_KUBE_BURST', DEFAULT_BURST)))
+
+def limit(*apis):
+    """
+    Wraps the API clients of one API server so they share a single bucket configured from the environment.
+    """
+    limiter = limiter_from_env()
+    if limiter is None:
+        return apis
+    return tuple(RateLimitedApi(api, limiter) for api in apis)
@@ -0,0 +1,81 @@
+import functools
+import threading
+import time
+from collections import Counter
+
+# Resource type of the list calls whose results are shared, as named by the watch layer
+_RESOURCE_TYPES = {
+    'list_node': 'node',
+    'list_service_for_all_namespaces': 'service',
+    'list_ingress_for_all_namespaces': 'ingress',
+    'list_config_map_for_all_namespaces': 'config_map',
+}
+
+# Seconds a result may be reused without a watch event, in case a watch missed one while reconnecting
+DEFAULT_MAX_AGE = 30
+
+# Bumped on every watch event of a resource type, results listed under an older generation are stale
+_generations = Counter()
+_generations_lock = threading.Lock()
+
+def invalidate(resource_type):
+    """
+    Marks the shared list results of a resource type as stale. Called for every watch event before
+    the plugins it triggers are queued, so their runs never see a list older than the event.
+    """
+    with _generations_lock:
+        _generations[resource_type] += 1
+
+def _generation(resource_type):
+    with _generations_lock:
+        return _generations[resource_type]
+
+class SharedListApi:
+    """
+    Wraps a Kubernetes API client so the plugin instances reconciling the same objects against several
+    firewalls list them once. A list result is reused until a watch event for its resource type arrives
+    or it is max_age seconds old; identical concurrent calls wait for the one in flight. Every other
+    call is passed through to the wrapped client.
+    """
+    def __init__(self, api, max_age=DEFAULT_MAX_AGE, name=None):
+        self.api = api
+        # Names the cache in memory accounting, the wrapped client's class by default
+        self.name = name or type(api).__name__
+        self.max_age = max_age
+        # (method, args) -> (generation, listed at, result)
+        self._results = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if name not in _RESOURCE_TYPES:
+            return attr
+        return functools.partial(self._list, name, attr)
+
+    def _list(self, name, list_func, *args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            generation = _generation(_RESOURCE_TYPES[name])
+            cached = self._results.get(key)
+            if cached is not None and cached[0] == generation and time.monotonic() - cached[1] < self.max_age:
+                self.hits += 1
+                return cached[2]
+
+            # Timed from before the request, an event arriving meanwhile bumps the generation anyway
+            listed_at = time.monotonic()
+            result = list_func(*args, **kwargs)
+            self._results[key] = (generation, listed_at, result)
+            self.misses += 1
+            return result
+
+    def caches(self):
+        """
+        The shared list results by call, for memory accounting.
+        """
+        return {f"shared-lists/{self.name}": {f"{name}{args}{kwargs}": result for (name, args, kwargs), (_, _, result) in self._results.items()}}
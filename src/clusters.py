@@ -0,0 +1,102 @@
+import functools
+import logging
+import os
+import threading
+from collections import namedtuple
+from kubernetes import client, config
+from src.clients import rate_limit
+
+# Set on objects listed from a remote cluster, naming the cluster (its kubeconfig context)
+CLUSTER_ANNOTATION = 'opnsense.org/cluster'
+
+# The list calls merged across clusters, by the resource type the watch layer names them
+_LIST_CALLS = {
+    'service': ('core_v1', 'list_service_for_all_namespaces'),
+    'ingress': ('networking_v1', 'list_ingress_for_all_namespaces'),
+}
+
+RemoteCluster = namedtuple('RemoteCluster', ['name', 'core_v1', 'networking_v1'])
+
+def owner_ref(metadata):
+    """
+    namespace/name of an object for the descriptions of the OPNsense rows it owns, suffixed with
+    @<cluster> for objects of a remote cluster so equally named objects of two clusters stay apart.
+    """
+    cluster = (metadata.annotations or {}).get(CLUSTER_ANNOTATION)
+    return f"{metadata.namespace}/{metadata.name}@{cluster}" if cluster else f"{metadata.namespace}/{metadata.name}"
+
+class MultiClusterApi:
+    """
+    Serves the namespaced list calls of the plugins as the union of the objects of several clusters.
+    Objects of remote clusters are annotated with their cluster's name. When a remote cluster cannot be
+    listed, its last successful result is used so its objects are not mistaken for deleted ones.
+    Every other call goes to the home cluster.
+    """
+    def __init__(self, home_api, remote_apis):
+        self.home_api = home_api
+        # [(cluster name, API client)]
+        self.remote_apis = remote_apis
+        self._last_listed = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if not any(name == list_call for _, list_call in _LIST_CALLS.values()):
+            return getattr(self.home_api, name)
+        return functools.partial(self._list, name)
+
+    def _list(self, name, *args, **kwargs):
+        result = getattr(self.home_api, name)(*args, **kwargs)
+        items = list(result.items)
+        for cluster, api in self.remote_apis:
+            key = (cluster, name, args, tuple(sorted(kwargs.items())))
+            try:
+                remote_items = getattr(api, name)(*args, **kwargs).items
+            except Exception as e:
+                with self._lock:
+                    remote_items = self._last_listed.get(key)
+                if remote_items is None:
+                    raise
+                logging.error(f"Error listing {name} in cluster {cluster}, using its last listed objects: {e}")
+            else:
+                for obj in remote_items:
+                    obj.metadata.annotations = {**(obj.metadata.annotations or {}), CLUSTER_ANNOTATION: cluster}
+                with self._lock:
+                    self._last_listed[key] = remote_items
+            items.extend(remote_items)
+        return type(result)(items=items)
+
+class ClusterSet:
+    """
+    The remote clusters whose Services and Ingresses are reconciled together with the home cluster's.
+    """
+    def __init__(self, home_core_v1, home_networking_v1, remotes):
+        self.remotes = remotes
+        self.core_v1 = MultiClusterApi(home_core_v1, [(r.name, r.core_v1) for r in remotes])
+        self.networking_v1 = MultiClusterApi(home_networking_v1, [(r.name, r.networking_v1) for r in remotes])
+
+    def watch_sources(self, resource_type):
+        """
+        Returns (cluster name, list function) of every remote cluster to watch for a resource type.
+        """
+        if resource_type not in _LIST_CALLS:
+            return []
+        api_name, list_call = _LIST_CALLS[resource_type]
+        return [(remote.name, getattr(getattr(remote, api_name), list_call)) for remote in self.remotes]
+
+def from_env(home_core_v1, home_networking_v1):
+    """
+    Creates the ClusterSet of the kubeconfig contexts listed in CONTROLLER_CLUSTERS, read from
+    CONTROLLER_CLUSTERS_KUBECONFIG (default: the usual kubeconfig). Returns None when not set.
+    """
+    contexts = [context.strip() for context in os.getenv('CONTROLLER_CLUSTERS', '').split(',') if context.strip()]
+    if not contexts:
+        return None
+
+    kubeconfig = os.getenv('CONTROLLER_CLUSTERS_KUBECONFIG')
+    remotes = []
+    for context in contexts:
+        api_client = config.new_client_from_config(config_file=kubeconfig, context=context)
+        # Each API server gets its own rate limit
+        remotes.append(RemoteCluster(context, *rate_limit.limit(client.CoreV1Api(api_client), client.NetworkingV1Api(api_client))))
+    logging.info(f"Aggregating Services and Ingresses of clusters {', '.join(contexts)}.")
+    return ClusterSet(home_core_v1, home_networking_v1, remotes)
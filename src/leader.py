@@ -0,0 +1,165 @@
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from kubernetes import client
+
+# Defaults of client-go's leader election
+DEFAULT_LEASE_DURATION = 15
+DEFAULT_RENEW_DEADLINE = 10
+DEFAULT_RETRY_PERIOD = 2
+
+class LeaderElector:
+    """
+    Lease-based leader election, following client-go's leaderelection package.
+
+    Every replica tries to acquire or renew a coordination.k8s.io/v1 Lease every retry_period.
+    Another replica's lease counts as expired when its record has not changed for lease_duration
+    seconds, measured on the local monotonic clock so clock skew between nodes does not matter.
+    A leader that fails to renew within renew_deadline steps down before its lease can expire.
+    """
+    def __init__(self, k8s_coordination_v1_api, namespace, name, identity,
+                 lease_duration=DEFAULT_LEASE_DURATION, renew_deadline=DEFAULT_RENEW_DEADLINE, retry_period=DEFAULT_RETRY_PERIOD,
+                 on_started_leading=None, on_stopped_leading=None):
+        self.k8s_coordination_v1_api = k8s_coordination_v1_api
+        self.namespace = namespace
+        self.name = name
+        self.identity = identity
+        self.lease_duration = lease_duration
+        self.renew_deadline = renew_deadline
+        self.retry_period = retry_period
+        self.on_started_leading = on_started_leading
+        self.on_stopped_leading = on_stopped_leading
+        self._leader = threading.Event()
+        self._last_renewed = None
+        # (holder, renew time) of the lease as last read, and when it was first seen
+        self._observed_record = None
+        self._observed_at = None
+
+    def is_leader(self):
+        return self._leader.is_set()
+
+    def wait_for_leadership(self, timeout=None):
+        return self._leader.wait(timeout)
+
+    def run(self, stop_event):
+        """
+        Campaigns for and renews the lease until stop_event is set, then releases it if held.
+        """
+        logging.info(f"Starting leader election for lease {self.namespace}/{self.name} as {self.identity}.")
+        while not stop_event.is_set():
+            self.step()
+            stop_event.wait(self.retry_period)
+        self.release()
+
+    def step(self):
+        """
+        Makes one attempt to acquire or renew the lease and updates the leadership state.
+        """
+        try:
+            renewed = self._try_acquire_or_renew()
+        except Exception as e:
+            logging.error(f"Error updating lease {self.namespace}/{self.name}: {e}")
+            renewed = False
+
+        now = time.monotonic()
+        if renewed:
+            self._last_renewed = now
+            if not self.is_leader():
+                logging.info(f"Acquired lease {self.namespace}/{self.name}, this replica ({self.identity}) is now the leader.")
+                self._leader.set()
+                if self.on_started_leading:
+                    self.on_started_leading()
+        elif self.is_leader() and now - self._last_renewed > self.renew_deadline:
+            logging.error(f"Could not renew lease {self.namespace}/{self.name} within {self.renew_deadline}s, stepping down to standby.")
+            self._leader.clear()
+            if self.on_stopped_leading:
+                self.on_stopped_leading()
+
+    def release(self):
+        """
+        Gives up the lease so a standby can take over without waiting for it to expire.
+        """
+        if not self.is_leader():
+            return
+        self._leader.clear()
+        try:
+            lease = self.k8s_coordination_v1_api.read_namespaced_lease(self.name, self.namespace)
+            if lease.spec.holder_identity == self.identity:
+                lease.spec.holder_identity = None
+                lease.spec.lease_duration_seconds = 1
+                lease.spec.renew_time = _now()
+                self.k8s_coordination_v1_api.replace_namespaced_lease(self.name, self.namespace, lease)
+                logging.info(f"Released lease {self.namespace}/{self.name}.")
+        except Exception as e:
+            logging.error(f"Error releasing lease {self.namespace}/{self.name}: {e}")
+
+    def _try_acquire_or_renew(self):
+        now = _now()
+        try:
+            lease = self.k8s_coordination_v1_api.read_namespaced_lease(self.name, self.namespace)
+        except client.ApiException as e:
+            if e.status != 404:
+                raise
+            lease = client.V1Lease(
+                metadata=client.V1ObjectMeta(name=self.name, namespace=self.namespace),
+                spec=client.V1LeaseSpec(holder_identity=self.identity, lease_duration_seconds=self.lease_duration,
+                                        acquire_time=now, renew_time=now, lease_transitions=0),
+            )
+            return self._write(lambda: self.k8s_coordination_v1_api.create_namespaced_lease(self.namespace, lease))
+
+        spec = lease.spec
+        record = (spec.holder_identity, spec.renew_time)
+        if record != self._observed_record:
+            self._observed_record = record
+            self._observed_at = time.monotonic()
+
+        if spec.holder_identity and spec.holder_identity != self.identity:
+            duration = spec.lease_duration_seconds or self.lease_duration
+            if time.monotonic() - self._observed_at < duration:
+                return False
+            logging.info(f"Lease {self.namespace}/{self.name} held by {spec.holder_identity} expired, taking over.")
+
+        if spec.holder_identity != self.identity:
+            spec.acquire_time = now
+            spec.lease_transitions = (spec.lease_transitions or 0) + 1
+        spec.holder_identity = self.identity
+        spec.lease_duration_seconds = self.lease_duration
+        spec.renew_time = now
+        # The read resourceVersion makes this a compare-and-swap, a concurrent update fails with 409
+        return self._write(lambda: self.k8s_coordination_v1_api.replace_namespaced_lease(self.name, self.namespace, lease))
+
+    def _write(self, write):
+        try:
+            written = write()
+        except client.ApiException as e:
+            if e.status == 409:
+                return False
+            raise
+        self._observed_record = (written.spec.holder_identity, written.spec.renew_time)
+        self._observed_at = time.monotonic()
+        return True
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def from_env(k8s_coordination_v1_api, on_started_leading=None, on_stopped_leading=None):
+    """
+    Creates a LeaderElector when CONTROLLER_LEADER_ELECTION is true. Returns None otherwise,
+    in which case the replica always reconciles.
+    """
+    if os.getenv('CONTROLLER_LEADER_ELECTION', 'false').lower() not in ('1', 'true', 'yes'):
+        return None
+    namespace = os.getenv('CONTROLLER_NAMESPACE', 'kube-system')
+    name = os.getenv('CONTROLLER_LEASE_NAME', 'kubernetes-opnsense-controller')
+    identity = os.getenv('POD_NAME') or socket.gethostname()
+    return LeaderElector(
+        k8s_coordination_v1_api, namespace, name, identity,
+        lease_duration=int(os.getenv('CONTROLLER_LEASE_DURATION', DEFAULT_LEASE_DURATION)),
+        renew_deadline=float(os.getenv('CONTROLLER_LEASE_RENEW_DEADLINE', DEFAULT_RENEW_DEADLINE)),
+        retry_period=float(os.getenv('CONTROLLER_LEASE_RETRY_PERIOD', DEFAULT_RETRY_PERIOD)),
+        on_started_leading=on_started_leading,
+        on_stopped_leading=on_stopped_leading,
+    )
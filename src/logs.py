@@ -0,0 +1,158 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(trace_id)s - %(message)s'
+# Records waiting for the writer thread; beyond this, records are dropped rather than blocking the caller
+MAX_QUEUED_RECORDS = 10000
+# Seconds a repeated warning stays quiet after it was logged
+DEFAULT_REPEAT_INTERVAL = 300
+
+_listener = None
+_handler = None
+# Attributes every record has; anything else was passed with extra= and becomes a JSON field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'trace_id'}
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single-line JSON object, for log pipelines that index fields.
+    """
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        trace_id = getattr(record, 'trace_id', '-')
+        if trace_id != '-':
+            entry['trace_id'] = trace_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry.setdefault(key, value)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread as they are, so formatting happens there too. Drops records
+    instead of waiting when the queue is full.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener runs in this process, the record needs no flattening to be picklable
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class RepeatLimiter:
+    """
+    Tells whether a repeating message is due to be logged again: once per interval for each key.
+    """
+    def __init__(self, interval=DEFAULT_REPEAT_INTERVAL, max_keys=10000):
+        self.interval = interval
+        self.max_keys = max_keys
+        # key -> [logged at, repeats suppressed since]
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """
+        Returns the number of repeats suppressed since the key was last logged if it is due, else None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                return None
+            if entry is None and len(self._seen) >= self.max_keys:
+                self._seen = {k: e for k, e in self._seen.items() if now - e[0] < self.interval}
+                if len(self._seen) >= self.max_keys:
+                    self._seen.clear()
+            self._seen[key] = [now, 0]
+            return entry[1] if entry is not None else 0
+
+_repeats = RepeatLimiter()
+
+def warning(message, key=None):
+    """
+    Logs a warning that would otherwise repeat on every reconcile, such as a Service without an
+    external IP, at most once per repeat interval per message (or per key, if given).
+    """
+    suppressed = _repeats.check(key or message)
+    if suppressed is None:
+        logging.debug(message)
+    elif suppressed:
+        logging.warning(f"{message} (repeated {suppressed} times since last logged)")
+    else:
+        logging.warning(message)
+
+class ActionCounts(Counter):
+    """
+    Counts the changes of a reconcile pass by action, logged as one summary line instead of one per item.
+    """
+    def __str__(self):
+        return ', '.join(f"{count} {action}" for action, count in self.items() if count) or 'no changes'
+
+def configure_from_env():
+    """
+    Configures the root logger. CONTROLLER_LOG_FORMAT selects 'text' (default) or 'json' output,
+    CONTROLLER_LOG_LEVEL the level (default INFO) and CONTROLLER_LOG_REPEAT_INTERVAL the seconds between
+    repeats of the same warning. Records are written to stderr by a background thread, so logging calls
+    never wait on the stream.
+    """
+    global _listener, _handler
+    close()
+
+    log_format = os.getenv('CONTROLLER_LOG_FORMAT', 'text').lower()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.Queue(MAX_QUEUED_RECORDS)
+    _handler = _NonBlockingQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    level = os.getenv('CONTROLLER_LOG_LEVEL', 'INFO').upper()
+    try:
+        root.setLevel(level)
+    except ValueError:
+        root.setLevel(logging.INFO)
+        logging.error(f"Unknown CONTROLLER_LOG_LEVEL '{level}', using INFO.")
+    _repeats.interval = float(os.getenv('CONTROLLER_LOG_REPEAT_INTERVAL', DEFAULT_REPEAT_INTERVAL))
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+def dropped():
+    """
+    Returns the number of records dropped because the writer thread fell behind.
+    """
+    return _handler.dropped if _handler else 0
+
+def close():
+    """
+    Writes out the queued records and stops the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(close)
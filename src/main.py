@@ -1,40 +1,54 @@
 import os
+import heapq
+import itertools
 import logging
+import random
+import signal
 import yaml
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from kubernetes import client, config, watch
-from src.clients.opnsense import from_env as opnsense_from_env
-from src.plugins.metallb import MetalLBPlugin
-from src.plugins.haproxy_declarative import HAProxyDeclarativePlugin
-from src.plugins.haproxy_ingress_proxy import HAProxyIngressProxyPlugin
-from src.plugins.dns_services import DNSServicesPlugin
-from src.plugins.dns_ingresses import DNSIngressesPlugin
-from src.plugins.dns_haproxy_ingress_proxy import DNSHAProxyIngressProxyPlugin
+from src import logs, metrics, profiling, recording, sharding, tracing
+from src.clients import rate_limit, shared_lists
+from src.clients.opnsense import targets_from_env as opnsense_targets_from_env
+from src.clusters import from_env as clusters_from_env
+from src.leader import from_env as leader_from_env
+from src.registry import from_env as registry_from_env
+from src.reload import PluginReloader
+from src.startup import StartupTimer
+from src.workqueue import EventStamp, WorkQueue
+from src.plugins import CATALOG as PLUGIN_CATALOG
 from .version import __version__ 
 
 # --- Configuration ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 load_dotenv()
+tracing.install_log_context()
+logs.configure_from_env()
+
+# Per-plugin defaults, overridable with 'resyncInterval' (seconds, 0 disables) and 'resyncJitter' (fraction)
+DEFAULT_RESYNC_INTERVAL = 600
+DEFAULT_RESYNC_JITTER = 0.1
+# Seconds between checks of the resync scheduler for plugins added or retired by a configuration reload
+RESYNC_SCHEDULE_REFRESH = 5
+# Seconds before a watch that failed with anything but an expired resourceVersion is restarted
+WATCH_RETRY_DELAY = 5
 
 # --- Helper Functions ---
+def controller_configmap():
+    return os.getenv('CONTROLLER_NAMESPACE', 'kube-system'), os.getenv('CONTROLLER_CONFIGMAP', 'kubernetes-opnsense-controller')
+
 def get_controller_config(k8s_core_v1_api):
     """
     Fetches and parses the controller's ConfigMap from the cluster.
     """
-    namespace = os.getenv('CONTROLLER_NAMESPACE', 'kube-system')
-    name = os.getenv('CONTROLLER_CONFIGMAP', 'kubernetes-opnsense-controller')
+    namespace, name = controller_configmap()
     logging.info(f"Attempting to load configuration from ConfigMap: {namespace}/{name}")
 
     try:
         cm = k8s_core_v1_api.read_namespaced_config_map(name, namespace)
-        config_yaml = cm.data.get('config')
-        if not config_yaml:
-            logging.error(f"ConfigMap '{name}' does not have a 'config' key.")
-            return None
-
-        return yaml.safe_load(config_yaml)
+        return parse_controller_config(cm)
 
     except client.ApiException as e:
         if e.status == 404:
@@ -42,25 +56,316 @@ def get_controller_config(k8s_core_v1_api):
         else:
             logging.error(f"Error reading ConfigMap: {e}")
         return None
+    except Exception as e:
+        logging.error(f"An unexpected error occurred while loading config: {e}")
+        return None
+
+def parse_controller_config(cm):
+    """
+    Parses the 'config' key of the controller's ConfigMap. Returns None if it is missing or invalid.
+    """
+    config_yaml = (cm.data or {}).get('config')
+    if not config_yaml:
+        logging.error(f"ConfigMap '{cm.metadata.name}' does not have a 'config' key.")
+        return None
+    try:
+        controller_config = yaml.safe_load(config_yaml)
     except yaml.YAMLError as e:
         logging.error(f"Error parsing ConfigMap YAML: {e}")
         return None
-    except Exception as e:
-        logging.error(f"An unexpected error occurred while loading config: {e}")
+    if not isinstance(controller_config, dict):
+        logging.error(f"ConfigMap '{cm.metadata.name}' does not hold a mapping of plugin sections.")
         return None
+    return controller_config
 
 # --- Watcher Threads ---
-def watch_resources(resource_func, plugins):
-    w = watch.Watch()
-    resource_type = resource_func._apis['list_node'].__name__.split('_')[1]
+def list_resource_version(list_func):
+    """
+    Returns the current resourceVersion of a list, or None if it cannot be read.
+    """
+    try:
+        return list_func(limit=1).metadata.resource_version
+    except Exception as e:
+        logging.error(f"Error reading the resourceVersion to start a watch from: {e}")
+        return None
+
+def list_resource_versions(list_funcs):
+    """
+    Reads the resourceVersion of every list concurrently, in the order given.
+    """
+    if not list_funcs:
+        return []
+    with ThreadPoolExecutor(max_workers=len(list_funcs)) as executor:
+        return list(executor.map(list_resource_version, list_funcs))
+
+def watch_resources(resource_type, resource_func, watch_map, queue, resource_version=None):
+    """
+    Queues the plugins watching a resource type on each of its events. Started from a resourceVersion,
+    the watch skips the ADDED events of the objects that already exist, which the initial reconciliation
+    covers anyway. When the resourceVersion has expired (410 Gone), the watch restarts from a fresh one
+    and queues every watching plugin, as events may have been missed meanwhile.
+    """
     logging.info(f"Starting to watch for {resource_type} events...")
-    for event in w.stream(resource_func):
-        logging.info(f"Event: {event['type']} on {resource_type}")
-        for plugin in plugins:
-            plugin.run()
+    while True:
+        w = watch.Watch()
+        stream_args = {'resource_version': resource_version} if resource_version else {}
+        try:
+            for event in w.stream(resource_func, **stream_args):
+                recording.record_event(resource_type, event['type'], event.get('raw_object'))
+                # Looked up per event, a configuration reload may have replaced the plugins watching this type
+                dispatch_event(resource_type, event['type'], event['object'].metadata, watch_map.get(resource_type, []), queue)
+            resource_version = w.resource_version
+        except client.ApiException as e:
+            if e.status != 410:
+                logging.error(f"Error watching {resource_type}, retrying in {WATCH_RETRY_DELAY}s: {e}")
+                resource_version = w.resource_version
+                time.sleep(WATCH_RETRY_DELAY)
+                continue
+            logging.warning(f"Watch of {resource_type} expired at resourceVersion {w.resource_version}, relisting.")
+            resource_version = list_resource_version(resource_func)
+            resync_watchers(resource_type, watch_map, queue)
+        except Exception as e:
+            logging.error(f"Error watching {resource_type}, retrying in {WATCH_RETRY_DELAY}s: {e}")
+            resource_version = w.resource_version
+            time.sleep(WATCH_RETRY_DELAY)
+
+def resync_watchers(resource_type, watch_map, queue):
+    """
+    Queues a full run of every plugin watching the resource type, for when its watch may have missed events.
+    """
+    shared_lists.invalidate(resource_type)
+    for plugin in watch_map.get(resource_type, []):
+        queue.add(plugin)
+
+def watch_controller_config(k8s_core_v1_api, reloader):
+    """
+    Watches the controller's own ConfigMap and applies every valid change to the running plugins.
+    An invalid or deleted ConfigMap leaves the current configuration in effect. When the watch's
+    resourceVersion has expired (410 Gone), the ConfigMap is listed again, applied, and watched from there.
+    """
+    namespace, name = controller_configmap()
+    selector = {'field_selector': f"metadata.name={name}"}
+    logging.info(f"Watching ConfigMap {namespace}/{name} for configuration changes...")
+    resource_version = None
+    while True:
+        w = watch.Watch()
+        stream_args = {'resource_version': resource_version} if resource_version else {}
+        try:
+            for event in w.stream(k8s_core_v1_api.list_namespaced_config_map, namespace, **selector, **stream_args):
+                apply_controller_config_event(event['type'], event['object'], reloader)
+            resource_version = w.resource_version
+        except client.ApiException as e:
+            if e.status != 410:
+                logging.error(f"Error watching ConfigMap {namespace}/{name}, retrying in {WATCH_RETRY_DELAY}s: {e}")
+                resource_version = w.resource_version
+                time.sleep(WATCH_RETRY_DELAY)
+                continue
+            logging.warning(f"Watch of ConfigMap {namespace}/{name} expired at resourceVersion {w.resource_version}, relisting.")
+            try:
+                cms = k8s_core_v1_api.list_namespaced_config_map(namespace, **selector)
+            except Exception as e:
+                # Without a resourceVersion the watch starts with the current ConfigMap anyway
+                logging.error(f"Error listing ConfigMap {namespace}/{name}: {e}")
+                resource_version = None
+                continue
+            # Changes made while the watch was gone
+            for cm in cms.items:
+                apply_controller_config_event('ADDED', cm, reloader)
+            resource_version = cms.metadata.resource_version
+        except Exception as e:
+            logging.error(f"Error watching ConfigMap {namespace}/{name}, retrying in {WATCH_RETRY_DELAY}s: {e}")
+            resource_version = w.resource_version
+            time.sleep(WATCH_RETRY_DELAY)
+
+def apply_controller_config_event(event_type, cm, reloader):
+    """
+    Applies the configuration of one event on the controller's ConfigMap, if it is valid.
+    """
+    namespace, name = controller_configmap()
+    if event_type == 'DELETED':
+        logging.error(f"ConfigMap {namespace}/{name} was deleted, keeping the current configuration.")
+        return
+    controller_config = parse_controller_config(cm)
+    if controller_config is None:
+        logging.error(f"Ignoring invalid configuration in ConfigMap {namespace}/{name} (resourceVersion {cm.metadata.resource_version}).")
+        metrics.CONFIG_RELOADS.labels('invalid').inc()
+        return
+    try:
+        rebuilt, retuned, removed = reloader.apply(controller_config)
+    except Exception as e:
+        logging.error(f"Failed to apply the configuration from ConfigMap {namespace}/{name}: {e}")
+        metrics.CONFIG_RELOADS.labels('failed').inc()
+        return
+    metrics.CONFIG_RELOADS.labels('applied' if rebuilt or retuned or removed else 'unchanged').inc()
+
+def dispatch_event(resource_type, event_type, metadata, plugins, queue):
+    """
+    Queues a run of every plugin watching the resource type, stamped with the event.
+    """
+    stamp = EventStamp(resource_type, event_type, metadata.namespace, metadata.name, metadata.resource_version)
+    shared_lists.invalidate(resource_type)
+    logging.debug(f"Event: {event_type} on {resource_type} {metadata.namespace or ''}/{metadata.name} (resourceVersion {metadata.resource_version})")
+    metrics.WATCH_EVENTS.labels(resource_type, event_type).inc()
+    for plugin in plugins:
+        # Sharded plugins only react to the namespaces of their shard
+        shard = getattr(plugin, 'shard', None)
+        if shard is not None and not shard.owns(metadata.namespace):
+            continue
+        queue.add(plugin, stamp)
+
+def is_standby(plugin, elector):
+    """
+    Whether the plugin must hold off writing because another replica is the leader.
+    Sharded plugins never wait for leadership, every shard reconciles its own namespaces.
+    """
+    return elector is not None and getattr(plugin, 'shard', None) is None and not elector.is_leader()
+
+# --- Worker Threads ---
+def process_queue(queue, plugin_locks, elector=None):
+    """
+    Runs queued plugins. Events that arrive while a plugin is queued or running coalesce into one run.
+    While elector says this replica is a standby, plugins only warm their caches.
+    """
+    while True:
+        plugin = queue.get()
+        if plugin is None:
+            return
+        try:
+            lock = plugin_locks.get(plugin)
+            if lock is None:
+                # Retired by a configuration reload while queued
+                continue
+            if is_standby(plugin, elector):
+                # Standbys never write to OPNsense, they only keep what a leader can reuse up to date
+                warm = getattr(plugin, 'warm', None)
+                if warm:
+                    with lock, tracing.trace('warm', plugin=plugin.plugin_id):
+                        warm()
+                continue
+            stamps = queue.stamps(plugin)
+            breaker = getattr(getattr(plugin, 'opnsense_client', None), 'breaker', None)
+            if breaker is not None and breaker.is_open():
+                logging.info(f"Writes to OPNsense are paused, deferring {plugin.plugin_id} until it recovers.")
+                defer_until_writable(queue, plugin, stamps, breaker)
+                continue
+            with lock, metrics.RECONCILE_DURATION.labels(plugin.plugin_id).time(), \
+                    tracing.trace('reconcile', plugin=plugin.plugin_id, events=len(stamps)):
+                plugin.run(stamps)
+            if breaker is not None and breaker.state != breaker.CLOSED:
+                # Writes of this run may have been refused, run again once the firewall takes them
+                defer_until_writable(queue, plugin, stamps, breaker)
+        except Exception as e:
+            logging.error(f"Unhandled error running {plugin.plugin_id} plugin: {e}")
+            metrics.RECONCILE_ERRORS.labels(plugin.plugin_id).inc()
+        finally:
+            queue.done(plugin)
+
+def defer_until_writable(queue, plugin, stamps, breaker):
+    """
+    Queues a plugin again, with the events its run served, once its firewall's circuit breaker lets writes through.
+    """
+    def requeue():
+        for stamp in stamps or [None]:
+            queue.add(plugin, stamp)
+    breaker.when_writable(plugin, requeue)
+
+# --- Drift Detection ---
+def next_resync_delay(plugin):
+    interval = plugin.config.get('resyncInterval', DEFAULT_RESYNC_INTERVAL)
+    jitter = plugin.config.get('resyncJitter', DEFAULT_RESYNC_JITTER)
+    return interval * (1 + random.uniform(-jitter, jitter))
+
+def resync_scheduler(plugins, plugin_locks, queue, stop_event, elector=None):
+    """
+    Runs each plugin's cheap drift check on its own jittered interval and only enqueues
+    a full reconcile for the plugins whose managed OPNsense rows changed behind our back.
+    Standbys skip their checks. plugins is re-read every RESYNC_SCHEDULE_REFRESH seconds, so
+    plugins added by a configuration reload are scheduled and retired ones dropped.
+    """
+    schedule = []
+    scheduled = set()
+    order = itertools.count()
+
+    while True:
+        for plugin in list(plugins):
+            interval = plugin.config.get('resyncInterval', DEFAULT_RESYNC_INTERVAL)
+            if plugin in scheduled or not interval:
+                continue
+            scheduled.add(plugin)
+            # Spread the first checks over a whole interval so the plugins do not all fire at once
+            heapq.heappush(schedule, (time.monotonic() + random.uniform(0, interval), next(order), plugin))
+
+        wait = schedule[0][0] - time.monotonic() if schedule else RESYNC_SCHEDULE_REFRESH
+        if stop_event.wait(max(0, min(wait, RESYNC_SCHEDULE_REFRESH))):
+            return
+        if not schedule or schedule[0][0] > time.monotonic():
+            continue
+        next_at, i, plugin = heapq.heappop(schedule)
+        lock = plugin_locks.get(plugin)
+        # Retired, or its checks were disabled by a configuration reload
+        if lock is None or not plugin.config.get('resyncInterval', DEFAULT_RESYNC_INTERVAL):
+            scheduled.discard(plugin)
+            continue
+        if is_standby(plugin, elector):
+            heapq.heappush(schedule, (time.monotonic() + next_resync_delay(plugin), i, plugin))
+            continue
+
+        try:
+            with lock, tracing.trace('check_drift', plugin=plugin.plugin_id) as span:
+                drifted = plugin.check_drift()
+                span.set_attribute('drifted', drifted)
+        except Exception as e:
+            logging.error(f"Drift check failed for {plugin.plugin_id} plugin: {e}")
+            drifted = False
+        if drifted:
+            queue.add(plugin)
+
+        heapq.heappush(schedule, (time.monotonic() + next_resync_delay(plugin), i, plugin))
+
+# --- Plugin Loading ---
+def load_plugins(controller_config, k8s_core_v1, k8s_networking_v1, opnsense_client, registry=None, shard=None, cluster_scoped=True, clusters=None):
+    """
+    Creates the plugins enabled in the controller configuration. opnsense_client may also be a list of
+    clients with a target name each, every plugin then gets one instance per firewall.
+    With clusters, a ClusterSet, the Service and Ingress plugins reconcile the objects of all its clusters.
+    Namespaced plugins only reconcile the namespaces of shard, if given; cluster-scoped plugins
+    (MetalLB, HAProxy declarative) are left out unless cluster_scoped is true.
+    Returns the plugins and a map of resource type to the plugins watching it.
+    """
+    plugins = []
+    watch_map = {}
+
+    opnsense_clients = opnsense_client if isinstance(opnsense_client, list) else [opnsense_client]
+    apis = {'core_v1': k8s_core_v1, 'networking_v1': k8s_networking_v1}
+    # Node and ConfigMap based plugins always stay on the home cluster
+    namespaced_apis = {'core_v1': clusters.core_v1, 'networking_v1': clusters.networking_v1} if clusters else apis
+
+    for section, spec in PLUGIN_CATALOG.items():
+        config = controller_config.get(section, {})
+        if not config.get('enabled', False) or not (spec.namespaced or cluster_scoped):
+            continue
+        extra_args = {'shard': shard} if spec.namespaced else {}
+        if section == 'opnsense-dns-haproxy-ingress-proxy':
+            extra_args['haproxy_ingress_proxy_config'] = controller_config.get('haproxy-ingress-proxy', {})
+        # Imported here, so disabled plugins cost nothing at startup
+        plugin_class = spec.load()
+        k8s_api = (namespaced_apis if spec.namespaced else apis)[spec.api]
+
+        for target_client in opnsense_clients:
+            if len(opnsense_clients) > 1:
+                extra_args = {**extra_args, 'target': target_client.target}
+            p = plugin_class(k8s_api, target_client, config, registry=registry, **extra_args)
+            plugins.append(p)
+            for r_type in spec.resource_types:
+                if r_type not in watch_map:
+                    watch_map[r_type] = []
+                watch_map[r_type].append(p)
+
+    return plugins, watch_map
 
 # --- Initialization ---
 def main():
+    startup = StartupTimer()
     logging.info("Starting Kubernetes OPNsense Controller {__version__}")
 
     try:
@@ -68,58 +373,90 @@ def main():
     except config.ConfigException:
         config.load_kube_config()
 
-    k8s_core_v1 = client.CoreV1Api()
-    k8s_networking_v1 = client.NetworkingV1Api()
+    # The leader election's lease requests stay outside the rate limit, a delayed renewal would cost the lease
+    k8s_core_v1, k8s_networking_v1 = rate_limit.limit(client.CoreV1Api(), client.NetworkingV1Api())
 
     try:
-        opnsense_client = opnsense_from_env()
-        logging.info("OPNsense client initialized.")
+        opnsense_clients = opnsense_targets_from_env()
+        logging.info(f"OPNsense client initialized for {', '.join(c.target or c.base_url for c in opnsense_clients)}.")
     except ValueError as e:
         logging.error(f"Failed to initialize OPNsense client: {e}")
         return
+    startup.mark('clients')
 
     controller_config = get_controller_config(k8s_core_v1)
     if not controller_config:
         logging.error("Could not load controller configuration. Exiting.")
         return
+    startup.mark('config')
 
-    # --- Plugin Loading ---
-    plugins = []
-    watch_map = {}
+    # --- Sharding ---
+    try:
+        shard = sharding.from_env()
+    except ValueError as e:
+        logging.error(f"Invalid sharding configuration: {e}")
+        return
+
+    # --- Multi-Cluster ---
+    try:
+        clusters = clusters_from_env(k8s_core_v1, k8s_networking_v1)
+    except Exception as e:
+        logging.error(f"Failed to initialize the clients of the aggregated clusters: {e}")
+        return
 
-    def register_plugin(plugin_class, k8s_api, config, resource_types, extra_args=None):
-        if extra_args is None:
-            extra_args = {}
-        p = plugin_class(k8s_api, opnsense_client, config, **extra_args)
-        plugins.append(p)
-        for r_type in resource_types:
-            if r_type not in watch_map:
-                watch_map[r_type] = []
-            watch_map[r_type].append(p)
+    # --- Managed-Object Registry ---
+    registry = registry_from_env(k8s_core_v1, shard)
+    if registry:
+        registry.load()
+    startup.mark('registry')
 
-    if controller_config.get('metallb', {}).get('enabled', False):
-        register_plugin(MetalLBPlugin, k8s_core_v1, controller_config['metallb'], ['node'])
+    queue = WorkQueue()
+    stop_event = threading.Event()
 
-    if controller_config.get('haproxy-declarative', {}).get('enabled', False):
-        register_plugin(HAProxyDeclarativePlugin, k8s_core_v1, controller_config['haproxy-declarative'], ['config_map'])
+    # --- Leader Election ---
+    def on_started_leading():
+        # Pick up what the previous leader applied, then catch up on anything missed during the handover
+        if registry:
+            registry.load()
+        for plugin in plugins:
+            queue.add(plugin)
 
-    if controller_config.get('haproxy-ingress-proxy', {}).get('enabled', False):
-        register_plugin(HAProxyIngressProxyPlugin, k8s_networking_v1, controller_config['haproxy-ingress-proxy'], ['ingress'])
+    lost_leadership = threading.Event()
 
-    if controller_config.get('opnsense-dns-services', {}).get('enabled', False):
-        register_plugin(DNSServicesPlugin, k8s_core_v1, controller_config['opnsense-dns-services'], ['service'])
+    def on_stopped_leading():
+        # Like client-go, exit rather than risk a run that is still writing next to the new leader;
+        # the restarted replica comes back as a standby
+        logging.error("Lost leadership, shutting down so this replica restarts as a standby.")
+        lost_leadership.set()
 
-    if controller_config.get('opnsense-dns-ingresses', {}).get('enabled', False):
-        register_plugin(DNSIngressesPlugin, k8s_networking_v1, controller_config['opnsense-dns-ingresses'], ['ingress'])
+    elector = leader_from_env(client.CoordinationV1Api(), on_started_leading=on_started_leading, on_stopped_leading=on_stopped_leading)
 
-    if controller_config.get('opnsense-dns-haproxy-ingress-proxy', {}).get('enabled', False):
-        haproxy_ingress_config = controller_config.get('haproxy-ingress-proxy', {})
-        register_plugin(DNSHAProxyIngressProxyPlugin, k8s_networking_v1, controller_config['opnsense-dns-haproxy-ingress-proxy'], ['ingress'], extra_args={'haproxy_ingress_proxy_config': haproxy_ingress_config})
+    # --- Plugin Loading ---
+    # Without leader election, cluster-scoped plugins run on shard 0 only; with it, on whichever shard leads
+    cluster_scoped = shard is None or shard.index == 0 or elector is not None
+    # The plugins share their Kubernetes list results until a watch event invalidates them: the three ingress
+    # plugins list Ingresses once per change, and so do the instances of a plugin for several firewalls
+    plugin_core_v1, plugin_networking_v1 = shared_lists.SharedListApi(k8s_core_v1, name='core_v1'), shared_lists.SharedListApi(k8s_networking_v1, name='networking_v1')
+    profiling.track(plugin_core_v1, plugin_networking_v1)
+    if clusters:
+        clusters.core_v1 = shared_lists.SharedListApi(clusters.core_v1, name='clusters/core_v1')
+        clusters.networking_v1 = shared_lists.SharedListApi(clusters.networking_v1, name='clusters/networking_v1')
+        profiling.track(clusters.core_v1, clusters.networking_v1)
 
-    # --- Initial Reconciliation ---
-    logging.info("Performing initial reconciliation for all plugins...")
-    for plugin in plugins:
-        plugin.run()
+    def build_plugins(controller_config):
+        return load_plugins(controller_config, plugin_core_v1, plugin_networking_v1, opnsense_clients, registry, shard, cluster_scoped, clusters)
+
+    plugins, watch_map = build_plugins(controller_config)
+    plugin_locks = {p: threading.Lock() for p in plugins}
+    startup.mark('plugins')
+
+    metrics.track(queue=queue, plugins=plugins, registry=registry, elector=elector, opnsense_clients=opnsense_clients)
+    metrics.start_server()
+    tracing.configure_from_env()
+    recording.configure_from_env()
+    profiling.track(*plugins, registry)
+    profiling.start_debug_server()
+    profiling.install_signal_handler()
 
     # --- Main Controller Loop ---
     resource_map = {
@@ -129,22 +466,88 @@ def main():
         'service': k8s_core_v1.list_service_for_all_namespaces
     }
 
-    threads = []
-    for resource_type, plugin_list in watch_map.items():
-        if resource_type in resource_map:
-            thread = threading.Thread(target=watch_resources, args=(resource_map[resource_type], plugin_list))
-            threads.append(thread)
+    workers = []
+    watched = set()
+
+    def start_watches():
+        # One watch per resource type and cluster; only ever grows
+        new_sources = []
+        for resource_type in list(watch_map):
+            sources = [(None, resource_map[resource_type])] if resource_type in resource_map else []
+            if clusters:
+                sources += clusters.watch_sources(resource_type)
+            for cluster, list_func in sources:
+                if (cluster, resource_type) not in watched:
+                    watched.add((cluster, resource_type))
+                    new_sources.append((resource_type, list_func))
+        # A recording replays a cluster from the ADDED events of its existing objects, so it needs them
+        if recording.enabled():
+            resource_versions = [None] * len(new_sources)
+        else:
+            resource_versions = list_resource_versions([list_func for _, list_func in new_sources])
+        for (resource_type, list_func), resource_version in zip(new_sources, resource_versions):
+            threading.Thread(target=watch_resources, args=(resource_type, list_func, watch_map, queue, resource_version), daemon=True).start()
+
+    def start_workers():
+        # One worker per plugin; only ever grows
+        while len(workers) < len(plugins):
+            workers.append(threading.Thread(target=process_queue, args=(queue, plugin_locks, elector), daemon=True))
+            workers[-1].start()
+
+    def on_plugins_reloaded(added, removed):
+        metrics.track(plugins=plugins)
+        start_watches()
+        start_workers()
+
+    # --- Configuration Hot Reload ---
+    reloader = PluginReloader(controller_config, plugins, watch_map, plugin_locks, queue, build_plugins, on_reloaded=on_plugins_reloaded)
+
+    # Watches start from the lists' current resourceVersions before the initial run lists them, so no change is missed
+    start_watches()
+    startup.mark('watches')
+    startup.log("Watch-ready")
+
+    # --- Initial Reconciliation ---
+    logging.info("Queueing initial reconciliation for all plugins..." if elector is None else "Queueing cache warm-up for all plugins...")
+    for plugin in plugins:
+        queue.add(plugin)
+    start_workers()
+
+    def log_initial_run():
+        queue.wait_idle()
+        startup.mark('initial run' if elector is None else 'warm-up')
+        startup.log("Initial reconciliation finished" if elector is None else "Cache warm-up finished")
+
+    threads = [
+        threading.Thread(target=log_initial_run, daemon=True),
+        threading.Thread(target=resync_scheduler, args=(plugins, plugin_locks, queue, stop_event, elector), daemon=True),
+        threading.Thread(target=watch_controller_config, args=(k8s_core_v1, reloader), daemon=True),
+    ]
+    if elector:
+        threads.append(threading.Thread(target=elector.run, args=(stop_event,), daemon=True))
 
     for t in threads:
         t.start()
 
+    # Kubernetes stops pods with SIGTERM, shut down the same way as on Ctrl-C so the lease is released
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
     try:
-        while True:
-            time.sleep(60)
+        while not lost_leadership.wait(60):
+            pass
     except KeyboardInterrupt:
         logging.info("Shutting down controller...")
+    stop_event.set()
+    queue.shutdown()
+    if elector:
+        elector.release()
+    recording.close()
 
     logging.info("Controller shut down.")
+    if lost_leadership.is_set():
+        raise SystemExit(1)
 
 if __name__ == '__main__':
     main()
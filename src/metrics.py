@@ -0,0 +1,186 @@
+import logging
+import os
+from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from src import logs
+
+# --- Reconciliation ---
+RECONCILE_DURATION = Histogram(
+    'opnsense_controller_reconcile_duration_seconds',
+    'Duration of plugin reconcile runs, including runs that found nothing to change.',
+    ['plugin'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+RECONCILE_ERRORS = Counter(
+    'opnsense_controller_reconcile_errors_total',
+    'Plugin runs that raised an unhandled exception.',
+    ['plugin'],
+)
+
+# --- OPNsense API ---
+OPNSENSE_REQUEST_DURATION = Histogram(
+    'opnsense_controller_opnsense_request_duration_seconds',
+    'Latency of OPNsense API requests by method and endpoint (without object UUIDs).',
+    ['method', 'endpoint'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+OPNSENSE_REQUEST_ERRORS = Counter(
+    'opnsense_controller_opnsense_request_errors_total',
+    'Failed OPNsense API requests by method, endpoint and HTTP status (or the exception name).',
+    ['method', 'endpoint', 'error'],
+)
+OPNSENSE_CHANGES = Counter(
+    'opnsense_controller_opnsense_changes_total',
+    'Successful OPNsense writes by module and operation (add, update, delete, reconfigure).',
+    ['module', 'operation'],
+)
+
+# --- Kubernetes ---
+WATCH_EVENTS = Counter(
+    'opnsense_controller_watch_events_total',
+    'Kubernetes watch events received by resource type and event type.',
+    ['resource', 'type'],
+)
+KUBERNETES_REQUESTS = Counter(
+    'opnsense_controller_kubernetes_requests_total',
+    'Kubernetes API requests sent through the client-side rate limit, by priority (watch, request, list).',
+    ['priority'],
+)
+KUBERNETES_THROTTLED = Counter(
+    'opnsense_controller_kubernetes_throttled_seconds_total',
+    'Time Kubernetes API requests waited for the client-side rate limit, by priority.',
+    ['priority'],
+)
+
+CONFIG_RELOADS = Counter(
+    'opnsense_controller_config_reloads_total',
+    'Changes to the controller ConfigMap by result (applied, unchanged, invalid, failed).',
+    ['result'],
+)
+
+EVENT_TO_APPLY_DURATION = Histogram(
+    'opnsense_controller_event_to_apply_seconds',
+    'Time from receiving a Kubernetes watch event until the resulting OPNsense change was applied and the service reconfigured.',
+    ['resource', 'service'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+
+# OPNsense API commands that write, by command prefix
+_OPERATIONS = (
+    ('add', 'add'),
+    ('set', 'update'),
+    ('del', 'delete'),
+    ('reconfigure', 'reconfigure'),
+    ('reload', 'reconfigure'),
+)
+
+def endpoint_label(endpoint):
+    """
+    Reduces an endpoint to /api/<module>/<controller>/<command>, dropping UUIDs and other parameters
+    so the label keeps a bounded number of values.
+    """
+    return '/'.join(endpoint.split('?', 1)[0].split('/')[:5])
+
+def record_opnsense_change(endpoint):
+    """
+    Counts a successful write, classified by the OPNsense command it called.
+    """
+    parts = endpoint_label(endpoint).split('/')
+    if len(parts) < 5:
+        return
+    module, command = parts[2], parts[4]
+    for prefix, operation in _OPERATIONS:
+        if command.startswith(prefix):
+            OPNSENSE_CHANGES.labels(module, operation).inc()
+            return
+
+def observe_event_latency(service, events):
+    """
+    Records the event-to-apply latency of every event served by a successful apply, and logs it
+    with the oldest event, which bounds the latency of the whole batch.
+    """
+    if not events:
+        return
+    for event in events:
+        EVENT_TO_APPLY_DURATION.labels(event.resource_type, service).observe(event.age())
+
+    oldest = min(events, key=lambda e: e.received_at)
+    latency = oldest.age()
+    fields = {
+        'service': service,
+        'event_latency_seconds': round(latency, 3),
+        'events': len(events),
+        'resource_type': oldest.resource_type,
+        'event_type': oldest.event_type,
+        'object': f"{oldest.namespace}/{oldest.name}" if oldest.namespace else oldest.name,
+        'resource_version': oldest.resource_version,
+    }
+    logging.info(f"Applied {service} changes " + " ".join(f"{k}={v}" for k, v in fields.items()), extra=fields)
+
+class _StateCollector:
+    """
+    Reports values read at scrape time: work-queue depth and coalescing, and cache sizes.
+    """
+    def __init__(self):
+        self.queue = None
+        self.plugins = []
+        self.registry = None
+        self.elector = None
+        self.opnsense_clients = []
+
+    def collect(self):
+        yield GaugeMetricFamily('opnsense_controller_leader', 'Whether this replica reconciles (1) or is a standby (0).',
+                                value=1 if self.elector is None or self.elector.is_leader() else 0)
+        if self.queue is not None:
+            yield GaugeMetricFamily('opnsense_controller_queue_depth', 'Plugins waiting for a reconcile run.', value=len(self.queue))
+            yield CounterMetricFamily('opnsense_controller_queue_adds', 'Reconcile requests added to the work queue.', value=self.queue.adds)
+            yield CounterMetricFamily('opnsense_controller_queue_coalesced', 'Reconcile requests merged into one already pending.', value=self.queue.coalesced)
+
+        limits = GaugeMetricFamily('opnsense_controller_opnsense_concurrency_limit', 'Current adaptive cap of OPNsense requests in flight.', labels=['target'])
+        circuit = GaugeMetricFamily('opnsense_controller_opnsense_circuit_open', 'Whether writes to OPNsense are paused (1), probing (0.5) or flowing (0).', labels=['target'])
+        for opnsense_client in self.opnsense_clients:
+            target = opnsense_client.target or ''
+            limits.add_metric([target], int(opnsense_client.concurrency.limit))
+            circuit.add_metric([target], {'open': 1, 'half-open': 0.5}.get(opnsense_client.breaker.state, 0))
+        yield limits
+        yield circuit
+
+        yield CounterMetricFamily('opnsense_controller_log_records_dropped', 'Log records dropped because the log writer fell behind.', value=logs.dropped())
+
+        sizes = GaugeMetricFamily('opnsense_controller_cache_entries', 'Entries held in in-memory caches.', labels=['cache'])
+        for plugin in self.plugins:
+            caches = getattr(plugin, 'caches', None)
+            if caches:
+                for name, cache in caches().items():
+                    sizes.add_metric([f"{plugin.plugin_id}/{name}"], len(cache))
+        if self.registry is not None:
+            sizes.add_metric(['registry'], self.registry.object_count())
+        yield sizes
+
+_state = _StateCollector()
+REGISTRY.register(_state)
+
+def track(queue=None, plugins=None, registry=None, elector=None, opnsense_clients=None):
+    """
+    Registers the controller state reported at scrape time.
+    """
+    if queue is not None:
+        _state.queue = queue
+    if plugins is not None:
+        _state.plugins = list(plugins)
+    if registry is not None:
+        _state.registry = registry
+    if elector is not None:
+        _state.elector = elector
+    if opnsense_clients is not None:
+        _state.opnsense_clients = list(opnsense_clients)
+
+def start_server():
+    """
+    Serves /metrics on CONTROLLER_METRICS_PORT (default 8080). Set it to 0 to disable the endpoint.
+    """
+    port = int(os.getenv('CONTROLLER_METRICS_PORT', '8080'))
+    if not port:
+        return
+    start_http_server(port)
+    logging.info(f"Serving Prometheus metrics on port {port}.")
@@ -0,0 +1,27 @@
+import importlib
+
+class PluginSpec:
+    """
+    How the controller creates a plugin. The module is only imported once the plugin is enabled.
+    """
+    def __init__(self, module, class_name, api, resource_types, namespaced):
+        self.module = module
+        self.class_name = class_name
+        # 'core_v1' or 'networking_v1', the Kubernetes API the plugin reads
+        self.api = api
+        self.resource_types = resource_types
+        # Namespaced plugins can be sharded and aggregated across clusters
+        self.namespaced = namespaced
+
+    def load(self):
+        return getattr(importlib.import_module(self.module), self.class_name)
+
+# Plugins by configuration section, in the order they are created
+CATALOG = {
+    'metallb': PluginSpec('src.plugins.metallb', 'MetalLBPlugin', 'core_v1', ['node'], namespaced=False),
+    'haproxy-declarative': PluginSpec('src.plugins.haproxy_declarative', 'HAProxyDeclarativePlugin', 'core_v1', ['config_map'], namespaced=False),
+    'haproxy-ingress-proxy': PluginSpec('src.plugins.haproxy_ingress_proxy', 'HAProxyIngressProxyPlugin', 'networking_v1', ['ingress'], namespaced=True),
+    'opnsense-dns-services': PluginSpec('src.plugins.dns_services', 'DNSServicesPlugin', 'core_v1', ['service'], namespaced=True),
+    'opnsense-dns-ingresses': PluginSpec('src.plugins.dns_ingresses', 'DNSIngressesPlugin', 'networking_v1', ['ingress'], namespaced=True),
+    'opnsense-dns-haproxy-ingress-proxy': PluginSpec('src.plugins.dns_haproxy_ingress_proxy', 'DNSHAProxyIngressProxyPlugin', 'networking_v1', ['ingress'], namespaced=True),
+}
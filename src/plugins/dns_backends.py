@@ -0,0 +1,377 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from src import logs, metrics, tracing
+from src.clients import bulk
+from src.registry import fingerprint
+
+class DNSBackend:
+    """
+    Base class for an OPNsense DNS service the DNS plugins publish records to.
+
+    Records come in two kinds, both keyed by FQDN:
+      - 'host_override': {'host', 'domain', 'ip', 'description'}
+      - 'host_alias': {'host', 'target', 'description'}, where target is the FQDN of an existing host
+    """
+    name = None
+    # kind -> table settings, see UnboundBackend for the keys
+    tables = {}
+    # Where the tables live in the service's settings model, for bulkWrites; None if not supported
+    bulk_model = None
+
+    def __init__(self, opnsense_client, config=None, shard=None):
+        self.opnsense_client = opnsense_client
+        self.config = config or {}
+        # Opt-in: apply all changes of a sync with one model save instead of one save per record
+        self.bulk_writes = self.config.get('bulkWrites', False)
+        # When sharding, only records of this shard's namespaces are owned
+        self.shard = shard
+        # kind -> hash of the owned records after the last successful sync, compared by check_drift()
+        self._managed_rows_hash = {}
+        # Set while written records still wait for a successful reconfigure
+        self._apply_pending = False
+
+    def sync(self, kind, desired, owner_prefix, events=None):
+        """
+        Diffs the desired records against this backend, applies the differences and reconfigures the service.
+        Only records whose description starts with owner_prefix are deleted. events are the EventStamps
+        of the watch events that triggered the sync, used to measure event-to-apply latency.
+        Returns True if anything changed, or None if the current records could not be fetched or the
+        service could not be reconfigured. A failed reconfigure is retried by the next sync.
+        """
+        self._managed_rows_hash.pop(kind, None)
+        with tracing.span('fetch_opnsense', backend=self.name, kind=kind) as span:
+            current = self.get_records(kind)
+            if current is None:
+                return None
+            span.set_attribute('count', len(current))
+
+        with tracing.span('reconcile', backend=self.name, kind=kind) as span:
+            changes_made = self.reconcile_records(kind, self.build_records(kind, desired, current), current, owner_prefix)
+            span.set_attribute('changed', changes_made)
+        if changes_made or self._apply_pending:
+            with tracing.span('apply', backend=self.name):
+                self._apply_pending = not self.apply_changes(events)
+            if self._apply_pending:
+                return None
+
+        # Baseline for drift checks, re-read when this sync's own writes changed the records
+        applied = self.get_records(kind) if changes_made else current
+        if applied is not None:
+            self._managed_rows_hash[kind] = self._hash_owned_records(kind, applied, owner_prefix)
+        return changes_made
+
+    def check_drift(self, kind, owner_prefix):
+        """
+        Checks whether the owned records of a kind changed since the last successful sync.
+        A backend that never synced successfully counts as drifted.
+        """
+        current = self.get_records(kind)
+        if current is None:
+            return False
+        return self._managed_rows_hash.get(kind) != self._hash_owned_records(kind, current, owner_prefix)
+
+    def owned_records(self, kind, current, owner_prefix):
+        """
+        Filters the current records of a kind down to the ones created by the controller, and by this replica's shard.
+        """
+        description_field = self.tables[kind].get('description', 'description')
+        return {k: v for k, v in current.items() if v.get(description_field, '').startswith(owner_prefix)
+                and (self.shard is None or self.shard.owns_description(v.get(description_field)))}
+
+    def _hash_owned_records(self, kind, current, owner_prefix):
+        return fingerprint(self.owned_records(kind, current, owner_prefix))
+
+    def get_records(self, kind):
+        """
+        Gets the current records of a kind, keyed by FQDN.
+        """
+        table = self.tables[kind]
+        try:
+            response = self.opnsense_client.get(table['search'])
+            existing = {}
+            for row in response.get('rows', []):
+                key = table['key'](row)
+                if key:
+                    existing[key] = row
+            return existing
+        except Exception as e:
+            logging.error(f"Error getting OPNsense {self.name} {kind}s: {e}")
+            return None
+
+    def build_records(self, kind, desired, current):
+        """
+        Converts the plugin's desired records into this backend's payloads.
+        """
+        return desired
+
+    def reconcile_records(self, kind, desired, current, owner_prefix):
+        table = self.tables[kind]
+        label = kind.replace('_', ' ')
+        changes = logs.ActionCounts()
+        writer = bulk.writer_for(self.opnsense_client, self.bulk_model, self.bulk_writes)
+
+        # Add/Update
+        for key, data in desired.items():
+            payload = {table['payload']: data}
+            if key in current:
+                if current[key].get(table['compare']) != data[table['compare']]:
+                    logging.debug(f"Updating {self.name} {label} for '{key}'")
+                    uuid = current[key]['uuid']
+                    writer.post(f"{table['set']}/{uuid}", payload)
+                    changes['updated'] += 1
+            else:
+                logging.debug(f"Adding new {self.name} {label} for '{key}'")
+                writer.post(table['add'], payload)
+                changes['added'] += 1
+
+        # Delete
+        orphaned = {k: v for k, v in self.owned_records(kind, current, owner_prefix).items() if k not in desired}
+        for key, item in orphaned.items():
+            logging.debug(f"Deleting orphaned {self.name} {label}: {key}")
+            uuid = item['uuid']
+            writer.post(f"{table['del']}/{uuid}")
+            changes['deleted'] += 1
+        bulk.flush(writer)
+
+        logging.info(f"Reconciled {self.name} {label}s: {changes}.")
+        return bool(changes)
+
+    def apply_changes(self, events=None):
+        """
+        Reconfigures the service. Returns True on success.
+        """
+        raise NotImplementedError
+
+class UnboundBackend(DNSBackend):
+    name = 'unbound'
+    tables = {
+        'host_override': {
+            'search': '/api/unbound/settings/search_host_override',
+            'add': '/api/unbound/settings/add_host_override',
+            'set': '/api/unbound/settings/set_host_override',
+            'del': '/api/unbound/settings/del_host_override',
+            'payload': 'host',
+            'key': lambda row: f"{row.get('host')}.{row.get('domain')}",
+            'compare': 'ip',
+        },
+        'host_alias': {
+            'search': '/api/unbound/settings/search_host_alias',
+            'add': '/api/unbound/settings/add_host_alias',
+            'set': '/api/unbound/settings/set_host_alias',
+            'del': '/api/unbound/settings/del_host_alias',
+            'payload': 'alias', # API payload structure is a guess
+            'key': lambda row: row.get('hostname'),
+            'compare': 'target',
+        },
+    }
+    bulk_model = bulk.BulkModel('/api/unbound/settings', 'unbound', {'host_override': ('hosts', 'host'), 'host_alias': ('aliases', 'alias')})
+
+    def __init__(self, opnsense_client, config=None, shard=None):
+        super().__init__(opnsense_client, config, shard)
+        # Opt-in: keep the resolver cache warm across reconfigures
+        self.preserve_cache = self.config.get('preserveCache', False)
+        # Cleared once the cache endpoints turn out to be missing, so we stop trying
+        self._cache_endpoints_available = True
+
+    def apply_changes(self, events=None):
+        """
+        Applies the Unbound DNS changes by calling the reconfigure endpoint.
+        With preserveCache, the resolver cache is dumped before and loaded back after the restart.
+        Host overrides are served from local data rather than the cache, so restored entries
+        never shadow the records that were just changed.
+        """
+        logging.info("Applying Unbound DNS configuration changes...")
+        cache = self._dump_cache() if self.preserve_cache and self._cache_endpoints_available else None
+
+        endpoint = '/api/unbound/service/reconfigure'
+        try:
+            self.opnsense_client.post(endpoint)
+        except Exception as e:
+            logging.error(f"Failed to apply Unbound DNS changes: {e}")
+            return False
+
+        if cache is not None:
+            self._load_cache(cache)
+        metrics.observe_event_latency(self.name, events)
+        return True
+
+    def _dump_cache(self):
+        endpoint = '/api/unbound/diagnostics/dumpcache'
+        try:
+            return self.opnsense_client.get(endpoint)
+        except Exception as e:
+            # Older OPNsense releases lack the endpoint, fall back to a plain reconfigure from now on
+            logging.warning(f"Could not dump Unbound cache, reconfiguring without cache preservation: {e}")
+            self._cache_endpoints_available = False
+            return None
+
+    def _load_cache(self, cache):
+        endpoint = '/api/unbound/diagnostics/loadcache'
+        try:
+            self.opnsense_client.post(endpoint, cache)
+            logging.info("Restored Unbound resolver cache.")
+        except Exception as e:
+            logging.warning(f"Could not restore Unbound cache, disabling cache preservation: {e}")
+            self._cache_endpoints_available = False
+
+class DnsmasqBackend(DNSBackend):
+    name = 'dnsmasq'
+    _hosts_table = {
+        'search': '/api/dnsmasq/settings/search_host',
+        'add': '/api/dnsmasq/settings/add_host',
+        'set': '/api/dnsmasq/settings/set_host',
+        'del': '/api/dnsmasq/settings/del_host',
+        'payload': 'host',
+        'key': lambda row: f"{row.get('host')}.{row.get('domain')}",
+        'compare': 'ip',
+        'description': 'descr',
+    }
+    # dnsmasq has no alias objects, aliases become host entries pointing at the target's address
+    tables = {'host_override': _hosts_table, 'host_alias': _hosts_table}
+    # Both kinds share the hosts table, alias entries are told apart by this description prefix
+    alias_marker = 'Alias: '
+
+    def owned_records(self, kind, current, owner_prefix):
+        if kind == 'host_alias':
+            owner_prefix = self.alias_marker + owner_prefix
+        return super().owned_records(kind, current, owner_prefix)
+
+    def reconcile_records(self, kind, desired, current, owner_prefix):
+        if kind == 'host_alias':
+            current = {k: v for k, v in current.items() if v.get('descr', '').startswith(self.alias_marker)}
+        else:
+            current = {k: v for k, v in current.items() if not v.get('descr', '').startswith(self.alias_marker)}
+        return super().reconcile_records(kind, desired, current, owner_prefix)
+
+    def build_records(self, kind, desired, current):
+        records = {}
+        for key, data in desired.items():
+            if kind == 'host_alias':
+                target = current.get(data['target'])
+                if not target:
+                    logs.warning(f"dnsmasq has no host entry for alias target '{data['target']}', skipping '{key}'.")
+                    continue
+                host, _, domain = data['host'].partition('.')
+                ip = target.get('ip')
+                description = self.alias_marker + data['description']
+            else:
+                host, domain, ip = data['host'], data['domain'], data['ip']
+                description = data['description']
+            records[key] = {'host': host, 'domain': domain, 'ip': ip, 'descr': description}
+        return records
+
+    def apply_changes(self, events=None):
+        """
+        Applies the dnsmasq changes by calling the reconfigure endpoint.
+        """
+        logging.info("Applying dnsmasq configuration changes...")
+        endpoint = '/api/dnsmasq/service/reconfigure'
+        try:
+            self.opnsense_client.post(endpoint)
+        except Exception as e:
+            logging.error(f"Failed to apply dnsmasq changes: {e}")
+            return False
+        metrics.observe_event_latency(self.name, events)
+        return True
+
+_BACKENDS = {
+    'unbound': UnboundBackend,
+    'dnsmasq': DnsmasqBackend,
+}
+
+def get_dns_backends(opnsense_client, config, shard=None):
+    """
+    Creates the DNS backends enabled under the plugin's 'dnsBackends' config.
+    Defaults to Unbound only when 'dnsBackends' is not configured. The plugin's 'bulkWrites'
+    applies to every backend that does not set its own.
+    """
+    defaults = {'bulkWrites': config['bulkWrites']} if 'bulkWrites' in config else {}
+    backends_config = config.get('dnsBackends')
+    if not backends_config:
+        return [UnboundBackend(opnsense_client, defaults or None, shard=shard)]
+
+    backends = []
+    for name, cls in _BACKENDS.items():
+        backend_config = backends_config.get(name) or {}
+        if backend_config.get('enabled', False):
+            backends.append(cls(opnsense_client, {**defaults, **backend_config}, shard))
+    return backends
+
+def sync_dns_backends(backends, kind, desired, owner_prefix, events=None):
+    """
+    Syncs the same desired records to every backend concurrently, so a slow reconfigure
+    on one service does not hold up the others. Returns True if every backend synced successfully.
+    """
+    def sync(backend):
+        try:
+            return backend.sync(kind, desired, owner_prefix, events) is not None
+        except Exception as e:
+            logging.error(f"Failed to sync {backend.name} {kind}s: {e}")
+            return False
+
+    if len(backends) <= 1:
+        return all([sync(backend) for backend in backends])
+
+    with ThreadPoolExecutor(max_workers=len(backends)) as executor:
+        return all(list(executor.map(tracing.propagate(sync), backends)))
+
+def check_dns_backends_drift(backends, kind, owner_prefix):
+    """
+    Returns True if the owned records drifted on any backend.
+    """
+    drifted = False
+    for backend in backends:
+        try:
+            if backend.check_drift(kind, owner_prefix):
+                logging.info(f"Managed {backend.name} {kind}s drifted from the last sync.")
+                drifted = True
+        except Exception as e:
+            logging.error(f"Failed to check {backend.name} {kind}s for drift: {e}")
+    return drifted
+
+def reconcile_dns(plugin, kind, desired, owner_prefix, events=None):
+    """
+    Syncs a DNS plugin's desired records of a kind to its backends. Skips the sync when neither the desired
+    records nor the OPNsense configuration changed since the plugin's last successful run, or when the
+    registry shows nothing diverged since the last apply; a drift detected by check_dns_drift() overrides both.
+    Keeps the plugin's _last_reconciled, _force_full and registry entries up to date.
+    """
+    state_hash = fingerprint([plugin.registry_id, desired])
+    change_token = plugin.opnsense_client.change_token()
+    if not plugin._force_full and change_token is not None and plugin._last_reconciled == (state_hash, change_token):
+        logging.info(f"Desired state and OPNsense configuration unchanged, skipping {plugin.plugin_id}.")
+        return
+
+    if not plugin._force_full and plugin.registry and not plugin.registry.diverged(plugin.registry_id, desired):
+        logging.info(f"No DNS records changed since the last apply, skipping {plugin.plugin_id}.")
+        plugin._last_reconciled = (state_hash, change_token)
+        return
+
+    if sync_dns_backends(plugin.dns_backends, kind, desired, owner_prefix, events):
+        # Refresh the token, this run's own writes changed it
+        plugin._last_reconciled = (state_hash, plugin.opnsense_client.change_token(max_age=0))
+        plugin._force_full = False
+        if plugin.registry:
+            plugin.registry.record(plugin.registry_id, desired)
+    else:
+        plugin._last_reconciled = None
+        if plugin.registry:
+            plugin.registry.forget(plugin.registry_id)
+
+def check_dns_drift(plugin, kind, owner_prefix):
+    """
+    Cheaply checks whether a DNS plugin's managed records of a kind were changed on any backend since the last
+    successful sync. Returns True, and makes the plugin's next run sync unconditionally, if they were.
+    """
+    if not check_dns_backends_drift(plugin.dns_backends, kind, owner_prefix):
+        return False
+    plugin._force_full = True
+    return True
+
+def registry_id(plugin_id, backends, shard=None):
+    """
+    Registry key for a DNS plugin, scoped to its enabled backends so enabling a new one forces a full sync,
+    and to its shard so a changed shard count does too.
+    """
+    key = f"{plugin_id}:{','.join(backend.name for backend in backends)}"
+    return f"{key}@{shard}" if shard else key
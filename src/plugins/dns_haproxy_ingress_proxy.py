@@ -1,34 +1,56 @@
 import logging
+from src.plugins.dns_backends import check_dns_drift, get_dns_backends, reconcile_dns, registry_id
+from src import tracing
+from src.clusters import owner_ref
 
 class DNSHAProxyIngressProxyPlugin:
-    def __init__(self, k8s_networking_v1_api, opnsense_client, config, haproxy_ingress_proxy_config):
+    def __init__(self, k8s_networking_v1_api, opnsense_client, config, haproxy_ingress_proxy_config, registry=None, shard=None, target=None):
         self.k8s_networking_v1_api = k8s_networking_v1_api
         self.opnsense_client = opnsense_client
         self.config = config
         self.haproxy_ingress_proxy_config = haproxy_ingress_proxy_config # Need this for default frontend
-        self.plugin_id = 'dns-haproxy-ingress-proxy'
+        self.plugin_id = f"dns-haproxy-ingress-proxy@{target}" if target else 'dns-haproxy-ingress-proxy'
         self.annotation_frontend = 'haproxy-ingress-proxy.opnsense.org/frontend'
-
-    def run(self):
+        # When set, only the objects in this replica's share of the namespaces are reconciled
+        self.shard = shard
+        self.dns_backends = get_dns_backends(opnsense_client, config, shard)
+        self.registry = registry
+        self.registry_id = registry_id(self.plugin_id, self.dns_backends, shard)
+        # (desired state hash, OPNsense change token) after the last successful run
+        self._last_reconciled = None
+        # Set when drift was detected, the next run then syncs without consulting the change token or registry
+        self._force_full = False
+
+    def run(self, events=None):
         """
         Runs the reconciliation loop for the DNS HAProxy Ingress Proxy plugin.
+        events are the EventStamps of the watch events that triggered this run, if any.
         """
         logging.info(f"Running {self.plugin_id} plugin reconciliation...")
 
-        try:
-            ingresses = self.k8s_networking_v1_api.list_ingress_for_all_namespaces().items
-        except Exception as e:
-            logging.error(f"Error getting Ingress resources: {e}")
-            return
+        with tracing.span('list_kubernetes', resource='ingress') as span:
+            try:
+                ingresses = self.k8s_networking_v1_api.list_ingress_for_all_namespaces().items
+                if self.shard:
+                    ingresses = self.shard.select(ingresses)
+            except Exception as e:
+                logging.error(f"Error getting Ingress resources: {e}")
+                return
+            span.set_attribute('count', len(ingresses))
+
+        with tracing.span('desired_state') as span:
+            desired_aliases = self._get_desired_state(ingresses)
+            span.set_attribute('count', len(desired_aliases))
 
-        desired_aliases = self._get_desired_state(ingresses)
-        current_aliases = self._get_opnsense_host_aliases()
-        if current_aliases is None:
-            return
+        # Reconcile and apply on every enabled DNS backend
+        reconcile_dns(self, 'host_alias', desired_aliases, 'Managed by K8s', events)
 
-        changes_made = self._reconcile_aliases(desired_aliases, current_aliases)
-        if changes_made:
-            self._apply_unbound_changes()
+    def check_drift(self):
+        """
+        Cheaply checks whether the managed DNS host aliases were changed on any backend since the last successful sync.
+        Returns True, and makes the next run sync unconditionally, if they were.
+        """
+        return check_dns_drift(self, 'host_alias', 'Managed by K8s')
 
     def _get_desired_state(self, ingresses):
         """
@@ -64,66 +86,6 @@ class DNSHAProxyIngressProxyPlugin:
                 desired[alias_host] = {
                     "host": alias_host,
                     "target": base_hostname,
-                    "description": f"Managed by K8s Ingress {ingress.metadata.namespace}/{ingress.metadata.name}"
+                    "description": f"Managed by K8s Ingress {owner_ref(ingress.metadata)}"
                 }
         return desired
-
-    def _get_opnsense_host_aliases(self):
-        """
-        Gets the current host aliases from OPNsense Unbound DNS.
-        """
-        endpoint = '/api/unbound/settings/search_host_alias'
-        try:
-            response = self.opnsense_client.get(endpoint)
-            existing = {}
-            if 'rows' in response:
-                for row in response['rows']:
-                    # Use hostname as the key
-                    if 'hostname' in row:
-                        existing[row['hostname']] = row
-            return existing
-        except Exception as e:
-            logging.error(f"Error getting OPNsense Unbound host aliases: {e}")
-            return None
-
-    def _reconcile_aliases(self, desired, current):
-        """
-        Reconciles DNS host aliases.
-        """
-        logging.info("Reconciling Unbound DNS host aliases...")
-        changes_made = False
-
-        # Add/Update
-        for key, data in desired.items():
-            payload = { "alias": data } # API payload structure is a guess
-            if key in current:
-                if current[key].get('target') != data['target']:
-                    logging.info(f"Updating host alias for '{key}'")
-                    uuid = current[key]['uuid']
-                    self.opnsense_client.post(f'/api/unbound/settings/set_host_alias/{uuid}', payload)
-                    changes_made = True
-            else:
-                logging.info(f"Adding new host alias for '{key}'")
-                self.opnsense_client.post('/api/unbound/settings/add_host_alias', payload)
-                changes_made = True
-
-        # Delete
-        orphaned = {k: v for k, v in current.items() if k not in desired and v.get('description', '').startswith('Managed by K8s')}
-        for key, item in orphaned.items():
-            logging.info(f"Deleting orphaned host alias: {key}")
-            uuid = item['uuid']
-            self.opnsense_client.post(f'/api/unbound/settings/del_host_alias/{uuid}')
-            changes_made = True
-
-        return changes_made
-
-    def _apply_unbound_changes(self):
-        """
-        Applies the Unbound DNS changes by calling the reconfigure endpoint.
-        """
-        logging.info("Applying Unbound DNS configuration changes for aliases...")
-        endpoint = '/api/unbound/service/reconfigure'
-        try:
-            self.opnsense_client.post(endpoint)
-        except Exception as e:
-            logging.error(f"Failed to apply Unbound DNS changes: {e}")
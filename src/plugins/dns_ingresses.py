@@ -1,39 +1,56 @@
 import logging
+from src.plugins.dns_backends import check_dns_drift, get_dns_backends, reconcile_dns, registry_id
+from src import logs, tracing
+from src.clusters import owner_ref
 
 class DNSIngressesPlugin:
-    def __init__(self, k8s_networking_v1_api, opnsense_client, config):
+    def __init__(self, k8s_networking_v1_api, opnsense_client, config, registry=None, shard=None, target=None):
         self.k8s_networking_v1_api = k8s_networking_v1_api
         self.opnsense_client = opnsense_client
         self.config = config
-        self.plugin_id = 'dns-ingresses'
-
-    def run(self):
+        self.plugin_id = f"dns-ingresses@{target}" if target else 'dns-ingresses'
+        # When set, only the objects in this replica's share of the namespaces are reconciled
+        self.shard = shard
+        self.dns_backends = get_dns_backends(opnsense_client, config, shard)
+        self.registry = registry
+        self.registry_id = registry_id(self.plugin_id, self.dns_backends, shard)
+        # (desired state hash, OPNsense change token) after the last successful run
+        self._last_reconciled = None
+        # Set when drift was detected, the next run then syncs without consulting the change token or registry
+        self._force_full = False
+
+    def run(self, events=None):
         """
         Runs the reconciliation loop for the DNS Ingresses plugin.
+        events are the EventStamps of the watch events that triggered this run, if any.
         """
         logging.info(f"Running {self.plugin_id} plugin reconciliation...")
 
         # 1. Get all Ingress resources
-        try:
-            ingresses = self.k8s_networking_v1_api.list_ingress_for_all_namespaces().items
-        except Exception as e:
-            logging.error(f"Error getting Ingress resources: {e}")
-            return
+        with tracing.span('list_kubernetes', resource='ingress') as span:
+            try:
+                ingresses = self.k8s_networking_v1_api.list_ingress_for_all_namespaces().items
+                if self.shard:
+                    ingresses = self.shard.select(ingresses)
+            except Exception as e:
+                logging.error(f"Error getting Ingress resources: {e}")
+                return
+            span.set_attribute('count', len(ingresses))
 
         # 2. Process ingresses to get desired state
-        desired_overrides = self._get_desired_state(ingresses)
-
-        # 3. Get current state from OPNsense
-        current_overrides = self._get_opnsense_host_overrides()
-        if current_overrides is None:
-            return
+        with tracing.span('desired_state') as span:
+            desired_overrides = self._get_desired_state(ingresses)
+            span.set_attribute('count', len(desired_overrides))
 
-        # 4. Reconcile
-        changes_made = self._reconcile_overrides(desired_overrides, current_overrides)
+        # 3. Reconcile and apply on every enabled DNS backend
+        reconcile_dns(self, 'host_override', desired_overrides, 'Managed by K8s Ingress', events)
 
-        # 5. Apply changes if any
-        if changes_made:
-            self._apply_unbound_changes()
+    def check_drift(self):
+        """
+        Cheaply checks whether the managed DNS host overrides were changed on any backend since the last successful sync.
+        Returns True, and makes the next run sync unconditionally, if they were.
+        """
+        return check_dns_drift(self, 'host_override', 'Managed by K8s Ingress')
 
     def _get_desired_state(self, ingresses):
         """
@@ -45,7 +62,7 @@ class DNSIngressesPlugin:
 
             ip = self._get_ingress_ip(ingress)
             if not ip:
-                logging.warning(f"Ingress {ingress.metadata.namespace}/{ingress.metadata.name} has no external IP.")
+                logs.warning(f"Ingress {ingress.metadata.namespace}/{ingress.metadata.name} has no external IP.")
                 continue
 
             if not ingress.spec.rules:
@@ -58,7 +75,7 @@ class DNSIngressesPlugin:
                 hostname = rule.host
                 parts = hostname.split('.')
                 if len(parts) < 2:
-                    logging.warning(f"Hostname '{hostname}' for ingress {ingress.metadata.name} is not a valid FQDN, skipping.")
+                    logs.warning(f"Hostname '{hostname}' for ingress {ingress.metadata.name} is not a valid FQDN, skipping.")
                     continue
 
                 host = parts[0]
@@ -68,7 +85,7 @@ class DNSIngressesPlugin:
                     "host": host,
                     "domain": domain,
                     "ip": ip,
-                    "description": f"Managed by K8s Ingress {ingress.metadata.namespace}/{ingress.metadata.name}"
+                    "description": f"Managed by K8s Ingress {owner_ref(ingress.metadata)}"
                 }
         return desired
 
@@ -80,61 +97,3 @@ class DNSIngressesPlugin:
         if lb_ingress and len(lb_ingress) > 0:
             return lb_ingress[0].ip
         return None
-
-    def _get_opnsense_host_overrides(self):
-        """
-        Gets the current host overrides from OPNsense Unbound DNS.
-        """
-        endpoint = '/api/unbound/settings/search_host_override'
-        try:
-            response = self.opnsense_client.get(endpoint)
-            existing = {}
-            if 'rows' in response:
-                for row in response['rows']:
-                    key = f"{row.get('host')}.{row.get('domain')}"
-                    existing[key] = row
-            return existing
-        except Exception as e:
-            logging.error(f"Error getting OPNsense Unbound host overrides: {e}")
-            return None
-
-    def _reconcile_overrides(self, desired, current):
-        """
-        Reconciles DNS host overrides.
-        """
-        logging.info("Reconciling Unbound DNS host overrides for Ingresses...")
-        changes_made = False
-
-        # Add/Update
-        for key, data in desired.items():
-            if key in current:
-                if current[key].get('ip') != data['ip']:
-                    logging.info(f"Updating host override for '{key}'")
-                    uuid = current[key]['uuid']
-                    self.opnsense_client.post(f'/api/unbound/settings/set_host_override/{uuid}', {'host': data})
-                    changes_made = True
-            else:
-                logging.info(f"Adding new host override for '{key}'")
-                self.opnsense_client.post('/api/unbound/settings/add_host_override', {'host': data})
-                changes_made = True
-
-        # Delete
-        orphaned = {k: v for k, v in current.items() if k not in desired and v.get('description', '').startswith('Managed by K8s Ingress')}
-        for key, item in orphaned.items():
-            logging.info(f"Deleting orphaned host override: {key}")
-            uuid = item['uuid']
-            self.opnsense_client.post(f'/api/unbound/settings/del_host_override/{uuid}')
-            changes_made = True
-
-        return changes_made
-
-    def _apply_unbound_changes(self):
-        """
-        Applies the Unbound DNS changes by calling the reconfigure endpoint.
-        """
-        logging.info("Applying Unbound DNS configuration changes for Ingresses...")
-        endpoint = '/api/unbound/service/reconfigure'
-        try:
-            self.opnsense_client.post(endpoint)
-        except Exception as e:
-            logging.error(f"Failed to apply Unbound DNS changes: {e}")
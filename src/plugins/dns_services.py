@@ -1,42 +1,57 @@
 import logging
+from src.plugins.dns_backends import check_dns_drift, get_dns_backends, reconcile_dns, registry_id
+from src import logs, tracing
+from src.clusters import owner_ref
 
 class DNSServicesPlugin:
-    def __init__(self, k8s_core_v1_api, opnsense_client, config):
+    def __init__(self, k8s_core_v1_api, opnsense_client, config, registry=None, shard=None, target=None):
         self.k8s_core_v1_api = k8s_core_v1_api
         self.opnsense_client = opnsense_client
         self.config = config
-        self.plugin_id = 'dns-services'
+        self.plugin_id = f"dns-services@{target}" if target else 'dns-services'
         self.annotation = 'dns.opnsense.org/hostname'
-
-    def run(self):
+        # When set, only the objects in this replica's share of the namespaces are reconciled
+        self.shard = shard
+        self.dns_backends = get_dns_backends(opnsense_client, config, shard)
+        self.registry = registry
+        self.registry_id = registry_id(self.plugin_id, self.dns_backends, shard)
+        # (desired state hash, OPNsense change token) after the last successful run
+        self._last_reconciled = None
+        # Set when drift was detected, the next run then syncs without consulting the change token or registry
+        self._force_full = False
+
+    def run(self, events=None):
         """
         Runs the reconciliation loop for the DNS Services plugin.
+        events are the EventStamps of the watch events that triggered this run, if any.
         """
         logging.info(f"Running {self.plugin_id} plugin reconciliation...")
 
         # 1. Get all Service resources
-        try:
-            services = self.k8s_core_v1_api.list_service_for_all_namespaces().items
-        except Exception as e:
-            logging.error(f"Error getting Service resources: {e}")
-            return
+        with tracing.span('list_kubernetes', resource='service') as span:
+            try:
+                services = self.k8s_core_v1_api.list_service_for_all_namespaces().items
+                if self.shard:
+                    services = self.shard.select(services)
+            except Exception as e:
+                logging.error(f"Error getting Service resources: {e}")
+                return
+            span.set_attribute('count', len(services))
 
         # 2. Process services to get desired state (DNS host overrides)
-        desired_overrides = self._get_desired_state(services)
-
-        # 3. Get current state from OPNsense
-        # Assuming Unbound DNS is the target for now. A real implementation would
-        # also handle dnsmasq based on config.
-        current_overrides = self._get_opnsense_host_overrides()
-        if current_overrides is None:
-            return
+        with tracing.span('desired_state') as span:
+            desired_overrides = self._get_desired_state(services)
+            span.set_attribute('count', len(desired_overrides))
 
-        # 4. Reconcile
-        changes_made = self._reconcile_overrides(desired_overrides, current_overrides)
+        # 3. Reconcile and apply on every enabled DNS backend
+        reconcile_dns(self, 'host_override', desired_overrides, 'Managed by K8s Service', events)
 
-        # 5. Apply changes if any
-        if changes_made:
-            self._apply_unbound_changes()
+    def check_drift(self):
+        """
+        Cheaply checks whether the managed DNS host overrides were changed on any backend since the last successful sync.
+        Returns True, and makes the next run sync unconditionally, if they were.
+        """
+        return check_dns_drift(self, 'host_override', 'Managed by K8s Service')
 
     def _get_desired_state(self, services):
         """
@@ -56,7 +71,7 @@ class DNSServicesPlugin:
             ip = self._get_service_ip(service)
 
             if not ip:
-                logging.warning(f"Service {service.metadata.namespace}/{service.metadata.name} has no external IP.")
+                logs.warning(f"Service {service.metadata.namespace}/{service.metadata.name} has no external IP.")
                 continue
 
             # Key for the map will be f"{hostname}.{domain}" but we need to figure out the domain.
@@ -68,7 +83,7 @@ class DNSServicesPlugin:
             # We'll split the hostname into host and domain parts.
             parts = hostname.split('.')
             if len(parts) < 2:
-                logging.warning(f"Hostname '{hostname}' for service {service.metadata.name} is not a valid FQDN, skipping.")
+                logs.warning(f"Hostname '{hostname}' for service {service.metadata.name} is not a valid FQDN, skipping.")
                 continue
 
             host = parts[0]
@@ -78,7 +93,7 @@ class DNSServicesPlugin:
                 "host": host,
                 "domain": domain,
                 "ip": ip,
-                "description": f"Managed by K8s Service {service.metadata.namespace}/{service.metadata.name}"
+                "description": f"Managed by K8s Service {owner_ref(service.metadata)}"
             }
         return desired
 
@@ -91,63 +106,3 @@ class DNSServicesPlugin:
             # Return the IP of the first ingress point
             return ingress[0].ip
         return None
-
-    def _get_opnsense_host_overrides(self):
-        """
-        Gets the current host overrides from OPNsense Unbound DNS.
-        """
-        endpoint = '/api/unbound/settings/search_host_override'
-        try:
-            response = self.opnsense_client.get(endpoint)
-            existing = {}
-            if 'rows' in response:
-                for row in response['rows']:
-                    # Create a unique key for comparison
-                    key = f"{row.get('host')}.{row.get('domain')}"
-                    existing[key] = row
-            return existing
-        except Exception as e:
-            logging.error(f"Error getting OPNsense Unbound host overrides: {e}")
-            return None
-
-    def _reconcile_overrides(self, desired, current):
-        """
-        Reconciles DNS host overrides.
-        """
-        logging.info("Reconciling Unbound DNS host overrides...")
-        changes_made = False
-
-        # Add/Update
-        for key, data in desired.items():
-            if key in current:
-                # Check if update is needed
-                if current[key].get('ip') != data['ip']:
-                    logging.info(f"Updating host override for '{key}'")
-                    uuid = current[key]['uuid']
-                    self.opnsense_client.post(f'/api/unbound/settings/set_host_override/{uuid}', {'host': data})
-                    changes_made = True
-            else:
-                logging.info(f"Adding new host override for '{key}'")
-                self.opnsense_client.post('/api/unbound/settings/add_host_override', {'host': data})
-                changes_made = True
-
-        # Delete
-        orphaned = {k: v for k, v in current.items() if k not in desired and v.get('description', '').startswith('Managed by K8s')}
-        for key, item in orphaned.items():
-            logging.info(f"Deleting orphaned host override: {key}")
-            uuid = item['uuid']
-            self.opnsense_client.post(f'/api/unbound/settings/del_host_override/{uuid}')
-            changes_made = True
-
-        return changes_made
-
-    def _apply_unbound_changes(self):
-        """
-        Applies the Unbound DNS changes by calling the reconfigure endpoint.
-        """
-        logging.info("Applying Unbound DNS configuration changes...")
-        endpoint = '/api/unbound/service/reconfigure'
-        try:
-            self.opnsense_client.post(endpoint)
-        except Exception as e:
-            logging.error(f"Failed to apply Unbound DNS changes: {e}")
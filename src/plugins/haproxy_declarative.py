@@ -1,34 +1,190 @@
+import hashlib
+import json
 import logging
 import yaml
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from kubernetes import client
+from src import logs, metrics, tracing
+from src.registry import fingerprint
+
+# Prefer the libyaml-backed loader when PyYAML was built with it
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Marks objects created by this plugin; only these are ever deleted
+_OWNER_PREFIX = 'Managed by K8s ConfigMap'
+
+# HAProxy object types in dependency order, servers first
+_TYPE_ORDER = ('server', 'acl', 'backend', 'action', 'frontend')
+
+# Definition fields that reference other objects by name, resolved to UUIDs on apply
+_REFERENCE_FIELDS = {
+    'backend': {'linkedServers': 'server'},
+    'action': {'linkedAcls': 'acl', 'use_backend': 'backend'},
+    'frontend': {'defaultBackend': 'backend', 'linkedActions': 'action'},
+}
+
+def _freeze(value):
+    """
+    Recursively converts parsed YAML into read-only mappings and tuples so it can be cached and shared.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def _thaw(value):
+    """
+    Returns a mutable deep copy of a frozen structure, suitable for building API payloads.
+    """
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+def _as_names(value):
+    """
+    Normalizes a reference field (list or comma-separated string) into a list of names.
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return list(value)
+
+def _fingerprint(payload):
+    """
+    Returns a short, stable hash of an object definition.
+    """
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+def _topological_levels(dependencies):
+    """
+    Groups graph nodes into levels where each node only depends on nodes in earlier levels.
+    Dependencies on nodes outside the graph (e.g. unmanaged objects) are ignored.
+    """
+    remaining = {node: set(deps) & dependencies.keys() for node, deps in dependencies.items()}
+    levels = []
+    while remaining:
+        level = sorted(node for node, deps in remaining.items() if not deps)
+        if not level:
+            raise ValueError(f"dependency cycle between {sorted(remaining)}")
+        levels.append(level)
+        for node in level:
+            del remaining[node]
+        for deps in remaining.values():
+            deps.difference_update(level)
+    return levels
 
 class HAProxyDeclarativePlugin:
-    def __init__(self, k8s_core_v1_api, opnsense_client, config):
+    def __init__(self, k8s_core_v1_api, opnsense_client, config, registry=None, target=None):
         self.k8s_core_v1_api = k8s_core_v1_api
         self.opnsense_client = opnsense_client
         self.config = config
-        self.plugin_id = 'haproxy-declarative'
-
-    def run(self):
+        self.plugin_id = f"haproxy-declarative@{target}" if target else 'haproxy-declarative'
+        self.registry = registry
+        self._failed = False
+        # Set while written changes still wait for a successful reconfigure
+        self._apply_pending = False
+        # (desired state hash, OPNsense change token) after the last successful run
+        self._last_reconciled = None
+        # Hash of the controller-owned rows after the last successful run, compared by check_drift()
+        self._managed_rows_hash = None
+        # Set when drift was detected, the next run then rewrites every object
+        self._force_full = False
+        self.max_workers = config.get('maxConcurrency', 4)
+        self._nodes = None
+        # (namespace, name, resourceVersion) -> tuple of frozen resources
+        self._parse_cache = {}
+
+    def run(self, events=None):
+        """
+        Runs the reconciliation loop for the HAProxy Declarative plugin.
+        events are the EventStamps of the watch events that triggered this run, if any.
+        """
         logging.info(f"Running {self.plugin_id} plugin reconciliation...")
 
-        declarative_cms = self._get_declarative_configmaps()
-        if declarative_cms is None:
-            return
+        with tracing.span('list_kubernetes', resource='config_map') as span:
+            declarative_cms = self._get_declarative_configmaps()
+            if declarative_cms is None:
+                return
+            span.set_attribute('count', len(declarative_cms))
 
-        all_desired_resources = []
-        for cm in declarative_cms:
-            resources = self._parse_cm_resources(cm)
-            if resources:
-                all_desired_resources.extend(resources)
+        with tracing.span('parse') as span:
+            all_desired_resources = []
+            for cm in declarative_cms:
+                resources = self._get_cm_resources(cm)
+                if resources:
+                    all_desired_resources.extend(resources)
+            span.set_attributes(resources=len(all_desired_resources), cached=len(self._parse_cache))
 
-        self._reconcile_resources(all_desired_resources)
+        self._reconcile_resources(all_desired_resources, events)
+
+    def warm(self):
+        """
+        Parses the declarative ConfigMaps into the parse cache without touching OPNsense, so a standby
+        that becomes leader starts with a warm cache.
+        """
+        for cm in self._get_declarative_configmaps() or []:
+            self._get_cm_resources(cm)
+
+    def check_drift(self):
+        """
+        Cheaply checks whether controller-owned objects were changed on OPNsense since the last successful run.
+        Returns True, and makes the next run rewrite every object, if they were.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            current = self._get_current_objects(executor)
+        if current is None:
+            return False
+        if self._managed_rows_hash is not None and self._hash_managed_rows(current) == self._managed_rows_hash:
+            return False
+
+        logging.info(f"Managed HAProxy objects drifted from the last apply, scheduling a full {self.plugin_id} reconcile.")
+        self._force_full = True
+        return True
+
+    def caches(self):
+        """
+        The in-memory caches of this plugin by name, for metrics and memory accounting.
+        """
+        return {'parse': self._parse_cache}
+
+    def _get_cm_resources(self, cm):
+        """
+        Returns the parsed resources of a ConfigMap, re-parsing only when its resourceVersion changed.
+        """
+        resource_version = cm.metadata.resource_version
+        if resource_version is None:
+            return self._parse_cm_resources(cm)
+
+        key = (cm.metadata.namespace, cm.metadata.name, resource_version)
+        if key not in self._parse_cache:
+            # Drop entries for older versions of the same ConfigMap
+            for stale in [k for k in self._parse_cache if k[:2] == key[:2]]:
+                del self._parse_cache[stale]
+            self._parse_cache[key] = self._parse_cm_resources(cm)
+        return self._parse_cache[key]
+
+    def _prune_parse_cache(self, configmaps):
+        """
+        Evicts cached entries for ConfigMaps that no longer exist.
+        """
+        live = {(cm.metadata.namespace, cm.metadata.name) for cm in configmaps}
+        for key in [k for k in self._parse_cache if k[:2] not in live]:
+            del self._parse_cache[key]
 
     def _get_declarative_configmaps(self):
         logging.info("Getting declarative HAProxy ConfigMaps...")
         try:
             label_selector = 'pfsense.org/type=declarative'
-            return self.k8s_core_v1_api.list_config_map_for_all_namespaces(label_selector=label_selector).items
+            configmaps = self.k8s_core_v1_api.list_config_map_for_all_namespaces(label_selector=label_selector).items
+            self._prune_parse_cache(configmaps)
+            return configmaps
         except client.ApiException as e:
             logging.error(f"Error getting declarative ConfigMaps: {e}")
             return None
@@ -36,96 +192,233 @@ class HAProxyDeclarativePlugin:
     def _parse_cm_resources(self, cm):
         cm_name = cm.metadata.name
         cm_namespace = cm.metadata.namespace
-        logging.info(f"Parsing ConfigMap: {cm_namespace}/{cm_name}")
+        logging.debug(f"Parsing ConfigMap: {cm_namespace}/{cm_name}")
         try:
             config_data_str = cm.data.get('data')
             if not config_data_str:
                 return None
-            config_data = yaml.safe_load(config_data_str)
+            config_data = yaml.load(config_data_str, Loader=_YAML_LOADER)
             if not config_data or 'resources' not in config_data:
                 return None
 
-            resources = config_data['resources']
-            for res in resources:
-                res['metadata'] = {'namespace': cm_namespace, 'cm_name': cm_name}
-            return resources
+            metadata = {'namespace': cm_namespace, 'cm_name': cm_name}
+            return tuple(_freeze({**res, 'metadata': metadata}) for res in config_data['resources'])
         except yaml.YAMLError as e:
             logging.error(f"Error parsing YAML from ConfigMap {cm_namespace}/{cm_name}: {e}")
             return None
 
-    def _reconcile_resources(self, desired_resources):
-        desired_backends = [r for r in desired_resources if r.get('type') == 'backend']
-        desired_frontends = [r for r in desired_resources if r.get('type') == 'frontend']
+    def _reconcile_resources(self, desired_resources, events=None):
+        """
+        Reconciles the declared HAProxy object graph against OPNsense in a single dependency-ordered pass.
+        """
+        self._nodes = None
+        self._failed = False
+        with tracing.span('desired_state') as span:
+            desired = self._build_object_graph(desired_resources)
+            span.set_attribute('count', len(desired))
+
+        registry_view = {f"{item_type}/{name}": obj for (item_type, name), obj in desired.items()}
+        state_hash = fingerprint(registry_view)
+        change_token = self.opnsense_client.change_token()
+        if not self._force_full:
+            if change_token is not None and self._last_reconciled == (state_hash, change_token):
+                logging.info(f"Desired state and OPNsense configuration unchanged, skipping {self.plugin_id}.")
+                return
+
+            if self.registry and not self.registry.diverged(self.plugin_id, registry_view):
+                logging.info(f"No declarative HAProxy objects changed since the last apply, skipping {self.plugin_id}.")
+                self._last_reconciled = (state_hash, change_token)
+                return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            with tracing.span('fetch_opnsense') as span:
+                current = self._get_current_objects(executor)
+                if current is None:
+                    return
+                span.set_attribute('count', sum(len(rows) for rows in current.values()))
+
+            try:
+                levels = _topological_levels({key: self._get_dependencies(key, obj) for key, obj in desired.items()})
+            except ValueError as e:
+                logging.error(f"Cannot reconcile declarative HAProxy resources: {e}")
+                return
+
+            # Objects are diffed against their fingerprint as they are applied, so diff and mutate share a span
+            with tracing.span('mutate', levels=len(levels)) as span:
+                changes, uuids = self._apply_objects(executor, levels, desired, current)
+                changes.update(self._delete_orphans(executor, desired, current))
+                # Failed calls mark the run failed, only the successful ones need a reconfigure
+                changes_made = any(count for action, count in changes.items() if action != 'failed')
+                span.set_attribute('changed', changes_made)
+            logging.info(f"Reconciled declarative HAProxy objects: {changes}.")
+
+            # Baseline for drift checks, re-read when this run's own writes changed the rows
+            applied = self._get_current_objects(executor) if changes_made and not self._failed else current
+
+        if self._failed or applied is None:
+            self._managed_rows_hash = None
+        else:
+            self._managed_rows_hash = self._hash_managed_rows(applied)
+            self._force_full = False
+
+        if changes_made or self._apply_pending:
+            with tracing.span('apply', service='haproxy'):
+                self._apply_pending = not self._apply_haproxy_changes(events)
+            # The written objects are not live yet, the next run reconfigures again
+            self._failed = self._failed or self._apply_pending
+            # This run's own writes changed the token
+            change_token = self.opnsense_client.change_token(max_age=0)
+        self._last_reconciled = None if self._failed else (state_hash, change_token)
+
+        if self.registry:
+            if self._failed:
+                self.registry.forget(self.plugin_id)
+            else:
+                self.registry.record(self.plugin_id, registry_view, {f"{t}/{n}": uuid for (t, n), uuid in uuids.items() if (t, n) in desired})
 
-        # Reconcile backends first, as frontends may depend on them
-        backends_changed = self._reconcile_backends(desired_backends)
-        frontends_changed = self._reconcile_frontends(desired_frontends)
+    def _build_object_graph(self, desired_resources):
+        """
+        Flattens the declared resources into {(item_type, name): object}, expanding backend ha_servers into server objects.
+        """
+        graph = {}
+
+        def add(item_type, definition, owner):
+            name = definition.get('name')
+            if not name:
+                logging.warning(f"Skipping {item_type} without a name declared in ConfigMap {owner}.")
+                return
+            if (item_type, name) in graph:
+                logging.warning(f"Duplicate {item_type} '{name}' declared in ConfigMap {owner}, ignoring.")
+                return
+            graph[(item_type, name)] = {'definition': definition, 'owner': owner}
+
+        for res in desired_resources:
+            item_type = res.get('type')
+            if item_type not in _TYPE_ORDER:
+                logging.warning(f"Skipping unsupported declarative resource type: {item_type}")
+                continue
+
+            metadata = res.get('metadata', {})
+            owner = f"{metadata.get('namespace')}/{metadata.get('cm_name')}"
+            definition = _thaw(res.get('definition', {}))
+
+            if item_type == 'backend' and 'ha_servers' in res:
+                servers = self._resolve_backend_servers(res)
+                for server in servers:
+                    add('server', server, owner)
+                linked = _as_names(definition.get('linkedServers'))
+                definition['linkedServers'] = linked + [s['name'] for s in servers if s.get('name') not in linked]
+
+            add(item_type, definition, owner)
+
+        return graph
+
+    def _get_dependencies(self, key, obj):
+        item_type = key[0]
+        return {(ref_type, name)
+                for field, ref_type in _REFERENCE_FIELDS.get(item_type, {}).items()
+                for name in _as_names(obj['definition'].get(field))}
+
+    def _hash_managed_rows(self, current):
+        return fingerprint({item_type: {name: row for name, row in rows.items() if row.get('description', '').startswith(_OWNER_PREFIX)}
+                            for item_type, rows in current.items()})
+
+    def _get_current_objects(self, executor):
+        """
+        Fetches every managed HAProxy object type from OPNsense concurrently.
+        """
+        current = dict(zip(_TYPE_ORDER, executor.map(tracing.propagate(self._get_opnsense_items), _TYPE_ORDER)))
+        if any(items is None for items in current.values()):
+            return None
+        return current
 
-        if backends_changed or frontends_changed:
-            self._apply_haproxy_changes()
+    def _apply_objects(self, executor, levels, desired, current):
+        """
+        Creates and updates objects level by level, so references always point at existing UUIDs.
+        Objects within a level are independent and are applied concurrently.
+        Returns a tuple of (changes, uuids), changes counting the added, updated and failed objects and
+        uuids mapping (item_type, name) to UUID.
+        """
+        uuids = {(item_type, name): row['uuid'] for item_type, rows in current.items() for name, row in rows.items()}
+
+        changes = logs.ActionCounts()
+        for level in levels:
+            results = executor.map(tracing.propagate(lambda key: self._apply_object(key, desired[key], current[key[0]].get(key[1]), uuids)), level)
+            for key, (uuid, action) in zip(level, list(results)):
+                if uuid:
+                    uuids[key] = uuid
+                if action:
+                    changes[action] += 1
+        return changes, uuids
+
+    def _apply_object(self, key, obj, current_row, uuids):
+        """
+        Adds or updates a single object. Returns a tuple of (uuid, action), action being 'added', 'updated',
+        'failed' or None if the object was unchanged, and uuid None if the add failed.
+        """
+        item_type, name = key
+        payload = self._resolve_references(item_type, obj['definition'], uuids)
 
-    def _reconcile_backends(self, desired_backends):
-        current_backends = self._get_opnsense_items('backend')
-        if current_backends is None: return
+        # The content fingerprint lives in the description, so unchanged objects cost no API calls
+        description = f"{_OWNER_PREFIX} {obj['owner']} [{_fingerprint(payload)}]"
+        if payload.get('description'):
+            description = f"{description} {payload['description']}"
+        payload['description'] = description
 
-        desired_map = {b.get('definition', {}).get('name'): b for b in desired_backends if b.get('definition', {}).get('name')}
+        if current_row is None:
+            logging.debug(f"Adding new {item_type} '{name}'")
+            uuid = self._add_opnsense_item(item_type, payload)
+            return uuid, 'added' if uuid else 'failed'
 
-        changes_made = False
-        for name, backend_data in desired_map.items():
-            resolved_backend = self._resolve_backend_servers(backend_data)
-            if name in current_backends:
-                uuid = current_backends[name]['uuid']
-                # TODO: Add proper update detection
-                logging.info(f"Updating backend '{name}' (UUID: {uuid})")
-                self._update_opnsense_item('backend', uuid, resolved_backend['definition'])
-                changes_made = True
-            else:
-                logging.info(f"Adding new backend '{name}'")
-                self._add_opnsense_item('backend', resolved_backend['definition'])
-                changes_made = True
-
-        orphaned = {k: v for k, v in current_backends.items() if k not in desired_map}
-        for name, backend in orphaned.items():
-            # TODO: Add a check to only delete managed backends
-            logging.info(f"Deleting orphaned backend: {name}")
-            self._delete_opnsense_item('backend', backend['uuid'])
-            changes_made = True
-
-        return changes_made
-
-    def _reconcile_frontends(self, desired_frontends):
-        current_frontends = self._get_opnsense_items('frontend')
-        if current_frontends is None: return False
-
-        desired_map = {f.get('definition', {}).get('name'): f for f in desired_frontends if f.get('definition', {}).get('name')}
-
-        changes_made = False
-        for name, frontend_data in desired_map.items():
-            if name in current_frontends:
-                uuid = current_frontends[name]['uuid']
-                logging.info(f"Updating frontend '{name}' (UUID: {uuid})")
-                self._update_opnsense_item('frontend', uuid, frontend_data['definition'])
-                changes_made = True
-            else:
-                logging.info(f"Adding new frontend '{name}'")
-                self._add_opnsense_item('frontend', frontend_data['definition'])
-                changes_made = True
+        uuid = current_row['uuid']
+        # The fingerprint cannot see fields edited on OPNsense, so a drift repair rewrites every object
+        if not self._force_full and current_row.get('description') == description:
+            return uuid, None
 
-        orphaned = {k: v for k, v in current_frontends.items() if k not in desired_map}
-        for name, frontend in orphaned.items():
-            logging.info(f"Deleting orphaned frontend: {name}")
-            self._delete_opnsense_item('frontend', frontend['uuid'])
-            changes_made = True
+        logging.debug(f"Updating {item_type} '{name}' (UUID: {uuid})")
+        return uuid, 'updated' if self._update_opnsense_item(item_type, uuid, payload) else 'failed'
 
-        return changes_made
+    def _resolve_references(self, item_type, definition, uuids):
+        """
+        Replaces object names in reference fields with the comma-separated UUIDs OPNsense expects.
+        """
+        payload = dict(definition)
+        for field, ref_type in _REFERENCE_FIELDS.get(item_type, {}).items():
+            if field not in payload:
+                continue
+            resolved = []
+            for ref_name in _as_names(payload[field]):
+                if (ref_type, ref_name) in uuids:
+                    resolved.append(uuids[(ref_type, ref_name)])
+                else:
+                    logs.warning(f"{item_type} '{definition.get('name')}' references unknown {ref_type} '{ref_name}'")
+            payload[field] = ",".join(resolved)
+        return payload
+
+    def _delete_orphans(self, executor, desired, current):
+        """
+        Deletes controller-owned objects that are no longer declared, dependents first.
+        Returns the number of deleted and failed objects.
+        """
+        changes = logs.ActionCounts()
+        for item_type in reversed(_TYPE_ORDER):
+            orphaned = {name: row for name, row in current[item_type].items()
+                        if (item_type, name) not in desired and row.get('description', '').startswith(_OWNER_PREFIX)}
+            for name in orphaned:
+                logging.debug(f"Deleting orphaned {item_type}: {name}")
+            results = executor.map(tracing.propagate(lambda row: self._delete_opnsense_item(item_type, row['uuid'])), orphaned.values())
+            for ok in list(results):
+                changes['deleted' if ok else 'failed'] += 1
+        return changes
 
     def _resolve_backend_servers(self, backend_data):
-        if 'ha_servers' not in backend_data:
-            return backend_data
-
+        """
+        Expands the ha_servers of a backend into server definitions.
+        """
+        backend_name = backend_data.get('definition', {}).get('name')
         resolved_servers = []
         for server in backend_data['ha_servers']:
-            server_def = server.get('definition', {})
+            server_def = _thaw(server.get('definition', {}))
 
             if server.get('type') == 'node-static':
                 resolved_servers.append(server_def)
@@ -136,7 +429,7 @@ class HAProxyDeclarativePlugin:
                 namespace = server.get('serviceNamespace') or backend_data.get('metadata', {}).get('namespace')
 
                 if not all([service_name, service_port, namespace]):
-                    logging.warning(f"Skipping node-service in backend '{backend_data.get('definition', {}).get('name')}' due to missing info.")
+                    logging.warning(f"Skipping node-service in backend '{backend_name}' due to missing info.")
                     continue
 
                 try:
@@ -147,21 +440,27 @@ class HAProxyDeclarativePlugin:
                         logging.warning(f"Service {namespace}/{service_name} has no matching nodePort for port {service_port}")
                         continue
 
-                    nodes = self.k8s_core_v1_api.list_node().items
-                    for node in nodes:
+                    for node in self._list_nodes():
                         node_ip = self._get_node_ip(node)
                         if node_ip:
                             new_server = server_def.copy()
-                            new_server['name'] = f"{node.metadata.name}-{service_port}"
+                            # Servers are standalone objects, so scope generated names to the backend
+                            new_server['name'] = f"{backend_name}-{node.metadata.name}-{service_port}"
                             new_server['address'] = node_ip
                             new_server['port'] = node_port
                             resolved_servers.append(new_server)
                 except client.ApiException as e:
                     logging.error(f"Error getting service {namespace}/{service_name}: {e}")
 
-        backend_data['definition']['servers'] = resolved_servers
-        del backend_data['ha_servers']
-        return backend_data
+        return resolved_servers
+
+    def _list_nodes(self):
+        """
+        Lists cluster nodes once per reconciliation, shared by every node-service server.
+        """
+        if self._nodes is None:
+            self._nodes = self.k8s_core_v1_api.list_node().items
+        return self._nodes
 
     def _get_node_ip(self, node):
         addrs = node.status.addresses
@@ -181,27 +480,40 @@ class HAProxyDeclarativePlugin:
     def _add_opnsense_item(self, item_type, item_data):
         endpoint = f'/api/haproxy/settings/add_{item_type}'
         try:
-            self.opnsense_client.post(endpoint, {item_type: item_data})
+            response = self.opnsense_client.post(endpoint, {item_type: _thaw(item_data)})
+            if not response.get('uuid'):
+                raise ValueError(f"no UUID returned: {response.get('validations') or response}")
+            return response['uuid']
         except Exception as e:
             logging.error(f"Failed to add {item_type} {item_data.get('name')}: {e}")
+            self._failed = True
+            return None
 
     def _update_opnsense_item(self, item_type, uuid, item_data):
         endpoint = f'/api/haproxy/settings/set_{item_type}/{uuid}'
         try:
-            self.opnsense_client.post(endpoint, {item_type: item_data})
+            response = self.opnsense_client.post(endpoint, {item_type: _thaw(item_data)})
+            if response.get('result') == 'failed':
+                raise ValueError(f"not saved: {response.get('validations') or response}")
+            return True
         except Exception as e:
             logging.error(f"Failed to update {item_type} {item_data.get('name')}: {e}")
+            self._failed = True
+            return False
 
     def _delete_opnsense_item(self, item_type, uuid):
         endpoint = f'/api/haproxy/settings/del_{item_type}/{uuid}'
         try:
             self.opnsense_client.post(endpoint)
+            return True
         except Exception as e:
             logging.error(f"Failed to delete {item_type} with UUID {uuid}: {e}")
+            self._failed = True
+            return False
 
-    def _apply_haproxy_changes(self):
+    def _apply_haproxy_changes(self, events=None):
         """
-        Applies the HAProxy changes by calling the reconfigure endpoint.
+        Applies the HAProxy changes by calling the reconfigure endpoint. Returns True on success.
         """
         logging.info("Applying HAProxy configuration changes...")
         endpoint = '/api/haproxy/service/reconfigure'
@@ -209,3 +521,6 @@ class HAProxyDeclarativePlugin:
             self.opnsense_client.post(endpoint)
         except Exception as e:
             logging.error(f"Failed to apply HAProxy changes: {e}")
+            return False
+        metrics.observe_event_latency('haproxy', events)
+        return True
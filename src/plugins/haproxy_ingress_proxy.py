@@ -1,47 +1,152 @@
 import logging
 from kubernetes import client
+from src import logs, metrics, tracing
+from src.registry import fingerprint
+from src.clusters import owner_ref
 
 class HAProxyIngressProxyPlugin:
-    def __init__(self, k8s_networking_v1_api, opnsense_client, config):
+    def __init__(self, k8s_networking_v1_api, opnsense_client, config, registry=None, shard=None, target=None):
         self.k8s_networking_v1_api = k8s_networking_v1_api
         self.opnsense_client = opnsense_client
         self.config = config
-        self.plugin_id = 'haproxy-ingress-proxy'
-
-    def run(self):
+        self.plugin_id = f"haproxy-ingress-proxy@{target}" if target else 'haproxy-ingress-proxy'
+        self.registry = registry
+        # When set, only the ingresses in this replica's share of the namespaces are reconciled
+        self.shard = shard
+        self.registry_id = f"{self.plugin_id}@{shard}" if shard else self.plugin_id
+        # Keys of objects that differ from the last successful apply, None when there is no registry
+        self._diverged = None
+        self._failed = False
+        # Set while written changes still wait for a successful reconfigure
+        self._apply_pending = False
+        # (desired state hash, OPNsense change token) after the last successful run
+        self._last_reconciled = None
+        # Hash of the managed ACL and action rows after the last successful run, compared by check_drift()
+        self._managed_rows_hash = None
+        # Set when drift was detected, the next run then rewrites every ACL and action
+        self._force_full = False
+
+    def run(self, events=None):
         """
         Runs the reconciliation loop for the HAProxy Ingress Proxy plugin.
+        events are the EventStamps of the watch events that triggered this run, if any.
         """
         logging.info(f"Running {self.plugin_id} plugin reconciliation...")
 
         # 1. Get all Ingress resources
-        try:
-            ingresses = self.k8s_networking_v1_api.list_ingress_for_all_namespaces().items
-        except client.ApiException as e:
-            logging.error(f"Error getting Ingress resources: {e}")
-            return
+        with tracing.span('list_kubernetes', resource='ingress') as span:
+            try:
+                ingresses = self.k8s_networking_v1_api.list_ingress_for_all_namespaces().items
+                if self.shard:
+                    ingresses = self.shard.select(ingresses)
+            except client.ApiException as e:
+                logging.error(f"Error getting Ingress resources: {e}")
+                return
+            span.set_attribute('count', len(ingresses))
 
         # 2. Process ingresses to get desired state (ACLs and Actions)
-        desired_acls, desired_actions = self._get_desired_state(ingresses)
+        with tracing.span('desired_state') as span:
+            desired_acls, desired_actions = self._get_desired_state(ingresses)
+            span.set_attributes(acls=len(desired_acls), actions=len(desired_actions))
+
+        # Snapshot before reconciliation, which rewrites action ACL names into UUIDs
+        registry_view = {f"acl/{k}": dict(v) for k, v in desired_acls.items()}
+        registry_view.update({f"action/{k}": dict(v) for k, v in desired_actions.items()})
+        state_hash = fingerprint(registry_view)
+        change_token = self.opnsense_client.change_token()
+        if not self._force_full and change_token is not None and self._last_reconciled == (state_hash, change_token):
+            logging.info(f"Desired state and OPNsense configuration unchanged, skipping {self.plugin_id}.")
+            return
+
+        self._diverged = None
+        if self.registry and not self._force_full:
+            self._diverged = self.registry.diverged(self.registry_id, registry_view)
+            if not self._diverged:
+                logging.info(f"No ACLs or actions changed since the last apply, skipping {self.plugin_id}.")
+                self._last_reconciled = (state_hash, change_token)
+                return
+        self._failed = False
 
         # 3. Get current state from OPNsense
-        current_acls = self._get_opnsense_items('acl')
-        current_actions = self._get_opnsense_items('action')
-        if current_acls is None or current_actions is None:
-            return
+        with tracing.span('fetch_opnsense') as span:
+            current_acls = self._get_opnsense_items('acl')
+            current_actions = self._get_opnsense_items('action')
+            if current_acls is None or current_actions is None:
+                return
+            span.set_attributes(acls=len(current_acls), actions=len(current_actions))
 
         # 4. Reconcile ACLs
-        acls_changed = self._reconcile_items('acl', desired_acls, current_acls)
+        # Items are diffed as they are written, so diff and mutate share a span
+        with tracing.span('mutate', item_type='acl') as span:
+            acls_changed = self._reconcile_items('acl', desired_acls, current_acls)
+            span.set_attribute('changed', acls_changed)
 
         # 5. Reconcile Actions
         # We need to refresh the ACL list from OPNsense so we can link actions to the new ACL UUIDs
-        refreshed_acls = self._get_opnsense_items('acl')
-        actions_changed = False
-        if refreshed_acls is not None:
-            actions_changed = self._reconcile_actions(desired_actions, current_actions, refreshed_acls)
+        with tracing.span('mutate', item_type='action') as span:
+            refreshed_acls = self._get_opnsense_items('acl')
+            actions_changed = False
+            if refreshed_acls is not None:
+                actions_changed = self._reconcile_actions(desired_actions, current_actions, refreshed_acls, current_acls)
+            span.set_attribute('changed', actions_changed)
+
+        if acls_changed or actions_changed or self._apply_pending:
+            with tracing.span('apply', service='haproxy'):
+                self._apply_pending = not self._apply_haproxy_changes(events)
+            # The written rows are not live yet, the next run reconfigures again
+            self._failed = self._failed or self._apply_pending
+
+        if self._failed or refreshed_acls is None:
+            self._last_reconciled = None
+            self._managed_rows_hash = None
+            if self.registry:
+                self.registry.forget(self.registry_id)
+        else:
+            if acls_changed or actions_changed:
+                # This run's own writes changed the token and the rows used as the drift baseline
+                change_token = self.opnsense_client.change_token(max_age=0)
+                self._managed_rows_hash = self._hash_managed_rows(self._get_opnsense_items('acl'), self._get_opnsense_items('action'))
+            else:
+                self._managed_rows_hash = self._hash_managed_rows(current_acls, current_actions)
+            self._force_full = False
+            self._last_reconciled = (state_hash, change_token)
+            if self.registry:
+                self.registry.record(self.registry_id, registry_view)
+
+    def check_drift(self):
+        """
+        Cheaply checks whether the managed ACLs and actions were changed on OPNsense since the last successful run.
+        Returns True, and makes the next run rewrite all of them, if they were.
+        """
+        current_acls = self._get_opnsense_items('acl')
+        current_actions = self._get_opnsense_items('action')
+        if current_acls is None or current_actions is None:
+            return False
+        if self._managed_rows_hash is not None and self._hash_managed_rows(current_acls, current_actions) == self._managed_rows_hash:
+            return False
 
-        if acls_changed or actions_changed:
-            self._apply_haproxy_changes()
+        logging.info(f"Managed HAProxy ACLs or actions drifted from the last apply, scheduling a full {self.plugin_id} reconcile.")
+        self._force_full = True
+        return True
+
+    def _hash_managed_rows(self, current_acls, current_actions):
+        """
+        Returns None if either table could not be read, so the next drift check forces a full run.
+        """
+        if current_acls is None or current_actions is None:
+            return None
+        return fingerprint({
+            'acl': self._owned(current_acls, current_acls),
+            'action': self._owned(current_actions, current_acls),
+        })
+
+    def _owned(self, items, current_acls):
+        """
+        Filters ACLs or actions down to the ones created by the controller, and by this replica's shard.
+        Actions carry no description, they belong to the shard of the ACL with the same name.
+        """
+        return {name: row for name, row in items.items() if name.startswith('kic-')
+                and (self.shard is None or self.shard.owns_description(current_acls.get(name, {}).get('description')))}
 
     def _get_desired_state(self, ingresses):
         """
@@ -54,9 +159,6 @@ class HAProxyIngressProxyPlugin:
         default_backend = self.config.get('defaultBackend')
 
         for ingress in ingresses:
-            ingress_name = ingress.metadata.name
-            ingress_ns = ingress.metadata.namespace
-
             # TODO: Handle annotations for enabling/disabling, and custom frontend/backend
 
             if not ingress.spec.rules:
@@ -76,7 +178,7 @@ class HAProxyIngressProxyPlugin:
                     "name": acl_name,
                     "expression": "host_matches", # This is a guess, needs verification
                     "value": host,
-                    "description": f"Managed by K8s Ingress {ingress_ns}/{ingress_name}"
+                    "description": f"Managed by K8s Ingress {owner_ref(ingress.metadata)}"
                 }
 
                 # Define the Action
@@ -92,65 +194,78 @@ class HAProxyIngressProxyPlugin:
 
     def _reconcile_items(self, item_type, desired_map, current_map):
         """Generic reconciliation function for simple items like ACLs."""
-        logging.info(f"Reconciling HAProxy {item_type}s...")
-        changes_made = False
+        changes = logs.ActionCounts()
 
         # Add/Update
         for name, data in desired_map.items():
             if name in current_map:
                 uuid = current_map[name]['uuid']
-                # TODO: Check if update is needed
-                logging.info(f"Updating {item_type} '{name}' (UUID: {uuid})")
+                if not self._is_diverged(item_type, name):
+                    continue
+                logging.debug(f"Updating {item_type} '{name}' (UUID: {uuid})")
                 self._update_opnsense_item(item_type, uuid, data)
-                changes_made = True
+                changes['updated'] += 1
             else:
-                logging.info(f"Adding new {item_type} '{name}'")
+                logging.debug(f"Adding new {item_type} '{name}'")
                 self._add_opnsense_item(item_type, data)
-                changes_made = True
+                changes['added'] += 1
 
         # Delete
-        orphaned = {k: v for k, v in current_map.items() if k not in desired_map and k.startswith('kic-')}
+        orphaned = {k: v for k, v in self._owned(current_map, current_map).items() if k not in desired_map}
         for name, item in orphaned.items():
-            logging.info(f"Deleting orphaned {item_type}: {name}")
+            logging.debug(f"Deleting orphaned {item_type}: {name}")
             self._delete_opnsense_item(item_type, item['uuid'])
-            changes_made = True
+            changes['deleted'] += 1
 
-        return changes_made
+        logging.info(f"Reconciled HAProxy {item_type}s: {changes}.")
+        return bool(changes)
 
-    def _reconcile_actions(self, desired_actions, current_actions, current_acls):
-        """Specific reconciliation for actions to link ACL UUIDs."""
-        logging.info("Reconciling HAProxy Actions...")
-        changes_made = False
+    def _reconcile_actions(self, desired_actions, current_actions, current_acls, owner_acls=None):
+        """
+        Specific reconciliation for actions to link ACL UUIDs.
+        owner_acls are the ACLs from before orphans were deleted, which tell the shard of orphaned actions.
+        """
+        changes = logs.ActionCounts()
 
         # Add/Update
         for name, data in desired_actions.items():
             # Replace ACL names with UUIDs
             acl_uuids = [current_acls[acl_name]['uuid'] for acl_name in data['acls'] if acl_name in current_acls]
             if not acl_uuids:
-                logging.warning(f"Could not find UUIDs for ACLs of action '{name}', skipping.")
+                logs.warning(f"Could not find UUIDs for ACLs of action '{name}', skipping.")
+                self._failed = True
                 continue
 
             data['acls'] = ",".join(acl_uuids) # API likely takes comma-separated UUIDs
 
             if name in current_actions:
                 uuid = current_actions[name]['uuid']
-                logging.info(f"Updating action '{name}' (UUID: {uuid})")
+                if not self._is_diverged('action', name):
+                    continue
+                logging.debug(f"Updating action '{name}' (UUID: {uuid})")
                 self._update_opnsense_item('action', uuid, data)
-                changes_made = True
+                changes['updated'] += 1
             else:
-                logging.info(f"Adding new action '{name}'")
+                logging.debug(f"Adding new action '{name}'")
                 self._add_opnsense_item('action', data)
-                changes_made = True
+                changes['added'] += 1
 
         # Delete (same as generic)
-        orphaned = {k: v for k, v in current_actions.items() if k not in desired_actions and k.startswith('kic-')}
+        orphaned = {k: v for k, v in self._owned(current_actions, owner_acls or current_acls).items() if k not in desired_actions}
         for name, item in orphaned.items():
-            logging.info(f"Deleting orphaned action: {name}")
+            logging.debug(f"Deleting orphaned action: {name}")
             self._delete_opnsense_item('action', item['uuid'])
-            changes_made = True
+            changes['deleted'] += 1
+
+        logging.info(f"Reconciled HAProxy actions: {changes}.")
+        return bool(changes)
 
-        return changes_made
 
+    def _is_diverged(self, item_type, name):
+        """
+        Without a registry every existing item is rewritten, as its previous content is unknown.
+        """
+        return self._diverged is None or f"{item_type}/{name}" in self._diverged
 
     # --- Generic OPNsense API Functions (can be moved to a shared module) ---
     def _get_opnsense_items(self, item_type):
@@ -171,6 +286,7 @@ class HAProxyIngressProxyPlugin:
             self.opnsense_client.post(endpoint, {item_type: item_data})
         except Exception as e:
             logging.error(f"Failed to add {item_type} {item_data.get('name')}: {e}")
+            self._failed = True
 
     def _update_opnsense_item(self, item_type, uuid, item_data):
         endpoint = f'/api/haproxy/settings/set_{item_type}/{uuid}'
@@ -178,6 +294,7 @@ class HAProxyIngressProxyPlugin:
             self.opnsense_client.post(endpoint, {item_type: item_data})
         except Exception as e:
             logging.error(f"Failed to update {item_type} {item_data.get('name')}: {e}")
+            self._failed = True
 
     def _delete_opnsense_item(self, item_type, uuid):
         endpoint = f'/api/haproxy/settings/del_{item_type}/{uuid}'
@@ -185,10 +302,11 @@ class HAProxyIngressProxyPlugin:
             self.opnsense_client.post(endpoint)
         except Exception as e:
             logging.error(f"Failed to delete {item_type} with UUID {uuid}: {e}")
+            self._failed = True
 
-    def _apply_haproxy_changes(self):
+    def _apply_haproxy_changes(self, events=None):
         """
-        Applies the HAProxy changes by calling the reconfigure endpoint.
+        Applies the HAProxy changes by calling the reconfigure endpoint. Returns True on success.
         """
         logging.info("Applying HAProxy configuration changes...")
         endpoint = '/api/haproxy/service/reconfigure'
@@ -196,3 +314,6 @@ class HAProxyIngressProxyPlugin:
             self.opnsense_client.post(endpoint)
         except Exception as e:
             logging.error(f"Failed to apply HAProxy changes: {e}")
+            return False
+        metrics.observe_event_latency('haproxy', events)
+        return True
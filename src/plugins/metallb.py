@@ -1,59 +1,377 @@
+import hashlib
+import json
 import logging
+import re
 from kubernetes import client
+from src import logs, metrics, tracing
+from src.clients import bulk
+from src.registry import fingerprint
+
+# Where the neighbors live in the settings model of each BGP implementation, for bulkWrites
+_BULK_MODELS = {
+    'openbgp': bulk.BulkModel('/api/openbgpd/settings', 'openbgpd', {'neighbor': ('neighbors', 'neighbor')}),
+    'frr': bulk.BulkModel('/api/frr/settings', 'bgp', {'bgp_neighbor': ('neighbors', 'neighbor')}),
+}
+
+# matchExpressions operators of a Kubernetes LabelSelector and their selector string forms
+_SELECTOR_OPERATORS = {
+    'In': lambda key, values: f"{key} in ({','.join(values)})",
+    'NotIn': lambda key, values: f"{key} notin ({','.join(values)})",
+    'Exists': lambda key, values: key,
+    'DoesNotExist': lambda key, values: f"!{key}",
+}
+
+def _format_selector(selector):
+    """
+    Accepts a selector as a Kubernetes selector string, a mapping of labels, or a LabelSelector with
+    matchLabels and matchExpressions, returns the string form. Raises ValueError for an unknown operator,
+    or for In and NotIn without values.
+    """
+    if not selector:
+        return None
+    if isinstance(selector, dict) and ('matchLabels' in selector or 'matchExpressions' in selector):
+        terms = [f"{k}={v}" for k, v in (selector.get('matchLabels') or {}).items()]
+        for expression in selector.get('matchExpressions') or []:
+            operator = _SELECTOR_OPERATORS.get(expression.get('operator'))
+            if operator is None:
+                raise ValueError(f"unsupported matchExpressions operator {expression.get('operator')!r}")
+            if not expression.get('key'):
+                raise ValueError("matchExpressions entry without a key")
+            values = [str(v) for v in expression.get('values') or []]
+            if expression['operator'] in ('In', 'NotIn') and not values:
+                raise ValueError(f"matchExpressions operator {expression['operator']!r} on {expression['key']!r} needs values")
+            terms.append(operator(expression['key'], values))
+        return ",".join(terms) or None
+    if isinstance(selector, dict):
+        return ",".join(f"{k}={v}" for k, v in selector.items())
+    return str(selector)
+
+def _matches_selector(labels, selector):
+    """
+    Evaluates a label selector (k=v, k==v, k!=v, k, !k, k in (a,b), k notin (a,b)) against a node's labels.
+    """
+    # Commas inside the value list of a set-based term do not separate terms
+    for term in re.split(r',(?![^()]*\))', selector or ''):
+        term = term.strip()
+        if not term:
+            continue
+        set_term = re.fullmatch(r'(\S+)\s+(in|notin)\s*\((.*)\)', term)
+        if set_term:
+            key, operator, values = set_term.groups()
+            if (labels.get(key) in {v.strip() for v in values.split(',')}) != (operator == 'in'):
+                return False
+        elif '!=' in term:
+            key, value = (p.strip() for p in term.split('!=', 1))
+            if labels.get(key) == value:
+                return False
+        elif '=' in term:
+            key, value = (p.strip() for p in re.split('==?', term, maxsplit=1))
+            if labels.get(key) != value:
+                return False
+        elif term.startswith('!'):
+            if term[1:].strip() in labels:
+                return False
+        elif term not in labels:
+            return False
+    return True
+
+class _NeighborPartition:
+    """
+    A group of nodes peered with the same neighbor template, diffed independently of other partitions.
+    """
+    def __init__(self, name, template, node_selector=None, max_nodes=None):
+        self.name = name
+        self.template = template
+        self.template_hash = hashlib.sha1(json.dumps(template, sort_keys=True, default=str).encode()).hexdigest()
+        self.node_selector = node_selector
+        self.max_nodes = max_nodes
+        # The unnamed default partition keeps the original kpc-<ip> descriptions
+        self.prefix = f"kpc-{name}-" if name else "kpc-"
+
+        # State of the last successful reconcile
+        self.node_index = None # node name -> IP
+        self.applied_template_hash = None
+
+    def host(self, node_ip):
+        return f"{self.prefix}{node_ip}"
+
+    def select(self, node_index):
+        """
+        Limits the node index to at most max_nodes nodes, picked by name so the choice is stable.
+        """
+        if not self.max_nodes:
+            return node_index
+        return {name: node_index[name] for name in sorted(node_index)[:self.max_nodes]}
+
+    def changed(self, node_index):
+        """
+        Checks whether the neighbor set or the neighbor template changed since the last successful reconcile.
+        """
+        if self.node_index is None:
+            return True
+        if self.applied_template_hash != self.template_hash:
+            return True
+        return set(node_index.values()) != set(self.node_index.values())
 
 class MetalLBPlugin:
-    def __init__(self, k8s_core_v1_api, opnsense_client, config):
+    def __init__(self, k8s_core_v1_api, opnsense_client, config, registry=None, target=None):
         self.k8s_core_v1_api = k8s_core_v1_api
         self.opnsense_client = opnsense_client
         self.config = config
-        self.plugin_id = 'metallb'
+        self.plugin_id = f"metallb@{target}" if target else 'metallb'
+        self.registry = registry
+        # Only touch OPNsense when the node address set or the template changed since the last apply
+        self.incremental = config.get('incremental', True)
+        # An invalid top-level selector disables the plugin, treating it as matching no node would delete every neighbor
+        self.config_error = None
+        try:
+            self.node_label_selector = _format_selector(config.get('nodeLabelSelector'))
+            self.node_field_selector = _format_selector(config.get('nodeFieldSelector'))
+        except ValueError as e:
+            self.node_label_selector = self.node_field_selector = None
+            self.config_error = f"invalid node selector: {e}"
+            logging.error(f"MetalLB plugin disabled, {self.config_error}")
+        self._partitions = self._build_partitions()
+        # (desired state hash, OPNsense change token) after the last successful run
+        self._last_reconciled = None
+        # Hash of the managed neighbor rows after the last successful run, compared by check_drift()
+        self._managed_rows_hash = None
+        # Set when drift was detected, the next run then diffs every partition against OPNsense
+        self._force_full = False
+        # Receives the writes of a run: the client, or with bulkWrites a writer saving them all at once
+        self._writer = opnsense_client
+        # Set while written neighbors still wait for a successful service reload
+        self._apply_pending = False
+        # Longest prefix first, so a partition whose name extends another's owns the right rows
+        self._owner_order = sorted(self._partitions, key=lambda p: len(p.prefix), reverse=True)
 
-    def run(self):
+    def _build_partitions(self):
+        """
+        Builds the neighbor partitions from config. Without 'partitions' all selected nodes form a single group.
+        """
+        template = dict(self.config.get('options', {}).get(self.config.get('bgp-implementation'), {}).get('template') or {})
+        partitions_config = self.config.get('partitions') or []
+        if not partitions_config:
+            return [_NeighborPartition(None, template)]
+
+        partitions = []
+        for p in partitions_config:
+            if not p.get('name'):
+                logging.warning("Skipping MetalLB partition without a name.")
+                continue
+            try:
+                node_selector = _format_selector(p.get('nodeLabelSelector'))
+            except ValueError as e:
+                logging.warning(f"Skipping MetalLB partition '{p['name']}': {e}")
+                continue
+            partitions.append(_NeighborPartition(
+                p['name'],
+                {**template, **(p.get('template') or {})},
+                node_selector=node_selector,
+                max_nodes=p.get('maxNodes'),
+            ))
+        return partitions
+
+    def run(self, events=None):
         """
         Runs the reconciliation loop for the MetalLB plugin.
+        events are the EventStamps of the watch events that triggered this run, if any.
         """
+        if self.config_error:
+            logging.error(f"MetalLB plugin disabled, {self.config_error}")
+            return
+
         logging.info("Running MetalLB plugin reconciliation...")
 
         # 1. Get desired state (from Kubernetes nodes)
-        desired_neighbors = self._get_desired_neighbors()
-        if desired_neighbors is None:
-            return # Error already logged
+        with tracing.span('list_kubernetes', resource='node') as span:
+            nodes = self._get_nodes()
+            if nodes is None:
+                return # Error already logged
+            span.set_attribute('count', len(nodes))
+
+        with tracing.span('desired_state') as span:
+            indexes = self._partition_nodes(nodes)
+            changed = [p for p in self._partitions if not self.incremental or p.changed(indexes[p.name])]
+            span.set_attributes(neighbors=sum(len(index) for index in indexes.values()), changed_partitions=len(changed))
+
+        # After a restart the in-memory indexes are empty, the registry tells whether anything moved meanwhile
+        registry_view = self._registry_view(indexes)
+        if changed and self.incremental and not self._force_full and self.registry and not self.registry.diverged(self.plugin_id, registry_view):
+            for partition in changed:
+                partition.node_index = indexes[partition.name]
+                partition.applied_template_hash = partition.template_hash
+            changed = []
+
+        if not changed and not self._apply_pending:
+            logging.info("Node addresses and neighbor templates unchanged, skipping BGP reconciliation.")
+            return
+
+        state_hash = fingerprint(registry_view)
+        change_token = self.opnsense_client.change_token()
+        if not self._force_full and change_token is not None and self._last_reconciled == (state_hash, change_token):
+            logging.info("Neighbors and OPNsense configuration unchanged, skipping BGP reconciliation.")
+            return
 
         # 2. Get current state (from OPNsense)
+        with tracing.span('fetch_opnsense') as span:
+            current_neighbors = self._get_current_neighbors()
+            if current_neighbors is None:
+                return # Error already logged
+            span.set_attribute('count', len(current_neighbors))
+
+        # 3. Reconcile each changed partition against the rows it owns
+        owned = {p.name: {} for p in self._partitions}
+        unowned = {}
+        for host, row in current_neighbors.items():
+            partition = self._get_owner(host)
+            if partition:
+                owned[partition.name][host] = row
+            elif host.startswith('kpc-'):
+                unowned[host] = row
+
+        changes_made = False
+        all_ok = True
+        self._writer = bulk.writer_for(self.opnsense_client, _BULK_MODELS.get(self.config['bgp-implementation']), self.config.get('bulkWrites', False))
+        for partition in changed:
+            desired_neighbors = self._get_desired_neighbors(partition, indexes[partition.name])
+            partition_changed, ok = self._reconcile(partition, desired_neighbors, owned[partition.name])
+            changes_made = changes_made or partition_changed
+            all_ok = all_ok and ok
+            if ok:
+                partition.node_index = indexes[partition.name]
+                partition.applied_template_hash = partition.template_hash
+            else:
+                # Force a full comparison against OPNsense on the next run
+                partition.node_index = None
+                partition.applied_template_hash = None
+
+        # Neighbors left behind by partitions that were removed from the config
+        if unowned:
+            deleted, ok = self._reconcile(None, {}, unowned)
+            changes_made = changes_made or deleted
+            all_ok = all_ok and ok
+
+        # With bulkWrites, the neighbors of every partition are saved together
+        try:
+            bulk.flush(self._writer)
+        except Exception as e:
+            logging.error(f"Failed to write BGP neighbor changes: {e}")
+            all_ok = False
+            for partition in changed:
+                partition.node_index = None
+                partition.applied_template_hash = None
+
+        if changes_made or self._apply_pending:
+            with tracing.span('apply', service=self.config['bgp-implementation']):
+                self._apply_pending = not self._reload_bgp_service(events)
+            # The written neighbors are not live yet, the next run reloads again
+            all_ok = all_ok and not self._apply_pending
+            # This run's own writes changed the token
+            change_token = self.opnsense_client.change_token(max_age=0)
+        self._last_reconciled = (state_hash, change_token) if all_ok else None
+
+        # Baseline for drift checks, re-read when this run's own writes changed the rows
+        applied = self._get_current_neighbors() if changes_made and all_ok else current_neighbors
+        if all_ok and applied is not None:
+            self._managed_rows_hash = self._hash_managed_rows(applied)
+            self._force_full = False
+        else:
+            self._managed_rows_hash = None
+
+        if self.registry:
+            if all_ok:
+                # The rows read back after the writes hold the UUIDs of the neighbors added by this run
+                rows = applied if applied is not None else current_neighbors
+                uuids = {host: row.get('uuid') for host, row in rows.items() if host in registry_view}
+                self.registry.record(self.plugin_id, registry_view, uuids)
+            else:
+                self.registry.forget(self.plugin_id)
+
+    def check_drift(self):
+        """
+        Cheaply checks whether the managed neighbors were changed on OPNsense since the last successful run.
+        Returns True, and makes the next run diff every partition in full, if they were.
+        """
+        if self.config_error:
+            return False
         current_neighbors = self._get_current_neighbors()
         if current_neighbors is None:
-            return # Error already logged
+            return False
+        if self._managed_rows_hash is not None and self._hash_managed_rows(current_neighbors) == self._managed_rows_hash:
+            return False
+
+        logging.info("Managed BGP neighbors drifted from the last apply, scheduling a full MetalLB reconcile.")
+        for partition in self._partitions:
+            partition.node_index = None
+            partition.applied_template_hash = None
+        self._force_full = True
+        return True
+
+    def caches(self):
+        """
+        The in-memory caches of this plugin by name, for metrics and memory accounting.
+        """
+        return {'node-index': {(p.name, node): ip for p in self._partitions for node, ip in (p.node_index or {}).items()}}
+
+    def _hash_managed_rows(self, current_neighbors):
+        return fingerprint({host: row for host, row in current_neighbors.items() if host.startswith('kpc-')})
 
-        # 3. Reconcile states
-        self._reconcile(desired_neighbors, current_neighbors)
+    def _registry_view(self, indexes):
+        """
+        The neighbors of every partition as recorded in the registry: host -> address and template hash.
+        """
+        view = {}
+        for partition in self._partitions:
+            for node_ip in indexes[partition.name].values():
+                view[partition.host(node_ip)] = {'address': node_ip, 'template': partition.template_hash}
+        return view
 
-    def _get_desired_neighbors(self):
+    def _get_nodes(self):
         """
-        Gets the desired BGP neighbors from Kubernetes nodes.
+        Lists the Kubernetes nodes matching the configured label and field selectors.
         """
-        logging.info("Getting desired BGP neighbors from Kubernetes nodes...")
+        logging.info("Getting node addresses from Kubernetes nodes...")
+        kwargs = {}
+        if self.node_label_selector:
+            kwargs['label_selector'] = self.node_label_selector
+        if self.node_field_selector:
+            kwargs['field_selector'] = self.node_field_selector
         try:
-            nodes = self.k8s_core_v1_api.list_node().items
-            desired = {}
-            for node in nodes:
-                node_ip = self._get_node_ip(node)
-                if not node_ip:
-                    logging.warning(f"Could not find IP for node: {node.metadata.name}")
-                    continue
-
-                host = f"kpc-{node_ip}"
-                neighbor_template = self.config.get('options', {}).get(self.config['bgp-implementation'], {}).get('template', {})
-
-                neighbor = neighbor_template.copy()
-                neighbor['address'] = node_ip
-                neighbor['description'] = host
-                desired[host] = neighbor
-
-            return desired
+            return self.k8s_core_v1_api.list_node(**kwargs).items
         except client.ApiException as e:
             logging.error(f"Error getting Kubernetes nodes: {e}")
             return None
 
+    def _partition_nodes(self, nodes):
+        """
+        Builds a node name -> IP index per partition. Each node joins the first partition whose selector matches it.
+        """
+        indexes = {p.name: {} for p in self._partitions}
+        for node in nodes:
+            node_ip = self._get_node_ip(node)
+            if not node_ip:
+                logs.warning(f"Could not find IP for node: {node.metadata.name}")
+                continue
+            labels = node.metadata.labels or {}
+            partition = next((p for p in self._partitions if _matches_selector(labels, p.node_selector)), None)
+            if partition:
+                indexes[partition.name][node.metadata.name] = node_ip
+        return {p.name: p.select(indexes[p.name]) for p in self._partitions}
+
+    def _get_owner(self, host):
+        return next((p for p in self._owner_order if host.startswith(p.prefix)), None)
+
+    def _get_desired_neighbors(self, partition, node_index):
+        """
+        Gets the desired BGP neighbors of a partition from its node index.
+        """
+        desired = {}
+        for node_ip in node_index.values():
+            host = partition.host(node_ip)
+            desired[host] = {**partition.template, 'address': node_ip, 'description': host}
+        return desired
+
     def _get_current_neighbors(self):
         """
         Gets the current BGP neighbors from OPNsense.
@@ -86,16 +404,27 @@ class MetalLBPlugin:
             logging.error(f"Error getting OPNsense neighbors: {e}")
             return None
 
-    def _reconcile(self, desired, current):
+    def _reconcile(self, partition, desired, current):
         """
-        Compares desired and current states and applies changes.
+        Compares desired and current states of a partition and applies changes.
+        A partition of None deletes every given neighbor.
+        Returns a tuple of (changes_made, ok), where ok is False if any OPNsense call failed.
         """
-        logging.info("Reconciling BGP neighbors...")
         bgp_implementation = self.config['bgp-implementation']
 
-        to_add = {k: v for k, v in desired.items() if k not in current}
-        to_update = {k: v for k, v in desired.items() if k in current and self._needs_update(current[k], v)}
-        to_delete = {k: v for k, v in current.items() if k not in desired and k.startswith('kpc-')} # Only delete managed neighbors
+        with tracing.span('diff', partition=(partition.name or '') if partition else '-') as span:
+            to_add = {k: v for k, v in desired.items() if k not in current}
+            if partition is None:
+                to_update = {}
+            elif not self.incremental or partition.applied_template_hash is None:
+                to_update = {k: v for k, v in desired.items() if k in current and self._needs_update(current[k], v)}
+            elif partition.applied_template_hash != partition.template_hash:
+                to_update = {k: v for k, v in desired.items() if k in current}
+            else:
+                # The template was already applied to every existing neighbor
+                to_update = {}
+            to_delete = {k: v for k, v in current.items() if k not in desired and k.startswith('kpc-')} # Only delete managed neighbors
+            span.set_attributes(adds=len(to_add), updates=len(to_update), deletes=len(to_delete))
 
         endpoint_map = {
             'openbgp': '/api/openbgpd/settings/',
@@ -107,48 +436,65 @@ class MetalLBPlugin:
         set_endpoint = base_endpoint + ('set_neighbor' if bgp_implementation == 'openbgp' else 'set_bgp_neighbor')
         del_endpoint = base_endpoint + ('del_neighbor' if bgp_implementation == 'openbgp' else 'del_bgp_neighbor')
 
-        # Add new neighbors
-        for host, neighbor in to_add.items():
-            logging.info(f"Adding neighbor: {host}")
-            try:
-                self.opnsense_client.post(add_endpoint, {'neighbor': neighbor})
-            except Exception as e:
-                logging.error(f"Failed to add neighbor {host}: {e}")
-
-        # Update existing neighbors
-        for host, neighbor in to_update.items():
-            logging.info(f"Updating neighbor: {host}")
-            uuid = current[host]['uuid']
-            try:
-                self.opnsense_client.post(f"{set_endpoint}/{uuid}", {'neighbor': neighbor})
-            except Exception as e:
-                logging.error(f"Failed to update neighbor {host}: {e}")
-
-        # Delete old neighbors
-        for host, neighbor in to_delete.items():
-            logging.info(f"Deleting neighbor: {host}")
-            uuid = neighbor['uuid']
-            try:
-                self.opnsense_client.post(f"{del_endpoint}/{uuid}")
-            except Exception as e:
-                logging.error(f"Failed to delete neighbor {host}: {e}")
+        ok = True
+
+        with tracing.span('mutate'):
+            # Add new neighbors
+            for host, neighbor in to_add.items():
+                logging.debug(f"Adding neighbor: {host}")
+                try:
+                    self._writer.post(add_endpoint, {'neighbor': neighbor})
+                except Exception as e:
+                    logging.error(f"Failed to add neighbor {host}: {e}")
+                    ok = False
+
+            # Update existing neighbors
+            for host, neighbor in to_update.items():
+                logging.debug(f"Updating neighbor: {host}")
+                uuid = current[host]['uuid']
+                try:
+                    self._writer.post(f"{set_endpoint}/{uuid}", {'neighbor': neighbor})
+                except Exception as e:
+                    logging.error(f"Failed to update neighbor {host}: {e}")
+                    ok = False
 
-        if to_add or to_update or to_delete:
-            self._reload_bgp_service()
+            # Delete old neighbors
+            for host, neighbor in to_delete.items():
+                logging.debug(f"Deleting neighbor: {host}")
+                uuid = neighbor['uuid']
+                try:
+                    self._writer.post(f"{del_endpoint}/{uuid}")
+                except Exception as e:
+                    logging.error(f"Failed to delete neighbor {host}: {e}")
+                    ok = False
+
+        changes = logs.ActionCounts(added=len(to_add), updated=len(to_update), deleted=len(to_delete))
+        logging.info(f"Reconciled BGP neighbors{f' for partition {partition.name}' if partition and partition.name else ''}: {changes}.")
+        return bool(to_add or to_update or to_delete), ok
 
     def _needs_update(self, current, desired):
         """
         Checks if a neighbor needs to be updated.
-        Compares all keys from the desired state.
+        Compares the scalar keys of the desired state that the search row exposes, using the
+        string encoding OPNsense returns (e.g. booleans as '1'/'0', empty values as '').
         """
         for key, value in desired.items():
-            if current.get(key) != value:
+            if key not in current or isinstance(value, (dict, list)):
+                continue
+            if self._encode_value(current[key]) != self._encode_value(value):
                 return True
         return False
 
-    def _reload_bgp_service(self):
+    def _encode_value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        return str(value)
+
+    def _reload_bgp_service(self, events=None):
         """
-        Reloads the appropriate BGP service on OPNsense.
+        Reloads the appropriate BGP service on OPNsense. Returns True on success.
         """
         bgp_implementation = self.config['bgp-implementation']
         logging.info(f"Reloading {bgp_implementation} service...")
@@ -161,7 +507,7 @@ class MetalLBPlugin:
 
         if not reload_endpoint:
             logging.error(f"No reload endpoint defined for {bgp_implementation}")
-            return
+            return False
 
         try:
             # The reload endpoint might be different, this is a guess based on the PHP code's function names
@@ -171,6 +517,9 @@ class MetalLBPlugin:
             logging.info(f"Successfully reloaded {bgp_implementation} service.")
         except Exception as e:
             logging.error(f"Failed to reload {bgp_implementation} service: {e}")
+            return False
+        metrics.observe_event_latency(bgp_implementation, events)
+        return True
 
     def _get_node_ip(self, node):
         """
@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from collections.abc import Mapping
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from src import tracing
+
+DEFAULT_PROFILE_SECONDS = 30
+DEFAULT_SAMPLE_INTERVAL = 0.005
+_MAX_PROFILE_SECONDS = 600
+
+# Objects exposing caches() -> {name: cache}, registered by the controller
+_cache_owners = []
+# Only one profile runs at a time
+_profile_lock = threading.Lock()
+
+def track(*owners):
+    """
+    Registers the objects whose caches are included in memory accounting.
+    """
+    _cache_owners.extend(owner for owner in owners if owner is not None)
+
+def untrack(*owners):
+    """
+    Stops including the caches of owners, e.g. plugins retired by a configuration reload.
+    """
+    _cache_owners[:] = [owner for owner in _cache_owners if all(owner is not o for o in owners)]
+
+def deep_sizeof(obj, seen=None):
+    """
+    Approximates the memory held by obj and everything it references through containers and instance attributes.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, Mapping):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+def cache_report():
+    """
+    Returns the number of entries and approximate memory of every registered cache.
+    """
+    report = {}
+    for owner in _cache_owners:
+        prefix = getattr(owner, 'plugin_id', None)
+        for name, cache in owner.caches().items():
+            key = f"{prefix}/{name}" if prefix else name
+            try:
+                # Caches are read without their owner's lock, a concurrent update just means trying again later
+                report[key] = {'entries': len(cache), 'bytes': deep_sizeof(cache)}
+            except RuntimeError as e:
+                report[key] = {'error': str(e)}
+    return report
+
+class _Sampler:
+    """
+    Periodically samples the stacks of all threads and counts them in collapsed-stack form,
+    prefixed with the plugin and trace phase the thread was working on.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+
+    def run(self, seconds):
+        own = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            spans = tracing.thread_spans()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                self.stacks[self._label(names.get(ident, str(ident)), spans.get(ident), frame)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def _label(self, thread_name, span, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        frames.reverse()
+
+        prefix = [thread_name]
+        if span is not None:
+            prefix.append(f"plugin:{span.root.attributes.get('plugin', span.root.name)}")
+            if span is not span.root:
+                prefix.append(f"phase:{span.name}")
+        return ';'.join(prefix + frames)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def summary(self, top=10):
+        by_plugin = Counter()
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            parts = stack.split(';')
+            plugin = next((p[len('plugin:'):] for p in parts if p.startswith('plugin:')), None)
+            if plugin:
+                by_plugin[plugin] += count
+                leaves[parts[-1]] += count
+        return {
+            'samples': self.samples,
+            'by_plugin': dict(by_plugin.most_common()),
+            'top_functions_in_plugins': dict(leaves.most_common(top)),
+        }
+
+def profile(seconds=DEFAULT_PROFILE_SECONDS, interval=DEFAULT_SAMPLE_INTERVAL, output_dir=None):
+    """
+    Samples all threads and traces memory allocations for the given number of seconds, then writes
+    <prefix>.collapsed (stacks for flame graphs), <prefix>.tracemalloc.txt and <prefix>.caches.json.
+    Returns a summary with the written paths, or None if another profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = min(max(float(seconds), 0.1), _MAX_PROFILE_SECONDS)
+        output_dir = output_dir or os.getenv('CONTROLLER_PROFILE_DIR') or tempfile.gettempdir()
+        prefix = os.path.join(output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}")
+        logging.info(f"Profiling for {seconds:.0f}s, writing results to {prefix}.*")
+
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start(25)
+        before = tracemalloc.take_snapshot()
+        tracing.set_profiling(True)
+        sampler = _Sampler(interval)
+        try:
+            sampler.run(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracing.set_profiling(False)
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+        sampler.write(f"{prefix}.collapsed")
+        _write_tracemalloc(f"{prefix}.tracemalloc.txt", before, after)
+        caches = cache_report()
+        with open(f"{prefix}.caches.json", 'w') as f:
+            json.dump(caches, f, indent=2, sort_keys=True)
+
+        result = sampler.summary()
+        result['caches'] = caches
+        result['files'] = [f"{prefix}.collapsed", f"{prefix}.tracemalloc.txt", f"{prefix}.caches.json"]
+        logging.info(f"Profile finished: {result['samples']} samples, files {', '.join(result['files'])}")
+        return result
+    finally:
+        _profile_lock.release()
+
+def _write_tracemalloc(path, before, after, top=50):
+    with open(path, 'w') as f:
+        f.write("# Allocations grown during the profile\n")
+        for stat in after.compare_to(before, 'lineno')[:top]:
+            f.write(f"{stat}\n")
+        f.write("\n# Largest live allocations at the end of the profile\n")
+        for stat in after.statistics('lineno')[:top]:
+            f.write(f"{stat}\n")
+
+class _DebugHandler(BaseHTTPRequestHandler):
+    """
+    GET /debug/profile?seconds=N runs a profile and returns its summary, GET /debug/caches returns the cache report.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/debug/caches':
+            self._respond(200, cache_report())
+        elif url.path == '/debug/profile':
+            seconds = parse_qs(url.query).get('seconds', [DEFAULT_PROFILE_SECONDS])[0]
+            try:
+                result = profile(seconds)
+            except ValueError:
+                self._respond(400, {'error': f"invalid seconds: {seconds}"})
+                return
+            if result is None:
+                self._respond(409, {'error': 'a profile is already running'})
+            else:
+                self._respond(200, result)
+        else:
+            self._respond(404, {'error': 'not found'})
+
+    def _respond(self, status, body):
+        payload = json.dumps(body, indent=2, sort_keys=True).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logging.info(f"Debug endpoint: {format % args}")
+
+def start_debug_server():
+    """
+    Serves the profiling endpoints on CONTROLLER_DEBUG_PORT. Disabled unless the port is set.
+    """
+    port = int(os.getenv('CONTROLLER_DEBUG_PORT', '0'))
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('', port), _DebugHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving profiling endpoints on port {port}.")
+    return server
+
+def install_signal_handler(signum=signal.SIGUSR1):
+    """
+    Starts a background profile of DEFAULT_PROFILE_SECONDS when the process receives signum (SIGUSR1 by default).
+    Must be called from the main thread.
+    """
+    def handler(received, frame):
+        threading.Thread(target=profile, daemon=True).start()
+    signal.signal(signum, handler)
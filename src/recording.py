@@ -0,0 +1,92 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+# Seconds between flushes, so a crash loses at most this much of a recording without flushing every line
+_FLUSH_INTERVAL = 1.0
+
+_recorder = None
+
+class Recorder:
+    """
+    Writes Kubernetes watch events and OPNsense API exchanges to a file, one JSON object per line,
+    gzip-compressed when the path ends in .gz. Every record carries 't', the seconds since recording
+    started, so a replay can reproduce the timing of a burst.
+
+    Records are either
+        {'t', 'kind': 'event', 'resource', 'type', 'object'} with the raw Kubernetes object, or
+        {'t', 'kind': 'opnsense', 'method', 'endpoint', 'request', 'status', 'response', 'duration'}.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = gzip.open(path, 'at') if path.endswith('.gz') else open(path, 'a')
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._flushed_at = self._start
+        self.records = 0
+
+    def write(self, record):
+        now = time.monotonic()
+        line = json.dumps({'t': round(now - self._start, 4), **record}, separators=(',', ':'), default=str)
+        try:
+            with self._lock:
+                self._file.write(line + '\n')
+                self.records += 1
+                if now - self._flushed_at >= _FLUSH_INTERVAL:
+                    self._file.flush()
+                    self._flushed_at = now
+        except Exception as e:
+            logging.error(f"Error writing recording to {self.path}: {e}")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def record_event(resource_type, event_type, obj):
+    """
+    Records a watch event. obj is the raw (JSON-decoded) Kubernetes object.
+    """
+    if _recorder is not None:
+        _recorder.write({'kind': 'event', 'resource': resource_type, 'type': event_type, 'object': obj})
+
+def record_opnsense(method, endpoint, request, status, response, duration):
+    """
+    Records an OPNsense API call and its response. status is None if no response was received.
+    """
+    if _recorder is not None:
+        _recorder.write({'kind': 'opnsense', 'method': method, 'endpoint': endpoint, 'request': request,
+                         'status': status, 'response': response, 'duration': round(duration, 4)})
+
+def enabled():
+    return _recorder is not None
+
+def set_recorder(recorder):
+    global _recorder
+    _recorder = recorder
+
+def close():
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        logging.info(f"Closed recording {_recorder.path} ({_recorder.records} records).")
+        _recorder = None
+
+def configure_from_env():
+    """
+    Records watch events and OPNsense exchanges to the file named by CONTROLLER_RECORD_FILE, if set.
+    """
+    path = os.getenv('CONTROLLER_RECORD_FILE')
+    if path:
+        set_recorder(Recorder(path))
+        logging.info(f"Recording watch events and OPNsense responses to {path}.")
+
+def load(path):
+    """
+    Reads a recording written by Recorder, oldest record first.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return [json.loads(line) for line in f if line.strip()]
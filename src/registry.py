@@ -0,0 +1,213 @@
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from kubernetes import client
+from src import logs
+
+def fingerprint(obj):
+    """
+    Returns a stable hash of a JSON-serializable object.
+    """
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+class FileStore:
+    """
+    Persists the registry as JSON in a local file, e.g. on an emptyDir or persistent volume.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write(self, data):
+        # Write to a temp file of its own and rename so a crash never leaves a truncated registry behind
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(self.path) or '.', prefix=f"{os.path.basename(self.path)}.", suffix='.tmp', delete=False) as f:
+            json.dump(data, f, sort_keys=True)
+        try:
+            os.replace(f.name, self.path)
+        except OSError:
+            os.unlink(f.name)
+            raise
+
+    def __str__(self):
+        return f"file {self.path}"
+
+class ConfigMapStore:
+    """
+    Persists the registry in a ConfigMap, one gzipped JSON binaryData key per plugin, so a change
+    only rewrites the keys of the plugins it touched. A ConfigMap holds at most 1 MiB; a registry
+    that would not fit is not persisted, and the stored one is cleared so the next start is cold
+    rather than trusting entries that are out of date.
+    """
+    # Room for the base64 encoded keys, leaving some of the 1 MiB ConfigMap limit to the metadata
+    MAX_BYTES = 900 * 1024
+
+    def __init__(self, k8s_core_v1_api, namespace, name):
+        self.k8s_core_v1_api = k8s_core_v1_api
+        self.namespace = namespace
+        self.name = name
+        # Key -> base64 value as last read or written, to patch only the keys that changed;
+        # ManagedObjectRegistry never calls read and write concurrently
+        self._written = {}
+
+    def read(self):
+        try:
+            cm = self.k8s_core_v1_api.read_namespaced_config_map(self.name, self.namespace)
+        except client.ApiException as e:
+            if e.status == 404:
+                return {}
+            raise
+        self._written = dict(cm.binary_data or {})
+        data = {}
+        for value in self._written.values():
+            data.update(json.loads(gzip.decompress(base64.b64decode(value))))
+        return data
+
+    def write(self, data):
+        values = {self._key(plugin_id): self._encode({plugin_id: entries}) for plugin_id, entries in data.items()}
+        size = sum(len(value) for value in values.values())
+        if size > self.MAX_BYTES:
+            logs.warning(f"Managed-object registry needs {size} bytes, more than {self} can hold ({self.MAX_BYTES}); "
+                         f"not persisting it, the next start is a cold reconcile.", key=('registry-size', str(self)))
+            values = {}
+        changes = {key: value for key, value in values.items() if self._written.get(key) != value}
+        # A null value removes the key from the ConfigMap
+        changes.update({key: None for key in self._written.keys() - values.keys()})
+        if not changes:
+            return
+        try:
+            self.k8s_core_v1_api.patch_namespaced_config_map(self.name, self.namespace, {'binaryData': changes})
+        except client.ApiException as e:
+            if e.status != 404:
+                raise
+            body = {'metadata': {'name': self.name, 'namespace': self.namespace}, 'binaryData': values}
+            self.k8s_core_v1_api.create_namespaced_config_map(self.namespace, body)
+        self._written = values
+
+    @staticmethod
+    def _key(plugin_id):
+        # ConfigMap keys only allow [-._a-zA-Z0-9]; the hash keeps sanitized plugin IDs apart
+        safe_id = re.sub(r'[^-._a-zA-Z0-9]', '_', plugin_id)
+        return f"{safe_id}-{hashlib.sha1(plugin_id.encode()).hexdigest()[:8]}.json.gz"
+
+    @staticmethod
+    def _encode(data):
+        # mtime=0 keeps the output of unchanged entries identical, so they are not rewritten
+        return base64.b64encode(gzip.compress(json.dumps(data, sort_keys=True).encode(), mtime=0)).decode()
+
+    def __str__(self):
+        return f"ConfigMap {self.namespace}/{self.name}"
+
+class ManagedObjectRegistry:
+    """
+    Remembers, per plugin, the objects the controller last applied to OPNsense:
+    object key -> {'hash': <content fingerprint>, 'uuid': <OPNsense UUID, if known>}.
+
+    Loaded at startup so a restarted controller can tell which objects diverged
+    since the last successful apply instead of rewriting everything.
+    """
+    def __init__(self, store):
+        self.store = store
+        self._data = {}
+        self._lock = threading.Lock()
+        # Held from taking a snapshot until it is written, so saves reach the store in order
+        self._save_lock = threading.Lock()
+
+    def load(self):
+        with self._save_lock:
+            try:
+                data = self.store.read()
+            except Exception as e:
+                logging.error(f"Error loading managed-object registry from {self.store}, starting empty: {e}")
+                data = {}
+            with self._lock:
+                self._data = data
+        logging.info(f"Loaded managed-object registry from {self.store} ({self.object_count()} objects).")
+
+    def get(self, plugin_id):
+        """
+        Returns a copy of the entries recorded for a plugin.
+        """
+        with self._lock:
+            return dict(self._data.get(plugin_id, {}))
+
+    def diverged(self, plugin_id, desired):
+        """
+        Returns the keys whose desired content differs from what was last applied, including
+        keys that are new or no longer desired. An empty set means OPNsense needs no changes.
+        """
+        entries = self.get(plugin_id)
+        changed = {key for key, obj in desired.items() if entries.get(key, {}).get('hash') != fingerprint(obj)}
+        return changed | (entries.keys() - desired.keys())
+
+    def record(self, plugin_id, desired, uuids=None):
+        """
+        Records the desired objects as successfully applied and persists the registry if anything changed.
+        """
+        uuids = uuids or {}
+        entries = {key: {'hash': fingerprint(obj), 'uuid': uuids.get(key)} for key, obj in desired.items()}
+        with self._save_lock:
+            with self._lock:
+                if self._data.get(plugin_id) == entries:
+                    return
+                self._data[plugin_id] = entries
+                snapshot = dict(self._data)
+            self._save(snapshot)
+
+    def forget(self, plugin_id):
+        """
+        Drops a plugin's entries, forcing a full reconcile on its next run.
+        """
+        with self._save_lock:
+            with self._lock:
+                if plugin_id not in self._data:
+                    return
+                del self._data[plugin_id]
+                snapshot = dict(self._data)
+            self._save(snapshot)
+
+    def caches(self):
+        """
+        The recorded entries by plugin, for memory accounting. Must not be modified.
+        """
+        return {'registry': self._data}
+
+    def object_count(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._data.values())
+
+    def _save(self, snapshot):
+        try:
+            self.store.write(snapshot)
+        except Exception as e:
+            logging.error(f"Error saving managed-object registry to {self.store}: {e}")
+
+def from_env(k8s_core_v1_api, shard=None):
+    """
+    Creates the registry configured through CONTROLLER_REGISTRY_FILE or CONTROLLER_REGISTRY_CONFIGMAP.
+    Returns None when neither is set. Each shard keeps its own ConfigMap, suffixed with its index,
+    so shards do not overwrite each other's entries.
+    """
+    path = os.getenv('CONTROLLER_REGISTRY_FILE')
+    if path:
+        return ManagedObjectRegistry(FileStore(path))
+
+    name = os.getenv('CONTROLLER_REGISTRY_CONFIGMAP')
+    if name:
+        namespace = os.getenv('CONTROLLER_NAMESPACE', 'kube-system')
+        if shard is not None:
+            name = f"{name}-{shard.index}"
+        return ManagedObjectRegistry(ConfigMapStore(k8s_core_v1_api, namespace, name))
+
+    return None
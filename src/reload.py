@@ -0,0 +1,103 @@
+import logging
+import threading
+from src import profiling
+
+# Options read on every use instead of at construction; changing only these updates the running plugin in place
+RUNTIME_OPTIONS = ('resyncInterval', 'resyncJitter')
+
+# The configuration sections each plugin is built from, by plugin ID
+PLUGIN_SECTIONS = {
+    'metallb': ('metallb',),
+    'haproxy-declarative': ('haproxy-declarative',),
+    'haproxy-ingress-proxy': ('haproxy-ingress-proxy',),
+    'dns-services': ('opnsense-dns-services',),
+    'dns-ingresses': ('opnsense-dns-ingresses',),
+    'dns-haproxy-ingress-proxy': ('opnsense-dns-haproxy-ingress-proxy', 'haproxy-ingress-proxy'),
+}
+
+def _without_runtime_options(section):
+    if not isinstance(section, dict):
+        return section
+    return {k: v for k, v in section.items() if k not in RUNTIME_OPTIONS}
+
+def plugin_inputs(plugin_id, controller_config):
+    """
+    The parts of the controller configuration a plugin's construction depends on.
+    """
+    # Instances per firewall are named <plugin>@<target>
+    sections = PLUGIN_SECTIONS.get(plugin_id.split('@')[0], ())
+    return [_without_runtime_options(controller_config.get(section)) for section in sections]
+
+class PluginReloader:
+    """
+    Applies a changed controller configuration to the running plugins.
+
+    Plugins whose configuration is unchanged keep running untouched, with their caches. Plugins that only
+    had runtime options such as resyncInterval changed get the new section in place. Only the plugins
+    whose construction inputs changed are rebuilt and queued for a run; removed plugins are retired.
+
+    plugins, watch_map and plugin_locks are the structures shared with the worker, watch and resync
+    threads. They are updated in place, so those threads pick up the new plugins on their next use.
+    build(controller_config) returns (plugins, watch_map) like load_plugins.
+    """
+    def __init__(self, controller_config, plugins, watch_map, plugin_locks, queue, build, on_reloaded=None):
+        self.controller_config = controller_config
+        self.plugins = plugins
+        self.watch_map = watch_map
+        self.plugin_locks = plugin_locks
+        self.queue = queue
+        self.build = build
+        # Called with (added, removed) plugins once a reload is in effect
+        self.on_reloaded = on_reloaded
+        self._lock = threading.Lock()
+
+    def apply(self, controller_config):
+        """
+        Switches to controller_config. Returns the plugin IDs that were (re)built, retuned and removed.
+        """
+        with self._lock:
+            if controller_config == self.controller_config:
+                return [], [], []
+
+            candidates, candidate_watch_map = self.build(controller_config)
+            current = {plugin.plugin_id: plugin for plugin in self.plugins}
+            kept, rebuilt, retuned = {}, [], []
+            for candidate in candidates:
+                plugin_id = candidate.plugin_id
+                running = current.get(plugin_id)
+                if running is not None and plugin_inputs(plugin_id, self.controller_config) == plugin_inputs(plugin_id, controller_config):
+                    kept[candidate] = running
+                    if running.config != candidate.config:
+                        running.config = candidate.config
+                        retuned.append(plugin_id)
+                else:
+                    kept[candidate] = candidate
+                    rebuilt.append(candidate)
+
+            plugins = list(kept.values())
+            removed = [plugin for plugin in self.plugins if plugin not in plugins]
+            for plugin in rebuilt:
+                # A replacement waits for any run of the plugin it replaces to finish
+                replaced = current.get(plugin.plugin_id)
+                self.plugin_locks[plugin] = self.plugin_locks[replaced] if replaced is not None else threading.Lock()
+
+            self.plugins[:] = plugins
+            for resource_type in set(self.watch_map) | set(candidate_watch_map):
+                self.watch_map[resource_type] = [kept[p] for p in candidate_watch_map.get(resource_type, [])]
+            for plugin in removed:
+                # Queued runs of retired plugins are skipped by the workers
+                self.plugin_locks.pop(plugin, None)
+            self.controller_config = controller_config
+
+            profiling.untrack(*removed)
+            profiling.track(*rebuilt)
+            if self.on_reloaded:
+                self.on_reloaded(rebuilt, removed)
+            for plugin in rebuilt:
+                self.queue.add(plugin)
+
+        rebuilt_ids = [p.plugin_id for p in rebuilt]
+        removed_ids = [p.plugin_id for p in removed if p.plugin_id not in rebuilt_ids]
+        logging.info(f"Reloaded the controller configuration: rebuilt {rebuilt_ids or 'no plugins'}, "
+                     f"retuned {retuned or 'no plugins'}, removed {removed_ids or 'no plugins'}.")
+        return rebuilt_ids, retuned, removed_ids
@@ -0,0 +1,66 @@
+import functools
+import hashlib
+import logging
+import os
+import re
+
+# The namespace in the descriptions of controller-owned rows: 'Managed by K8s <Kind> <namespace>/<name>'
+_OWNER_NAMESPACE = re.compile(r'Managed by K8s \S+ ([^/\s]+)/')
+
+@functools.lru_cache(maxsize=65536)
+def shard_of(namespace, count):
+    """
+    Assigns a namespace to one of count shards by rendezvous hashing, so changing the
+    number of shards only moves the namespaces of the added or removed shards.
+    """
+    return max(range(count), key=lambda index: hashlib.sha1(f"{index}/{namespace}".encode()).digest())
+
+class Shard:
+    """
+    One replica's share of the namespaces when namespaced plugins are split across replicas.
+    """
+    def __init__(self, index, count):
+        if not 0 <= index < count:
+            raise ValueError(f"shard index {index} is not between 0 and {count - 1}")
+        self.index = index
+        self.count = count
+
+    def owns(self, namespace):
+        return shard_of(namespace or '', self.count) == self.index
+
+    def owns_description(self, description):
+        """
+        Whether a controller-owned OPNsense row belongs to this shard, judged by the namespace in its
+        description. Rows without one (e.g. written by older versions) belong to shard 0.
+        """
+        match = _OWNER_NAMESPACE.search(description or '')
+        return self.owns(match.group(1)) if match else self.index == 0
+
+    def select(self, objects):
+        """
+        Filters Kubernetes objects down to the ones in this shard's namespaces.
+        """
+        return [obj for obj in objects if self.owns(obj.metadata.namespace)]
+
+    def __str__(self):
+        return f"shard-{self.index}-of-{self.count}"
+
+def from_env():
+    """
+    Creates the replica's Shard from CONTROLLER_SHARD_COUNT and CONTROLLER_SHARD_INDEX, falling back to
+    the ordinal at the end of POD_NAME as set for StatefulSet pods. Returns None when not sharding.
+    """
+    count = int(os.getenv('CONTROLLER_SHARD_COUNT', '1'))
+    if count <= 1:
+        return None
+
+    index = os.getenv('CONTROLLER_SHARD_INDEX')
+    if index is None:
+        ordinal = re.search(r'-(\d+)$', os.getenv('POD_NAME', ''))
+        if not ordinal:
+            raise ValueError("CONTROLLER_SHARD_COUNT is set, but neither CONTROLLER_SHARD_INDEX nor a POD_NAME ending in an ordinal is")
+        index = ordinal.group(1)
+
+    shard = Shard(int(index), count)
+    logging.info(f"Reconciling the namespaces of {shard}.")
+    return shard
@@ -0,0 +1,35 @@
+import logging
+import time
+
+class StartupTimer:
+    """
+    Records how long each startup phase took, in wall-clock and CPU time, and logs them as one line.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.started_cpu = time.process_time()
+        self._last = (self.started, self.started_cpu)
+        # [(phase, wall seconds, CPU seconds)]
+        self.phases = []
+
+    def mark(self, phase):
+        """
+        Ends a phase at the current time; it started where the previous phase ended.
+        """
+        now = (time.monotonic(), time.process_time())
+        self.phases.append((phase, now[0] - self._last[0], now[1] - self._last[1]))
+        self._last = now
+
+    def total(self):
+        """
+        Returns (wall seconds, CPU seconds) since the timer was created up to the last mark.
+        """
+        return self._last[0] - self.started, self._last[1] - self.started_cpu
+
+    def summary(self):
+        phases = ', '.join(f"{phase} {wall * 1000:.0f}ms ({cpu * 1000:.0f}ms CPU)" for phase, wall, cpu in self.phases)
+        wall, cpu = self.total()
+        return f"{wall * 1000:.0f}ms ({cpu * 1000:.0f}ms CPU): {phases}"
+
+    def log(self, message):
+        logging.info(f"{message} after {self.summary()}")
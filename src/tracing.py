@@ -0,0 +1,211 @@
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+# The innermost open span of the current thread (or of the task it was propagated to)
+_current_span = contextvars.ContextVar('current_span', default=None)
+_exporter = None
+# Thread ident -> innermost open span, so a profiler sampling other threads can attribute them
+_thread_spans = {}
+# While set, child spans are recorded even without an exporter
+_profiling = False
+
+class Span:
+    """
+    A timed operation within a trace, following the OpenTelemetry data model.
+    """
+    def __init__(self, name, trace_id, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.root = parent.root if parent else self
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        # Finished spans of the whole trace, exported together when the root span ends
+        self._finished = parent._finished if parent else []
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_otlp(self):
+        """
+        Encodes the span as in the OTLP/JSON format.
+        """
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 'SPAN_KIND_INTERNAL',
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': _otlp_attributes(self.attributes),
+            'status': {'code': 'STATUS_CODE_ERROR', 'message': self.error} if self.error else {'code': 'STATUS_CODE_OK'},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+class _NoopSpan:
+    """
+    Stands in for child spans when nothing is exported, so instrumented code costs next to nothing.
+    """
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def _otlp_attributes(attributes):
+    encoded = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            encoded_value = {'boolValue': value}
+        elif isinstance(value, int):
+            encoded_value = {'intValue': str(value)}
+        elif isinstance(value, float):
+            encoded_value = {'doubleValue': value}
+        else:
+            encoded_value = {'stringValue': str(value)}
+        encoded.append({'key': key, 'value': encoded_value})
+    return encoded
+
+class FileExporter:
+    """
+    Appends each finished trace to a file as one line of OTLP/JSON (the format of the
+    OpenTelemetry Collector's file exporter), so traces can be inspected or replayed offline.
+    """
+    def __init__(self, path, service_name='kubernetes-opnsense-controller'):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': self.service_name})},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [s.to_otlp() for s in spans]}],
+        }]})
+        try:
+            with self._lock, open(self.path, 'a') as f:
+                f.write(line + '\n')
+        except Exception as e:
+            logging.error(f"Error exporting trace to {self.path}: {e}")
+
+@contextmanager
+def _activate(span):
+    token = _current_span.set(span)
+    restore = _enter_thread(span)
+    try:
+        yield span
+    except Exception as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        restore()
+        _current_span.reset(token)
+        span.end_ns = time.time_ns()
+        span._finished.append(span)
+        if span.parent_id is None and _exporter is not None:
+            _exporter.export(span._finished)
+
+def trace(name, **attributes):
+    """
+    Starts a new trace with a root span. The trace ID is attached to every log record emitted inside it.
+    """
+    return _activate(Span(name, secrets.token_hex(16), attributes=attributes))
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Opens a child span of the current span. Outside a trace, or when spans are neither exported nor profiled,
+    yields a no-op span.
+    """
+    parent = _current_span.get()
+    if parent is None or (_exporter is None and not _profiling):
+        yield _NOOP_SPAN
+        return
+    with _activate(Span(name, parent.trace_id, parent, attributes)) as child:
+        yield child
+
+def propagate(fn):
+    """
+    Wraps fn so that, when run on an executor thread, its spans become children of the span current at wrap time.
+    """
+    parent = _current_span.get()
+
+    def run(*args, **kwargs):
+        token = _current_span.set(parent)
+        restore = _enter_thread(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            restore()
+            _current_span.reset(token)
+    return run
+
+def _enter_thread(span):
+    """
+    Marks span as the innermost span of the calling thread. Returns a function restoring the previous one.
+    """
+    ident = threading.get_ident()
+    previous = _thread_spans.get(ident)
+    if span is not None:
+        _thread_spans[ident] = span
+
+    def restore():
+        if previous is None:
+            _thread_spans.pop(ident, None)
+        else:
+            _thread_spans[ident] = previous
+    return restore
+
+def thread_spans():
+    """
+    Returns a snapshot of the innermost open span of every thread inside a trace.
+    """
+    return dict(_thread_spans)
+
+def set_profiling(enabled):
+    global _profiling
+    _profiling = enabled
+
+def current_trace_id():
+    current = _current_span.get()
+    return current.trace_id if current else None
+
+def install_log_context():
+    """
+    Adds a trace_id field to every log record, '-' outside a trace, for use in log formats.
+    """
+    factory = logging.getLogRecordFactory()
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.trace_id = current_trace_id() or '-'
+        return record
+    logging.setLogRecordFactory(record_factory)
+
+def set_exporter(exporter):
+    global _exporter
+    _exporter = exporter
+
+def configure_from_env():
+    """
+    Exports traces to the file named by CONTROLLER_TRACE_FILE. Without it, traces only provide log trace IDs.
+    """
+    path = os.getenv('CONTROLLER_TRACE_FILE')
+    if path:
+        set_exporter(FileExporter(path))
+        logging.info(f"Exporting reconcile traces to {path}.")
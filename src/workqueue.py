@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import deque
+
+class EventStamp:
+    """
+    Records when the watch layer received the Kubernetes event that triggered a reconcile.
+    """
+    def __init__(self, resource_type, event_type, namespace, name, resource_version, received_at=None):
+        self.resource_type = resource_type
+        self.event_type = event_type
+        self.namespace = namespace
+        self.name = name
+        self.resource_version = resource_version
+        # Monotonic, only meaningful as a difference to another time.monotonic() reading
+        self.received_at = time.monotonic() if received_at is None else received_at
+
+    def age(self):
+        return time.monotonic() - self.received_at
+
+    def __repr__(self):
+        return f"EventStamp({self.resource_type} {self.event_type} {self.namespace}/{self.name}@{self.resource_version})"
+
+class WorkQueue:
+    """
+    A coalescing work queue in the spirit of client-go's workqueue.
+
+    An item added while it is already pending is merged into the pending entry, so a burst of
+    events for one plugin results in a single run. An item is never handed to two workers at
+    once: if it is re-added while being processed, it is queued again once done() is called.
+
+    Event stamps passed to add() are collected per item until a worker picks it up, so a run
+    triggered by several coalesced events can report the latency of each of them.
+    """
+    def __init__(self):
+        self._queue = deque()
+        self._dirty = set()
+        self._processing = set()
+        # item -> stamps of the events waiting for the next run, and of the events the current run serves
+        self._stamps = {}
+        self._processing_stamps = {}
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self.adds = 0
+        self.coalesced = 0
+
+    def add(self, item, stamp=None):
+        with self._cond:
+            if self._shutdown:
+                return
+            if stamp is not None:
+                self._stamps.setdefault(item, []).append(stamp)
+            self.adds += 1
+            if item in self._dirty:
+                self.coalesced += 1
+                return
+            self._dirty.add(item)
+            if item in self._processing:
+                return
+            self._queue.append(item)
+            self._cond.notify()
+
+    def get(self):
+        """
+        Blocks until an item is available and marks it as processing. Returns None after shutdown.
+        """
+        with self._cond:
+            while not self._queue and not self._shutdown:
+                self._cond.wait()
+            if self._shutdown:
+                return None
+            item = self._queue.popleft()
+            self._dirty.discard(item)
+            self._processing.add(item)
+            self._processing_stamps[item] = self._stamps.pop(item, [])
+            return item
+
+    def stamps(self, item):
+        """
+        Returns the event stamps of the events served by the current run of an item, oldest first.
+        """
+        with self._cond:
+            return list(self._processing_stamps.get(item, []))
+
+    def done(self, item):
+        with self._cond:
+            self._processing.discard(item)
+            self._processing_stamps.pop(item, None)
+            if item in self._dirty:
+                self._queue.append(item)
+            # Wakes workers waiting for the requeued item as well as wait_idle()
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """
+        Blocks until no item is queued or processing. Returns False if the timeout expired first.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._processing, timeout)
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._queue)
@@ -0,0 +1,108 @@
+import unittest
+from benchmarks.fake_opnsense import FakeOpnSense
+from benchmarks.replay import ReplaySession, replay
+from benchmarks.run import benchmark_plugin, compare
+from benchmarks.synthetic import SyntheticCluster
+
+class TestFakeOpnSense(unittest.TestCase):
+
+    def test_rows_are_added_updated_and_deleted(self):
+        # --- Arrange ---
+        fake = FakeOpnSense()
+
+        # --- Act ---
+        _, added = fake.handle('POST', '/api/haproxy/settings/add_acl', {'acl': {'name': 'kic-a', 'value': 'a'}})
+        fake.handle('POST', f"/api/haproxy/settings/set_acl/{added['uuid']}", {'acl': {'value': 'b'}})
+        _, searched = fake.handle('GET', '/api/haproxy/settings/search_acls', None)
+        fake.handle('POST', f"/api/haproxy/settings/del_acl/{added['uuid']}", None)
+        fake.handle('POST', '/api/haproxy/service/reconfigure', None)
+
+        # --- Assert ---
+        self.assertEqual(searched['rows'], [{'name': 'kic-a', 'value': 'b', 'uuid': added['uuid']}])
+        self.assertEqual(fake.rows('haproxy', 'acl'), [])
+        self.assertEqual(fake.reconfigures['haproxy'], 1)
+        self.assertEqual(fake.revision, 3)
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_metallb_scenarios_against_fake_opnsense(self):
+        # --- Arrange ---
+        cluster = SyntheticCluster(nodes=4, services=0, ingresses=0, configmaps=0)
+
+        # --- Act ---
+        results = benchmark_plugin('metallb', cluster, mutate_fraction=0.5, memory=False)
+
+        # --- Assert ---
+        self.assertEqual(results['cold']['writes'], 4)
+        self.assertEqual(results['cold']['reconfigures'], 1)
+        self.assertEqual(results['warm_noop']['writes'], 0)
+        # Every second node moved, neighbors are keyed by address so each move adds one and deletes one
+        self.assertEqual(results['incremental']['writes'], 4)
+        self.assertEqual(results['restart']['writes'], 0)
+
+    def test_compare_reports_regressions(self):
+        # --- Arrange ---
+        previous = {'api_calls': 10, 'writes': 5, 'reconfigures': 1, 'wall_seconds': 1.0, 'peak_memory_bytes': None}
+        current = {'api_calls': 11, 'writes': 5, 'reconfigures': 1, 'wall_seconds': 1.1, 'peak_memory_bytes': 100}
+
+        # --- Act ---
+        regressions = compare({'metallb': {'cold': current}}, {'metallb': {'cold': previous}}, tolerance=0.2)
+
+        # --- Assert ---
+        self.assertEqual(regressions, ['metallb/cold: api_calls 10 -> 11'])
+
+def _node_event(t, event_type, name, address, resource_version):
+    return {'t': t, 'kind': 'event', 'resource': 'node', 'type': event_type, 'object': {
+        'metadata': {'name': name, 'resourceVersion': resource_version},
+        'status': {'addresses': [{'type': 'InternalIP', 'address': address}]},
+    }}
+
+def _opnsense_record(method, endpoint, response):
+    return {'t': 0, 'kind': 'opnsense', 'method': method, 'endpoint': endpoint, 'request': None,
+            'status': 200, 'response': response, 'duration': 0.01}
+
+class TestReplay(unittest.TestCase):
+
+    def test_session_serves_recorded_responses_in_order(self):
+        # --- Arrange ---
+        session = ReplaySession([
+            _opnsense_record('POST', '/api/haproxy/settings/set_acl/u1', {'result': 'saved'}),
+            _opnsense_record('POST', '/api/haproxy/settings/set_acl/u2', {'result': 'failed'}),
+        ])
+
+        # --- Act ---
+        responses = [session.post(f"/api/haproxy/settings/set_acl/{uuid}").json() for uuid in ('u3', 'u4', 'u5')]
+        unrecorded = session.get('/api/haproxy/settings/search_acls').json()
+
+        # --- Assert ---
+        # UUIDs are ignored, the last response is repeated once the recorded ones run out
+        self.assertEqual(responses, [{'result': 'saved'}, {'result': 'failed'}, {'result': 'failed'}])
+        self.assertEqual(unrecorded, {'rows': []})
+        self.assertEqual(sum(session.unmatched.values()), 1)
+
+    def test_replay_feeds_events_through_the_plugins(self):
+        # --- Arrange ---
+        config = {'metallb': {'enabled': True, 'bgp-implementation': 'openbgp', 'options': {'openbgp': {'template': {}}}}}
+        records = [
+            _node_event(0.0, 'ADDED', 'node-1', '10.0.0.1', '1'),
+            _node_event(0.1, 'ADDED', 'node-2', '10.0.0.2', '2'),
+            _opnsense_record('GET', '/api/openbgpd/settings/search_neighbor', {'rows': []}),
+            _node_event(30.0, 'MODIFIED', 'node-2', '10.0.0.3', '3'),
+        ]
+
+        # --- Act ---
+        # The node change arrives 30ms in, after the initial run
+        report = replay(records, config, speed=1000, timeout=30)
+
+        # --- Assert ---
+        self.assertTrue(report['drained'])
+        self.assertEqual(report['events'], 3)
+        self.assertEqual(report['initial_objects'], 2)
+        self.assertGreaterEqual(report['reconcile_runs'], 2)
+        self.assertGreaterEqual(report['event_to_apply']['count'], 1)
+        self.assertEqual(report['opnsense_calls']['by_endpoint']['GET /api/openbgpd/settings/search_neighbor']['recorded'], 1)
+        # Neighbors for the final node addresses were added
+        self.assertGreaterEqual(report['opnsense_calls']['by_endpoint']['POST /api/openbgpd/settings/add_neighbor']['replayed'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+from unittest.mock import MagicMock
+from src.clients.bulk import BulkModel, BulkModelWriter, BulkWriteError, flatten_model, writer_for
+
+UNBOUND = BulkModel('/api/unbound/settings', 'unbound', {'host_override': ('hosts', 'host'), 'host_alias': ('aliases', 'alias')})
+
+class TestBulkModelWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.responses = {
+            '/api/unbound/settings/get': {'unbound': {
+                'general': {'enabled': '1', 'dnssec': {'on': {'value': 'On', 'selected': 1}, 'off': {'value': 'Off', 'selected': 0}}},
+                'hosts': {'host': {
+                    'uuid-keep': {'host': 'keep', 'domain': 'example.com', 'server': '1.1.1.1', 'description': 'by hand'},
+                    'uuid-update': {'host': 'update', 'domain': 'example.com', 'server': '1.1.1.2', 'description': 'Managed by K8s'},
+                    'uuid-delete': {'host': 'delete', 'domain': 'example.com', 'server': '1.1.1.3', 'description': 'Managed by K8s'},
+                }},
+                'aliases': {'alias': []},
+            }},
+            '/api/unbound/settings/get_host_override': {'host': {'enabled': '1', 'host': '', 'domain': '', 'server': '', 'description': ''}},
+        }
+        self.client.get.side_effect = lambda endpoint: self.responses[endpoint]
+        self.client.post.return_value = {'result': 'saved'}
+        self.writer = BulkModelWriter(self.client, UNBOUND)
+
+    def test_changes_are_saved_with_one_model_set(self):
+        # --- Arrange ---
+        self.writer.post('/api/unbound/settings/add_host_override', {'host': {'host': 'new', 'domain': 'example.com', 'server': '2.2.2.2'}})
+        self.writer.post('/api/unbound/settings/set_host_override/uuid-update', {'host': {'server': '2.2.2.3'}})
+        self.client.post.assert_not_called()
+
+        # --- Act ---
+        saves = self.writer.flush()
+
+        # --- Assert ---
+        self.assertEqual(saves, 1)
+        self.client.post.assert_called_once()
+        endpoint, payload = self.client.post.call_args.args
+        self.assertEqual(endpoint, '/api/unbound/settings/set')
+        hosts = payload['unbound']['hosts']['host']
+        self.assertEqual(payload['unbound']['general']['dnssec'], 'on')
+        self.assertEqual(payload['unbound']['aliases']['alias'], {})
+        self.assertEqual(hosts['uuid-update']['server'], '2.2.2.3')
+        self.assertEqual(hosts['uuid-keep']['description'], 'by hand')
+        new = [h for key, h in hosts.items() if key.startswith('new-')]
+        # New items start from the defaults of the item template
+        self.assertEqual(new, [{'enabled': '1', 'host': 'new', 'domain': 'example.com', 'server': '2.2.2.2', 'description': ''}])
+
+    def test_other_calls_and_deletes_are_sent_right_away(self):
+        # --- Act ---
+        self.writer.post('/api/unbound/service/reconfigure')
+        self.writer.post('/api/unbound/settings/del_host_override/uuid-delete')
+
+        # --- Assert ---
+        self.assertEqual([c.args for c in self.client.post.call_args_list], [
+            ('/api/unbound/service/reconfigure', None),
+            ('/api/unbound/settings/del_host_override/uuid-delete', None),
+        ])
+        self.assertEqual(self.writer.staged, [])
+
+    def test_invalid_changes_fall_back_to_per_item_calls(self):
+        # --- Arrange ---
+        self.writer.post('/api/unbound/settings/add_host_override', {'host': {'host': 'new', 'bogus': 'x'}})
+        self.writer.post('/api/unbound/settings/set_host_override/uuid-update', {'host': {'server': '2.2.2.3'}})
+
+        # --- Act ---
+        saves = self.writer.flush()
+
+        # --- Assert ---
+        self.assertEqual(saves, 2)
+        self.assertEqual([c.args[0] for c in self.client.post.call_args_list], [
+            '/api/unbound/settings/add_host_override',
+            '/api/unbound/settings/set_host_override/uuid-update',
+        ])
+
+    def test_rejected_model_save_falls_back_and_reports_failures(self):
+        # --- Arrange ---
+        def post(endpoint, data=None):
+            if endpoint.endswith('/set'):
+                return {'result': 'failed', 'validations': {'unbound.hosts.host.x.server': 'invalid'}}
+            raise RuntimeError('500 Server Error')
+        self.client.post.side_effect = post
+        self.writer.post('/api/unbound/settings/set_host_override/uuid-update', {'host': {'server': '2.2.2.3'}})
+
+        # --- Act / Assert ---
+        with self.assertRaises(BulkWriteError):
+            self.writer.flush()
+        self.assertEqual(self.client.post.call_count, 2)
+
+    def test_saved_changes_are_not_resent_after_a_lost_response(self):
+        # --- Arrange ---
+        hosts = self.responses['/api/unbound/settings/get']['unbound']['hosts']['host']
+        def post(endpoint, data=None):
+            if endpoint.endswith('/set'):
+                # Saved, but the response never arrives
+                hosts['uuid-saved'] = {'host': 'new', 'domain': 'example.com', 'server': '2.2.2.2', 'description': ''}
+                raise RuntimeError('Read timed out')
+            return {'result': 'saved'}
+        self.client.post.side_effect = post
+        self.writer.post('/api/unbound/settings/add_host_override', {'host': {'host': 'new', 'domain': 'example.com', 'server': '2.2.2.2'}})
+        self.writer.post('/api/unbound/settings/add_host_override', {'host': {'host': 'other', 'domain': 'example.com', 'server': '2.2.2.4'}})
+
+        # --- Act ---
+        saves = self.writer.flush()
+
+        # --- Assert ---
+        # Only the add the model does not show is sent again
+        self.assertEqual(saves, 1)
+        self.assertEqual(self.client.post.call_args_list[-1].args, ('/api/unbound/settings/add_host_override', {'host': {'host': 'other', 'domain': 'example.com', 'server': '2.2.2.4'}}))
+
+    def test_disabled_bulk_writes_use_the_client(self):
+        # --- Assert ---
+        self.assertIs(writer_for(self.client, UNBOUND, False), self.client)
+        self.assertIsInstance(writer_for(self.client, UNBOUND, True), BulkModelWriter)
+
+    def test_flatten_model(self):
+        # --- Act ---
+        flat = flatten_model({'mode': {'a': {'value': 'A', 'selected': 1}, 'b': {'value': 'B', 'selected': 1}, 'c': {'value': 'C', 'selected': 0}}, 'list': []})
+
+        # --- Assert ---
+        self.assertEqual(flat, {'mode': 'a,b', 'list': {}})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import MagicMock
+from kubernetes import client
+from src.clusters import CLUSTER_ANNOTATION, ClusterSet, RemoteCluster, owner_ref
+from src.main import load_plugins
+from src.plugins.dns_services import DNSServicesPlugin
+
+def _service(name, namespace, hostname, ip):
+    return client.V1Service(
+        metadata=client.V1ObjectMeta(name=name, namespace=namespace, annotations={'dns.opnsense.org/hostname': hostname}),
+        spec=client.V1ServiceSpec(type='LoadBalancer'),
+        status=client.V1ServiceStatus(load_balancer=client.V1LoadBalancerStatus(ingress=[client.V1LoadBalancerIngress(ip=ip)])),
+    )
+
+class TestClusters(unittest.TestCase):
+
+    def setUp(self):
+        self.home = MagicMock()
+        self.home.list_service_for_all_namespaces.return_value = client.V1ServiceList(items=[_service('web', 'default', 'web.example.com', '1.1.1.1')])
+        self.remote = MagicMock()
+        self.remote.list_service_for_all_namespaces.return_value = client.V1ServiceList(items=[_service('web', 'default', 'web.eu.example.com', '2.2.2.2')])
+        self.clusters = ClusterSet(self.home, MagicMock(), [RemoteCluster('eu', self.remote, MagicMock())])
+
+    def test_lists_are_merged_and_remote_objects_annotated(self):
+        # --- Act ---
+        services = self.clusters.core_v1.list_service_for_all_namespaces().items
+
+        # --- Assert ---
+        self.assertEqual([owner_ref(s.metadata) for s in services], ['default/web', 'default/web@eu'])
+        self.assertEqual(services[1].metadata.annotations[CLUSTER_ANNOTATION], 'eu')
+        # Other calls go to the home cluster only
+        self.clusters.core_v1.list_node()
+        self.home.list_node.assert_called_once()
+        self.remote.list_node.assert_not_called()
+
+    def test_unreachable_cluster_keeps_its_last_listed_objects(self):
+        # --- Arrange ---
+        self.clusters.core_v1.list_service_for_all_namespaces()
+        self.remote.list_service_for_all_namespaces.side_effect = Exception('connection refused')
+
+        # --- Act ---
+        services = self.clusters.core_v1.list_service_for_all_namespaces().items
+
+        # --- Assert ---
+        self.assertEqual([owner_ref(s.metadata) for s in services], ['default/web', 'default/web@eu'])
+
+    def test_never_listed_cluster_fails_the_list(self):
+        # --- Arrange ---
+        self.remote.list_service_for_all_namespaces.side_effect = Exception('connection refused')
+
+        # --- Act / Assert ---
+        # Without the remote objects their OPNsense rows would look orphaned
+        with self.assertRaises(Exception):
+            self.clusters.core_v1.list_service_for_all_namespaces()
+
+    def test_plugins_reconcile_every_cluster_once(self):
+        # --- Arrange ---
+        config = {'metallb': {'enabled': True, 'bgp-implementation': 'frr'}, 'opnsense-dns-services': {'enabled': True}}
+        plugins, _ = load_plugins(config, self.home, MagicMock(), MagicMock(), clusters=self.clusters)
+        metallb, dns_services = plugins
+
+        # --- Act ---
+        desired = dns_services._get_desired_state(dns_services.k8s_core_v1_api.list_service_for_all_namespaces().items)
+
+        # --- Assert ---
+        self.assertIs(metallb.k8s_core_v1_api, self.home)
+        self.assertIsInstance(dns_services, DNSServicesPlugin)
+        self.assertEqual({k: v['description'] for k, v in desired.items()}, {
+            'web.example.com': 'Managed by K8s Service default/web',
+            'web.eu.example.com': 'Managed by K8s Service default/web@eu',
+        })
+
+    def test_watch_sources(self):
+        # --- Act / Assert ---
+        self.assertEqual(self.clusters.watch_sources('service'), [('eu', self.remote.list_service_for_all_namespaces)])
+        self.assertEqual(self.clusters.watch_sources('node'), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import threading
+import unittest
+from unittest.mock import MagicMock, call
+from src.plugins.dns_backends import DnsmasqBackend, UnboundBackend, get_dns_backends, registry_id, sync_dns_backends
+from src.sharding import Shard, shard_of
+
+class TestDNSBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.opnsense_client = MagicMock()
+
+    def test_get_dns_backends(self):
+        # Unbound stays the default when nothing is configured
+        backends = get_dns_backends(self.opnsense_client, {})
+        self.assertEqual([b.name for b in backends], ['unbound'])
+
+        backends = get_dns_backends(self.opnsense_client, {'dnsBackends': {'dnsmasq': {'enabled': True}, 'unbound': {'enabled': False}}})
+        self.assertEqual([b.name for b in backends], ['dnsmasq'])
+
+    def test_dnsmasq_host_overrides(self):
+        # --- Arrange ---
+        backend = DnsmasqBackend(self.opnsense_client)
+        self.opnsense_client.get.return_value = {
+            'rows': [
+                {'uuid': 'uuid-update', 'host': 'update', 'domain': 'example.com', 'ip': '8.8.8.8', 'descr': 'Managed by K8s Service default/a'},
+                {'uuid': 'uuid-delete', 'host': 'delete', 'domain': 'example.com', 'ip': '9.9.9.9', 'descr': 'Managed by K8s Service default/b'},
+                {'uuid': 'uuid-alias', 'host': 'alias', 'domain': 'example.com', 'ip': '9.9.9.9', 'descr': 'Alias: Managed by K8s Ingress default/c'},
+                {'uuid': 'uuid-manual', 'host': 'manual', 'domain': 'example.com', 'ip': '7.7.7.7', 'descr': 'by hand'},
+            ]
+        }
+        desired = {
+            'update.example.com': {'host': 'update', 'domain': 'example.com', 'ip': '2.2.2.2', 'description': 'Managed by K8s Service default/a'},
+        }
+
+        # --- Act ---
+        changed = backend.sync('host_override', desired, 'Managed by K8s')
+
+        # --- Assert ---
+        self.assertTrue(changed)
+        # The second search records the drift baseline after this run's writes
+        self.assertEqual(self.opnsense_client.get.call_args_list, [call('/api/dnsmasq/settings/search_host')] * 2)
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        # Alias entries and unmanaged hosts are left alone
+        self.assertEqual(endpoints, [
+            '/api/dnsmasq/settings/set_host/uuid-update',
+            '/api/dnsmasq/settings/del_host/uuid-delete',
+            '/api/dnsmasq/service/reconfigure',
+        ])
+        payload = self.opnsense_client.post.call_args_list[0].args[1]
+        self.assertEqual(payload, {'host': {'host': 'update', 'domain': 'example.com', 'ip': '2.2.2.2', 'descr': 'Managed by K8s Service default/a'}})
+
+    def test_unbound_bulk_writes_save_the_model_once(self):
+        # --- Arrange ---
+        backend = get_dns_backends(self.opnsense_client, {'bulkWrites': True})[0]
+        rows = [{'uuid': f"uuid-{n}", 'host': f"old-{n}", 'domain': 'example.com', 'ip': '1.1.1.1', 'description': 'Managed by K8s Service default/old'} for n in range(3)]
+        model = {'unbound': {'hosts': {'host': {row['uuid']: dict(row) for row in rows}}, 'aliases': {'alias': []}}}
+        responses = {
+            '/api/unbound/settings/search_host_override': {'rows': rows},
+            '/api/unbound/settings/get': model,
+            '/api/unbound/settings/get_host_override': {'host': {'host': '', 'domain': '', 'ip': '', 'description': ''}},
+        }
+        self.opnsense_client.get.side_effect = lambda endpoint: responses[endpoint]
+        self.opnsense_client.post.return_value = {'result': 'saved'}
+        desired = {f"new-{n}.example.com": {'host': f"new-{n}", 'domain': 'example.com', 'ip': '2.2.2.2', 'description': 'Managed by K8s Service default/new'} for n in range(5)}
+
+        # --- Act ---
+        changed = backend.sync('host_override', desired, 'Managed by K8s')
+
+        # --- Assert ---
+        self.assertTrue(changed)
+        # Three per-item deletes, the five adds in one save, then the reconfigure
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertEqual(endpoints, [f"/api/unbound/settings/del_host_override/uuid-{n}" for n in range(3)] + ['/api/unbound/settings/set', '/api/unbound/service/reconfigure'])
+        hosts = self.opnsense_client.post.call_args_list[3].args[1]['unbound']['hosts']['host']
+        self.assertEqual(sorted(h['host'] for key, h in hosts.items() if key.startswith('new-')), [f"new-{n}" for n in range(5)])
+
+    def test_dnsmasq_aliases_resolve_target_address(self):
+        # --- Arrange ---
+        backend = DnsmasqBackend(self.opnsense_client)
+        self.opnsense_client.get.return_value = {
+            'rows': [{'uuid': 'uuid-target', 'host': 'http-80', 'domain': 'k8s', 'ip': '10.0.0.80', 'descr': 'by hand'}]
+        }
+        desired = {
+            'app.example.com': {'host': 'app.example.com', 'target': 'http-80.k8s', 'description': 'Managed by K8s Ingress default/app'},
+            'other.example.com': {'host': 'other.example.com', 'target': 'missing.k8s', 'description': 'Managed by K8s Ingress default/other'},
+        }
+
+        # --- Act ---
+        backend.sync('host_alias', desired, 'Managed by K8s')
+
+        # --- Assert ---
+        add_calls = [c for c in self.opnsense_client.post.call_args_list if c.args[0] == '/api/dnsmasq/settings/add_host']
+        self.assertEqual(len(add_calls), 1)
+        self.assertEqual(add_calls[0].args[1]['host'], {
+            'host': 'app', 'domain': 'example.com', 'ip': '10.0.0.80', 'descr': 'Alias: Managed by K8s Ingress default/app'
+        })
+
+    def test_check_drift_compares_owned_records(self):
+        # --- Arrange ---
+        backend = UnboundBackend(self.opnsense_client)
+        rows = [
+            {'uuid': 'uuid-a', 'host': 'a', 'domain': 'example.com', 'ip': '1.1.1.1', 'description': 'Managed by K8s Service default/a'},
+            {'uuid': 'uuid-manual', 'host': 'manual', 'domain': 'example.com', 'ip': '7.7.7.7', 'description': 'by hand'},
+        ]
+        self.opnsense_client.get.return_value = {'rows': rows}
+        desired = {'a.example.com': {'host': 'a', 'domain': 'example.com', 'ip': '1.1.1.1', 'description': 'Managed by K8s Service default/a'}}
+
+        # --- Act / Assert ---
+        # Never synced, so there is nothing to compare against
+        self.assertTrue(backend.check_drift('host_override', 'Managed by K8s Service'))
+
+        backend.sync('host_override', desired, 'Managed by K8s Service')
+        self.assertFalse(backend.check_drift('host_override', 'Managed by K8s Service'))
+
+        # Edits to unmanaged records are ignored, edits to owned ones are not
+        rows[1]['ip'] = '8.8.8.8'
+        self.assertFalse(backend.check_drift('host_override', 'Managed by K8s Service'))
+        rows[0]['ip'] = '2.2.2.2'
+        self.assertTrue(backend.check_drift('host_override', 'Managed by K8s Service'))
+
+    def test_sharded_backend_only_owns_its_namespaces(self):
+        # --- Arrange ---
+        mine = next(f"ns-{n}" for n in range(100) if shard_of(f"ns-{n}", 2) == 1)
+        theirs = next(f"ns-{n}" for n in range(100) if shard_of(f"ns-{n}", 2) == 0)
+        backend = UnboundBackend(self.opnsense_client, shard=Shard(1, 2))
+        self.opnsense_client.get.return_value = {'rows': [
+            {'uuid': 'uuid-mine', 'host': 'a', 'domain': 'example.com', 'ip': '1.1.1.1', 'description': f"Managed by K8s Service {mine}/a"},
+            {'uuid': 'uuid-theirs', 'host': 'b', 'domain': 'example.com', 'ip': '2.2.2.2', 'description': f"Managed by K8s Service {theirs}/b"},
+        ]}
+
+        # --- Act ---
+        backend.sync('host_override', {}, 'Managed by K8s Service')
+
+        # --- Assert ---
+        # Only this shard's orphan is deleted, the other shard's record is left alone
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertIn('/api/unbound/settings/del_host_override/uuid-mine', endpoints)
+        self.assertNotIn('/api/unbound/settings/del_host_override/uuid-theirs', endpoints)
+        self.assertEqual(registry_id('dns', [backend], Shard(1, 2)), 'dns:unbound@shard-1-of-2')
+
+    def test_unbound_preserves_cache_across_reconfigure(self):
+        # --- Arrange ---
+        backend = UnboundBackend(self.opnsense_client, {'enabled': True, 'preserveCache': True})
+        self.opnsense_client.get.return_value = {'data': ['cached entry']}
+
+        # --- Act ---
+        backend.apply_changes()
+
+        # --- Assert ---
+        self.opnsense_client.get.assert_called_once_with('/api/unbound/diagnostics/dumpcache')
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertEqual(endpoints, ['/api/unbound/service/reconfigure', '/api/unbound/diagnostics/loadcache'])
+        self.assertEqual(self.opnsense_client.post.call_args_list[1].args[1], {'data': ['cached entry']})
+
+    def test_unbound_cache_preservation_falls_back_to_plain_reconfigure(self):
+        # --- Arrange ---
+        backend = UnboundBackend(self.opnsense_client, {'enabled': True, 'preserveCache': True})
+        self.opnsense_client.get.side_effect = Exception("404 Not Found")
+
+        # --- Act ---
+        backend.apply_changes()
+        backend.apply_changes()
+
+        # --- Assert ---
+        # The missing endpoint is only probed once
+        self.opnsense_client.get.assert_called_once()
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertEqual(endpoints, ['/api/unbound/service/reconfigure', '/api/unbound/service/reconfigure'])
+
+    def test_sync_fans_out_to_backends_in_parallel(self):
+        # --- Arrange ---
+        # Each backend blocks in its search until both have started, which only works if they run concurrently
+        barrier = threading.Barrier(2, timeout=5)
+
+        def get(endpoint):
+            barrier.wait()
+            return {'rows': []}
+        self.opnsense_client.get.side_effect = get
+        backends = [UnboundBackend(self.opnsense_client), DnsmasqBackend(self.opnsense_client)]
+        desired = {'add.example.com': {'host': 'add', 'domain': 'example.com', 'ip': '1.1.1.1', 'description': 'Managed by K8s'}}
+
+        # --- Act ---
+        changed = sync_dns_backends(backends, 'host_override', desired, 'Managed by K8s')
+
+        # --- Assert ---
+        self.assertTrue(changed)
+        endpoints = {c.args[0] for c in self.opnsense_client.post.call_args_list}
+        self.assertIn('/api/unbound/settings/add_host_override', endpoints)
+        self.assertIn('/api/dnsmasq/settings/add_host', endpoints)
+        self.assertIn('/api/unbound/service/reconfigure', endpoints)
+        self.assertIn('/api/dnsmasq/service/reconfigure', endpoints)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, call
 from src.plugins.dns_haproxy_ingress_proxy import DNSHAProxyIngressProxyPlugin
 
 # Mock Kubernetes objects
@@ -58,7 +58,8 @@ class TestDNSHAProxyIngressProxyPlugin(unittest.TestCase):
         self.plugin.run()
 
         # --- Assert ---
-        self.opnsense_client.get.assert_called_once_with('/api/unbound/settings/search_host_alias')
+        # The second search records the drift baseline after this run's writes
+        self.assertEqual(self.opnsense_client.get.call_args_list, [call('/api/unbound/settings/search_host_alias')] * 2)
 
         calls = self.opnsense_client.post.call_args_list
         self.assertEqual(len(calls), 4)
@@ -1,5 +1,5 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, call
 from src.plugins.dns_ingresses import DNSIngressesPlugin
 
 # Mock Kubernetes objects
@@ -50,7 +50,8 @@ class TestDNSIngressesPlugin(unittest.TestCase):
         self.plugin.run()
 
         # --- Assert ---
-        self.opnsense_client.get.assert_called_once_with('/api/unbound/settings/search_host_override')
+        # The second search records the drift baseline after this run's writes
+        self.assertEqual(self.opnsense_client.get.call_args_list, [call('/api/unbound/settings/search_host_override')] * 2)
 
         calls = self.opnsense_client.post.call_args_list
         self.assertEqual(len(calls), 4)
@@ -1,5 +1,5 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, call
 from src.plugins.dns_services import DNSServicesPlugin
 
 # Mock Kubernetes objects
@@ -53,7 +53,8 @@ class TestDNSServicesPlugin(unittest.TestCase):
         self.plugin.run()
 
         # --- Assert ---
-        self.opnsense_client.get.assert_called_once_with('/api/unbound/settings/search_host_override')
+        # The second search records the drift baseline after this run's writes
+        self.assertEqual(self.opnsense_client.get.call_args_list, [call('/api/unbound/settings/search_host_override')] * 2)
 
         calls = self.opnsense_client.post.call_args_list
         # We expect 3 override calls (add, update, delete) and 1 reconfigure call
@@ -74,5 +75,58 @@ class TestDNSServicesPlugin(unittest.TestCase):
         reconfigure_call = next(c for c in calls if c.args[0] == '/api/unbound/service/reconfigure')
         self.assertIsNotNone(reconfigure_call)
 
+    def test_registry_skips_unchanged_records(self):
+        # --- Arrange ---
+        registry = MagicMock()
+        registry.diverged.return_value = set()
+        plugin = DNSServicesPlugin(self.k8s_core_v1_api, self.opnsense_client, self.config, registry=registry)
+        services = [MockV1Service('web-svc', 'default', 'LoadBalancer', {plugin.annotation: 'web.example.com'}, '1.1.1.1')]
+        self.k8s_core_v1_api.list_service_for_all_namespaces.return_value = MockV1ServiceList(services)
+
+        # --- Act ---
+        plugin.run()
+
+        # --- Assert ---
+        # Nothing diverged since the last apply, so OPNsense is not contacted at all
+        self.opnsense_client.get.assert_not_called()
+        self.opnsense_client.post.assert_not_called()
+        registry_id, desired = registry.diverged.call_args.args
+        self.assertEqual(registry_id, 'dns-services:unbound')
+        self.assertEqual(list(desired), ['web.example.com'])
+
+    def test_failed_reconfigure_is_retried(self):
+        # --- Arrange ---
+        registry = MagicMock()
+        registry.diverged.return_value = {'web.example.com'}
+        plugin = DNSServicesPlugin(self.k8s_core_v1_api, self.opnsense_client, self.config, registry=registry)
+        services = [MockV1Service('web-svc', 'default', 'LoadBalancer', {plugin.annotation: 'web.example.com'}, '1.1.1.1')]
+        self.k8s_core_v1_api.list_service_for_all_namespaces.return_value = MockV1ServiceList(services)
+        self.opnsense_client.change_token.return_value = 'rev-1'
+        self.opnsense_client.get.return_value = {'rows': []}
+        def post(endpoint, data=None):
+            if endpoint.endswith('/reconfigure'):
+                raise RuntimeError('500 Server Error')
+            return {'result': 'saved'}
+        self.opnsense_client.post.side_effect = post
+
+        # --- Act ---
+        plugin.run()
+
+        # --- Assert ---
+        # The records were written but never went live, so the run is not recorded as applied
+        registry.record.assert_not_called()
+        registry.forget.assert_called_once_with(plugin.registry_id)
+        self.assertIsNone(plugin._last_reconciled)
+
+        # The next run reconfigures again, even though the records are already in place
+        self.opnsense_client.post.reset_mock()
+        self.opnsense_client.post.side_effect = None
+        self.opnsense_client.get.return_value = {'rows': [
+            {'uuid': 'uuid-web', 'host': 'web', 'domain': 'example.com', 'ip': '1.1.1.1', 'description': 'Managed by K8s Service default/web-svc'},
+        ]}
+        plugin.run()
+        self.opnsense_client.post.assert_called_once_with('/api/unbound/service/reconfigure')
+        registry.record.assert_called_once()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,128 @@
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from src.clients.flow_control import AIMDLimiter, CircuitBreaker, is_service_command
+
+class TestAIMDLimiter(unittest.TestCase):
+
+    def test_prompt_responses_raise_the_limit(self):
+        # --- Arrange ---
+        limiter = AIMDLimiter(initial=2, maximum=8)
+
+        # --- Act ---
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(True, 0.05)
+
+        # --- Assert ---
+        self.assertGreater(limiter.limit, 4)
+        self.assertLessEqual(limiter.limit, 8)
+
+    def test_errors_halve_the_limit_once_per_second(self):
+        # --- Arrange ---
+        limiter = AIMDLimiter(initial=8, maximum=8)
+
+        # --- Act ---
+        with patch('src.clients.flow_control.time.monotonic', side_effect=[10, 10.1, 11.2]):
+            for _ in range(3):
+                limiter.acquire()
+                limiter.release(False)
+
+        # --- Assert ---
+        # The second failure was in flight alongside the first, only the third halves again
+        self.assertEqual(limiter.limit, 2)
+
+    def test_slow_responses_halve_the_limit(self):
+        # --- Arrange ---
+        limiter = AIMDLimiter(initial=8, maximum=8)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(True, 0.2)
+
+        # --- Act ---
+        limiter.acquire()
+        limiter.release(True, 2.0)
+
+        # --- Assert ---
+        self.assertEqual(limiter.limit, 4)
+
+    def test_requests_beyond_the_limit_wait(self):
+        # --- Arrange ---
+        limiter = AIMDLimiter(initial=1, maximum=1)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        # --- Act ---
+        waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+        waiter.start()
+        blocked = not acquired.wait(0.05)
+        limiter.release(True, 0.01)
+        waiter.join(1)
+
+        # --- Assert ---
+        self.assertTrue(blocked)
+        self.assertTrue(acquired.is_set())
+
+    def test_service_commands_are_recognized(self):
+        # --- Assert ---
+        self.assertTrue(is_service_command('/api/unbound/service/reconfigure'))
+        self.assertFalse(is_service_command('/api/unbound/settings/add_host_override'))
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(threshold=2, cooldown=60, name='fw')
+
+    def tearDown(self):
+        if self.breaker._timer:
+            self.breaker._timer.cancel()
+
+    def test_opens_after_consecutive_failures(self):
+        # --- Act ---
+        self.breaker.record(False, False)
+        self.breaker.record(True, False)
+        self.breaker.record(False, False)
+        still_closed = self.breaker.allow_write()
+        self.breaker.record(False, True)
+
+        # --- Assert ---
+        self.assertTrue(still_closed)
+        self.assertTrue(self.breaker.is_open())
+        self.assertFalse(self.breaker.allow_write())
+
+    def test_held_back_work_resumes_after_a_successful_probe(self):
+        # --- Arrange ---
+        resumed = MagicMock()
+        self.breaker.record(False, True)
+        self.breaker.record(False, True)
+        self.breaker.when_writable('dns', resumed)
+        # Registering the same work again does not resume it twice
+        self.breaker.when_writable('dns', resumed)
+
+        # --- Act ---
+        self.breaker._half_open()
+        probe, second = self.breaker.allow_write(), self.breaker.allow_write()
+        self.breaker.record(True, True)
+
+        # --- Assert ---
+        self.assertEqual((probe, second), (True, False))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        resumed.assert_called_once()
+
+    def test_failed_probe_doubles_the_cooldown(self):
+        # --- Arrange ---
+        self.breaker.record(False, True)
+        self.breaker.record(False, True)
+        self.breaker._timer.cancel()
+        self.breaker._half_open()
+
+        # --- Act ---
+        self.breaker.allow_write()
+        self.breaker.record(False, True)
+
+        # --- Assert ---
+        self.assertTrue(self.breaker.is_open())
+        self.assertEqual(self.breaker.cooldown, 120)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,287 @@
+import unittest
+import yaml
+from unittest.mock import MagicMock, patch
+from src.plugins.haproxy_declarative import HAProxyDeclarativePlugin
+
+DECLARATIVE_DATA = """
+resources:
+  - type: backend
+    ha_servers:
+      - type: node-static
+        definition:
+          name: node01
+          address: 10.0.0.1
+          port: 80
+    definition:
+      name: traefik
+      balance: leastconn
+  - type: frontend
+    definition:
+      name: http-80
+      type: http
+"""
+
+# Mock Kubernetes objects
+class MockV1ConfigMap:
+    def __init__(self, name, namespace, resource_version, data):
+        self.metadata = MagicMock()
+        self.metadata.name = name
+        self.metadata.namespace = namespace
+        self.metadata.resource_version = resource_version
+        self.data = {'data': data}
+
+class MockV1ConfigMapList:
+    def __init__(self, items):
+        self.items = items
+
+class TestHAProxyDeclarativePlugin(unittest.TestCase):
+
+    def setUp(self):
+        self.k8s_core_v1_api = MagicMock()
+        self.opnsense_client = MagicMock()
+        self.opnsense_client.get.return_value = {'rows': []}
+        self.opnsense_client.post.side_effect = self._post
+        self.opnsense_client.change_token.return_value = None
+        self.config = {}
+        self.plugin = HAProxyDeclarativePlugin(self.k8s_core_v1_api, self.opnsense_client, self.config)
+
+    def _post(self, endpoint, data=None):
+        # OPNsense returns the UUID of newly added objects
+        if '/add_' in endpoint:
+            return {'result': 'saved', 'uuid': f"uuid-{data[endpoint.rsplit('_', 1)[1]]['name']}"}
+        return {'result': 'saved'}
+
+    def _set_configmaps(self, configmaps):
+        self.k8s_core_v1_api.list_config_map_for_all_namespaces.return_value = MockV1ConfigMapList(configmaps)
+
+    def test_parse_cache_reuses_unchanged_configmaps(self):
+        # --- Arrange ---
+        self._set_configmaps([MockV1ConfigMap('decl', 'default', '1', DECLARATIVE_DATA)])
+
+        # --- Act ---
+        with patch('src.plugins.haproxy_declarative.yaml.load', wraps=yaml.load) as mock_load:
+            self.plugin.run()
+            self.plugin.run()
+            self.assertEqual(mock_load.call_count, 1)
+
+            # A new resourceVersion forces a re-parse and evicts the old entry
+            self._set_configmaps([MockV1ConfigMap('decl', 'default', '2', DECLARATIVE_DATA)])
+            self.plugin.run()
+            self.assertEqual(mock_load.call_count, 2)
+
+        # --- Assert ---
+        self.assertEqual(list(self.plugin._parse_cache), [('default', 'decl', '2')])
+
+        # Deleted ConfigMaps are dropped from the cache
+        self._set_configmaps([])
+        self.plugin.run()
+        self.assertEqual(self.plugin._parse_cache, {})
+
+    def test_warm_fills_parse_cache_without_opnsense_calls(self):
+        # --- Arrange ---
+        self._set_configmaps([MockV1ConfigMap('decl', 'default', '1', DECLARATIVE_DATA)])
+
+        # --- Act ---
+        self.plugin.warm()
+
+        # --- Assert ---
+        self.assertEqual(list(self.plugin._parse_cache), [('default', 'decl', '1')])
+        self.opnsense_client.get.assert_not_called()
+        self.opnsense_client.post.assert_not_called()
+
+    def test_cached_resources_are_immutable(self):
+        # --- Arrange ---
+        self._set_configmaps([MockV1ConfigMap('decl', 'default', '1', DECLARATIVE_DATA)])
+
+        # --- Act ---
+        self.plugin.run()
+        resources = self.plugin._parse_cache[('default', 'decl', '1')]
+
+        # --- Assert ---
+        backend = resources[0]
+        self.assertEqual(backend['metadata']['namespace'], 'default')
+        with self.assertRaises(TypeError):
+            backend['definition']['name'] = 'changed'
+
+        # Resolving servers must leave the cached backend untouched
+        self.assertIn('ha_servers', backend)
+        self.assertNotIn('linkedServers', backend['definition'])
+
+    def test_graph_reconcile_orders_creates_and_deletes(self):
+        # --- Arrange ---
+        data = DECLARATIVE_DATA + """
+  - type: acl
+    definition:
+      name: host-acl
+      expression: hdr
+      hdr: app.example.com
+  - type: action
+    definition:
+      name: host-action
+      type: use_backend
+      linkedAcls: host-acl
+      use_backend: traefik
+"""
+        data = data.replace("      name: http-80\n", "      name: http-80\n      defaultBackend: traefik\n      linkedActions: [host-action]\n")
+        self._set_configmaps([MockV1ConfigMap('decl', 'default', '1', data)])
+
+        managed = 'Managed by K8s ConfigMap default/old'
+        rows = {
+            'frontend': [{'uuid': 'uuid-fe-old', 'name': 'old-fe', 'description': managed}],
+            'backend': [
+                {'uuid': 'uuid-be-old', 'name': 'old-be', 'description': managed},
+                {'uuid': 'uuid-be-manual', 'name': 'manual-be', 'description': 'created by hand'},
+            ],
+            'server': [{'uuid': 'uuid-srv-old', 'name': 'old-srv', 'description': managed}],
+        }
+        self.opnsense_client.get.side_effect = lambda endpoint: {'rows': rows.get(endpoint.rsplit('_', 1)[1], [])}
+
+        # --- Act ---
+        self.plugin.run()
+
+        # --- Assert ---
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        prefix = '/api/haproxy/settings/'
+
+        # Creates follow dependencies: servers -> backends -> frontends, acls/backends -> actions -> frontends
+        self.assertLess(endpoints.index(prefix + 'add_server'), endpoints.index(prefix + 'add_backend'))
+        self.assertLess(endpoints.index(prefix + 'add_backend'), endpoints.index(prefix + 'add_action'))
+        self.assertLess(endpoints.index(prefix + 'add_acl'), endpoints.index(prefix + 'add_action'))
+        self.assertLess(endpoints.index(prefix + 'add_action'), endpoints.index(prefix + 'add_frontend'))
+
+        # Deletes run in reverse order and only touch controller-owned objects
+        self.assertLess(endpoints.index(prefix + 'del_frontend/uuid-fe-old'), endpoints.index(prefix + 'del_backend/uuid-be-old'))
+        self.assertLess(endpoints.index(prefix + 'del_backend/uuid-be-old'), endpoints.index(prefix + 'del_server/uuid-srv-old'))
+        self.assertNotIn(prefix + 'del_backend/uuid-be-manual', endpoints)
+
+        # References are resolved to the UUIDs returned by the add calls
+        calls = {c.args[0]: c.args[1] for c in self.opnsense_client.post.call_args_list if len(c.args) > 1}
+        self.assertEqual(calls[prefix + 'add_backend']['backend']['linkedServers'], 'uuid-node01')
+        self.assertEqual(calls[prefix + 'add_action']['action']['linkedAcls'], 'uuid-host-acl')
+        self.assertEqual(calls[prefix + 'add_action']['action']['use_backend'], 'uuid-traefik')
+        self.assertEqual(calls[prefix + 'add_frontend']['frontend']['defaultBackend'], 'uuid-traefik')
+        self.assertEqual(calls[prefix + 'add_frontend']['frontend']['linkedActions'], 'uuid-host-action')
+
+        # A single reconfigure at the end
+        self.assertEqual(endpoints.count('/api/haproxy/service/reconfigure'), 1)
+        self.assertEqual(endpoints[-1], '/api/haproxy/service/reconfigure')
+
+    def test_failed_adds_are_not_changes_or_recorded(self):
+        # --- Arrange ---
+        registry = MagicMock()
+        registry.diverged.return_value = {'backend/traefik'}
+        self.plugin = HAProxyDeclarativePlugin(self.k8s_core_v1_api, self.opnsense_client, self.config, registry=registry)
+        self._set_configmaps([MockV1ConfigMap('decl', 'default', '1', DECLARATIVE_DATA)])
+        # OPNsense rejects the adds without an HTTP error
+        self.opnsense_client.post.side_effect = lambda endpoint, data=None: {'result': 'failed', 'validations': {'name': 'invalid'}}
+
+        # --- Act ---
+        self.plugin.run()
+
+        # --- Assert ---
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertNotIn('/api/haproxy/service/reconfigure', endpoints)
+        registry.record.assert_not_called()
+        registry.forget.assert_called_once_with(self.plugin.plugin_id)
+
+    def test_failed_updates_and_deletes_are_not_changes(self):
+        # --- Arrange ---
+        registry = MagicMock()
+        registry.diverged.return_value = {'backend/traefik'}
+        self.plugin = HAProxyDeclarativePlugin(self.k8s_core_v1_api, self.opnsense_client, self.config, registry=registry)
+        self._set_configmaps([MockV1ConfigMap('decl', 'default', '1', DECLARATIVE_DATA)])
+        managed = 'Managed by K8s ConfigMap default/decl'
+        rows = {
+            'frontend': [{'uuid': 'uuid-http-80', 'name': 'http-80', 'description': f"{managed} [stale]"}],
+            'backend': [
+                {'uuid': 'uuid-traefik', 'name': 'traefik', 'description': f"{managed} [stale]"},
+                {'uuid': 'uuid-old', 'name': 'old', 'description': managed},
+            ],
+            'server': [{'uuid': 'uuid-node01', 'name': 'node01', 'description': f"{managed} [stale]"}],
+        }
+        self.opnsense_client.get.side_effect = lambda endpoint: {'rows': rows.get(endpoint.rsplit('_', 1)[1], [])}
+        def post(endpoint, data=None):
+            if '/set_' in endpoint:
+                return {'result': 'failed', 'validations': {'name': 'invalid'}}
+            raise RuntimeError('500 Server Error')
+        self.opnsense_client.post.side_effect = post
+
+        # --- Act ---
+        with self.assertLogs(level='INFO') as logs:
+            self.plugin.run()
+
+        # --- Assert ---
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertIn('/api/haproxy/settings/del_backend/uuid-old', endpoints)
+        self.assertNotIn('/api/haproxy/service/reconfigure', endpoints)
+        self.assertTrue(any('Reconciled declarative HAProxy objects: 4 failed.' in line for line in logs.output))
+        registry.record.assert_not_called()
+        registry.forget.assert_called_once_with(self.plugin.plugin_id)
+
+    def test_unchanged_objects_are_not_updated(self):
+        # --- Arrange ---
+        self._set_configmaps([MockV1ConfigMap('decl', 'default', '1', DECLARATIVE_DATA)])
+        self.plugin.run()
+
+        # Feed back what was applied as the current OPNsense state
+        applied = {}
+        for c in self.opnsense_client.post.call_args_list:
+            if len(c.args) > 1:
+                item_type = c.args[0].rsplit('_', 1)[1]
+                applied.setdefault(item_type, []).append({'uuid': f"uuid-{c.args[1][item_type]['name']}", **c.args[1][item_type]})
+        self.opnsense_client.get.side_effect = lambda endpoint: {'rows': applied.get(endpoint.rsplit('_', 1)[1], [])}
+        self.opnsense_client.post.reset_mock()
+
+        # --- Act ---
+        self.plugin.run()
+
+        # --- Assert ---
+        self.opnsense_client.post.assert_not_called()
+
+    def test_unchanged_state_and_change_token_skip_opnsense(self):
+        # --- Arrange ---
+        self.opnsense_client.change_token.return_value = 'rev-1'
+        self._set_configmaps([MockV1ConfigMap('decl', 'default', '1', DECLARATIVE_DATA)])
+        self.plugin.run()
+        self.opnsense_client.get.reset_mock()
+        self.opnsense_client.post.reset_mock()
+
+        # --- Act ---
+        self.plugin.run()
+
+        # --- Assert ---
+        self.opnsense_client.get.assert_not_called()
+        self.opnsense_client.post.assert_not_called()
+
+        # A configuration change on the OPNsense side forces a full diff
+        self.opnsense_client.change_token.return_value = 'rev-2'
+        self.plugin.run()
+        # Five searches for the diff, five more to record the drift baseline after the writes
+        self.assertEqual(self.opnsense_client.get.call_count, 10)
+
+    def test_drift_check_forces_rewrite(self):
+        # --- Arrange ---
+        self._set_configmaps([MockV1ConfigMap('decl', 'default', '1', DECLARATIVE_DATA)])
+        self.plugin.run()
+        applied = {}
+        for c in self.opnsense_client.post.call_args_list:
+            if len(c.args) > 1:
+                item_type = c.args[0].rsplit('_', 1)[1]
+                applied.setdefault(item_type, []).append({'uuid': f"uuid-{c.args[1][item_type]['name']}", **c.args[1][item_type]})
+        self.opnsense_client.get.side_effect = lambda endpoint: {'rows': applied.get(endpoint.rsplit('_', 1)[1], [])}
+        self.plugin.run()
+        self.opnsense_client.post.reset_mock()
+
+        # --- Act / Assert ---
+        self.assertFalse(self.plugin.check_drift())
+
+        # A field edited on OPNsense keeps the fingerprint in the description, so only a full rewrite repairs it
+        applied['backend'][0]['balance'] = 'roundrobin'
+        self.assertTrue(self.plugin.check_drift())
+        self.plugin.run()
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertIn('/api/haproxy/settings/set_backend/uuid-traefik', endpoints)
+        self.assertEqual(endpoints[-1], '/api/haproxy/service/reconfigure')
+
+if __name__ == '__main__':
+    unittest.main()
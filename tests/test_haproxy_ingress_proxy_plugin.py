@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import MagicMock, call
 from src.plugins.haproxy_ingress_proxy import HAProxyIngressProxyPlugin
+from src.sharding import Shard, shard_of
 
 # Mock Kubernetes objects
 class MockV1Ingress:
@@ -95,6 +96,40 @@ class TestHAProxyIngressProxyPlugin(unittest.TestCase):
         reconfigure_call = next(c for c in post_calls if c.args[0] == '/api/haproxy/service/reconfigure')
         self.assertIsNotNone(reconfigure_call)
 
+    def test_sharded_plugin_only_manages_its_namespaces(self):
+        # --- Arrange ---
+        mine = next(f"ns-{n}" for n in range(100) if shard_of(f"ns-{n}", 2) == 1)
+        theirs = next(f"ns-{n}" for n in range(100) if shard_of(f"ns-{n}", 2) == 0)
+        plugin = HAProxyIngressProxyPlugin(self.k8s_networking_v1_api, self.opnsense_client, self.config, shard=Shard(1, 2))
+        self.k8s_networking_v1_api.list_ingress_for_all_namespaces.return_value = MockV1IngressList([
+            MockV1Ingress('mine', mine, ['mine.example.com'], '1.1.1.1'),
+            MockV1Ingress('theirs', theirs, ['theirs.example.com'], '2.2.2.2'),
+        ])
+        acls = {'rows': [
+            {'uuid': 'uuid-acl-gone', 'name': 'kic-gone.example.com', 'description': f"Managed by K8s Ingress {mine}/gone"},
+            {'uuid': 'uuid-acl-other', 'name': 'kic-other.example.com', 'description': f"Managed by K8s Ingress {theirs}/other"},
+        ]}
+        actions = {'rows': [
+            {'uuid': 'uuid-action-gone', 'name': 'kic-gone.example.com'},
+            {'uuid': 'uuid-action-other', 'name': 'kic-other.example.com'},
+        ]}
+        refreshed_acls = {'rows': [acls['rows'][1], {'uuid': 'uuid-acl-mine', 'name': 'kic-mine.example.com'}]}
+        self.opnsense_client.get.side_effect = [acls, actions, refreshed_acls, refreshed_acls, actions]
+
+        # --- Act ---
+        plugin.run()
+
+        # --- Assert ---
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        added = [c.args[1]['acl']['name'] for c in self.opnsense_client.post.call_args_list if c.args[0] == '/api/haproxy/settings/add_acl']
+        self.assertEqual(added, ['kic-mine.example.com'])
+        # The orphans of this shard are deleted, even the action whose ACL was deleted first
+        self.assertIn('/api/haproxy/settings/del_acl/uuid-acl-gone', endpoints)
+        self.assertIn('/api/haproxy/settings/del_action/uuid-action-gone', endpoints)
+        # The other shard's rows are left alone
+        self.assertNotIn('/api/haproxy/settings/del_acl/uuid-acl-other', endpoints)
+        self.assertNotIn('/api/haproxy/settings/del_action/uuid-action-other', endpoints)
+
 
 if __name__ == '__main__':
     unittest.main()
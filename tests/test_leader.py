@@ -0,0 +1,109 @@
+import copy
+import unittest
+from unittest.mock import MagicMock, patch
+from kubernetes import client
+from src.leader import LeaderElector
+
+class FakeLeaseApi:
+    """
+    Stores a single Lease and rejects replacements based on a stale resourceVersion, like the API server.
+    """
+    def __init__(self):
+        self.lease = None
+        self.version = 0
+
+    def read_namespaced_lease(self, name, namespace):
+        if self.lease is None:
+            raise client.ApiException(status=404)
+        return copy.deepcopy(self.lease)
+
+    def create_namespaced_lease(self, namespace, body):
+        if self.lease is not None:
+            raise client.ApiException(status=409)
+        return self._store(body)
+
+    def replace_namespaced_lease(self, name, namespace, body):
+        if body.metadata.resource_version != self.lease.metadata.resource_version:
+            raise client.ApiException(status=409)
+        return self._store(body)
+
+    def _store(self, body):
+        self.version += 1
+        body = copy.deepcopy(body)
+        body.metadata.resource_version = str(self.version)
+        self.lease = body
+        return copy.deepcopy(body)
+
+class TestLeaderElector(unittest.TestCase):
+
+    def setUp(self):
+        self.api = FakeLeaseApi()
+        self.started = MagicMock()
+        self.a = LeaderElector(self.api, 'koc', 'koc-leader', 'pod-a', on_started_leading=self.started)
+        self.b = LeaderElector(self.api, 'koc', 'koc-leader', 'pod-b')
+
+    def test_only_one_replica_leads(self):
+        # --- Act ---
+        self.a.step()
+        self.b.step()
+        self.a.step()
+
+        # --- Assert ---
+        self.assertTrue(self.a.is_leader())
+        self.assertFalse(self.b.is_leader())
+        self.assertEqual(self.api.lease.spec.holder_identity, 'pod-a')
+        self.started.assert_called_once()
+
+    @patch('src.leader.time.monotonic')
+    def test_standby_takes_over_an_expired_lease(self, mock_monotonic):
+        # --- Arrange ---
+        mock_monotonic.return_value = 100.0
+        self.a.step()
+        self.b.step()
+
+        # --- Act ---
+        # pod-a stopped renewing, the record pod-b observed has not changed for longer than the lease duration
+        mock_monotonic.return_value = 100.0 + self.b.lease_duration + 1
+        self.b.step()
+
+        # --- Assert ---
+        self.assertTrue(self.b.is_leader())
+        self.assertEqual(self.api.lease.spec.holder_identity, 'pod-b')
+        self.assertEqual(self.api.lease.spec.lease_transitions, 1)
+
+    def test_released_lease_is_taken_over_immediately(self):
+        # --- Arrange ---
+        self.a.step()
+        self.b.step()
+
+        # --- Act ---
+        self.a.release()
+        self.b.step()
+
+        # --- Assert ---
+        self.assertFalse(self.a.is_leader())
+        self.assertTrue(self.b.is_leader())
+
+    @patch('src.leader.time.monotonic')
+    def test_leader_steps_down_when_renewals_fail(self, mock_monotonic):
+        # --- Arrange ---
+        stopped = MagicMock()
+        self.a.on_stopped_leading = stopped
+        mock_monotonic.return_value = 100.0
+        self.a.step()
+        self.api.read_namespaced_lease = MagicMock(side_effect=client.ApiException(status=500))
+
+        # --- Act ---
+        mock_monotonic.return_value = 100.0 + self.a.renew_deadline - 1
+        self.a.step()
+        still_leading = self.a.is_leader()
+        mock_monotonic.return_value = 100.0 + self.a.renew_deadline + 1
+        self.a.step()
+
+        # --- Assert ---
+        self.assertTrue(still_leading)
+        self.assertFalse(self.a.is_leader())
+        stopped.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
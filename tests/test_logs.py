@@ -0,0 +1,95 @@
+import json
+import logging
+import queue
+import unittest
+from unittest.mock import patch
+from src import logs
+
+class TestJsonFormatter(unittest.TestCase):
+
+    def test_record_is_one_json_object_with_extra_fields(self):
+        # --- Arrange ---
+        record = logging.LogRecord('root', logging.INFO, __file__, 1, 'Applied %s changes', ('unbound',), None)
+        record.trace_id = 'abc'
+        record.events = 3
+
+        # --- Act ---
+        line = logs.JsonFormatter().format(record)
+
+        # --- Assert ---
+        self.assertNotIn('\n', line)
+        entry = json.loads(line)
+        self.assertEqual(entry['message'], 'Applied unbound changes')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['trace_id'], 'abc')
+        self.assertEqual(entry['events'], 3)
+        self.assertNotIn('args', entry)
+
+class TestQueueHandler(unittest.TestCase):
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        # --- Arrange ---
+        handler = logs._NonBlockingQueueHandler(queue.Queue(1))
+        record = logging.LogRecord('root', logging.INFO, __file__, 1, 'message', (), None)
+
+        # --- Act ---
+        handler.emit(record)
+        handler.emit(record)
+
+        # --- Assert ---
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(handler.dropped, 1)
+
+class TestRepeatedWarnings(unittest.TestCase):
+
+    def test_repeats_are_suppressed_within_the_interval(self):
+        # --- Arrange ---
+        limiter = logs.RepeatLimiter(interval=60)
+
+        # --- Act ---
+        with patch('src.logs.time.monotonic', side_effect=[0, 10, 20, 61]):
+            results = [limiter.check('no-ip') for _ in range(4)]
+
+        # --- Assert ---
+        # Logged first, then twice suppressed, then logged again with the number of suppressed repeats
+        self.assertEqual(results, [0, None, None, 2])
+
+    def test_warning_is_logged_once_per_message(self):
+        # --- Arrange ---
+        limiter = logs.RepeatLimiter(interval=60)
+
+        # --- Act ---
+        with patch('src.logs._repeats', limiter), self.assertLogs(level='WARNING') as captured:
+            for _ in range(3):
+                logs.warning('Service default/a has no external IP.')
+            logs.warning('Service default/b has no external IP.')
+
+        # --- Assert ---
+        self.assertEqual([r.getMessage() for r in captured.records],
+                         ['Service default/a has no external IP.', 'Service default/b has no external IP.'])
+
+    def test_limiter_stays_bounded(self):
+        # --- Arrange ---
+        limiter = logs.RepeatLimiter(interval=60, max_keys=10)
+
+        # --- Act ---
+        for n in range(25):
+            limiter.check(f"key-{n}")
+
+        # --- Assert ---
+        self.assertLessEqual(len(limiter._seen), 10)
+
+class TestActionCounts(unittest.TestCase):
+
+    def test_summary(self):
+        # --- Arrange ---
+        changes = logs.ActionCounts()
+        changes['added'] += 2
+        changes['deleted'] += 1
+
+        # --- Assert ---
+        self.assertEqual(str(changes), '2 added, 1 deleted')
+        self.assertEqual(str(logs.ActionCounts(added=0)), 'no changes')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,15 @@
 import unittest
 from unittest.mock import MagicMock, patch, call
+from prometheus_client import REGISTRY
 from src.plugins.metallb import MetalLBPlugin
+from src.workqueue import EventStamp
 
 # Mock Kubernetes objects
 class MockV1Node:
-    def __init__(self, name, internal_ip):
+    def __init__(self, name, internal_ip, labels=None):
         self.metadata = MagicMock()
         self.metadata.name = name
+        self.metadata.labels = labels
         self.status = MagicMock()
         self.status.addresses = [
             MagicMock(type='InternalIP', address=internal_ip)
@@ -68,7 +71,8 @@ class TestMetalLBPlugin(unittest.TestCase):
         # --- Assert ---
         # 1. Verify what was fetched
         self.k8s_core_v1_api.list_node.assert_called_once()
-        self.opnsense_client.get.assert_called_once_with('/api/frr/settings/search_bgp_neighbor')
+        # The second search records the drift baseline after this run's writes
+        self.assertEqual(self.opnsense_client.get.call_args_list, [call('/api/frr/settings/search_bgp_neighbor')] * 2)
 
         # 2. Verify what was changed in OPNsense
         self.assertEqual(self.opnsense_client.post.call_count, 4)
@@ -99,5 +103,240 @@ class TestMetalLBPlugin(unittest.TestCase):
         # 3. Verify that the BGP service was reloaded
         self.opnsense_client.post.assert_any_call('/api/frr/service/reload')
 
+    def test_registry_records_uuids_of_added_neighbors(self):
+        # --- Arrange ---
+        registry = MagicMock()
+        registry.diverged.return_value = {'kpc-10.0.0.1'}
+        self.plugin = MetalLBPlugin(self.k8s_core_v1_api, self.opnsense_client, self.config, registry=registry)
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([MockV1Node('node-1', '10.0.0.1')])
+        # Empty before the writes, the added neighbor is read back with the UUID OPNsense assigned
+        self.opnsense_client.get.side_effect = [
+            {'rows': []},
+            {'rows': [{'uuid': 'uuid-new', 'description': 'kpc-10.0.0.1', 'address': '10.0.0.1', 'peergroup': 'metallb'}]},
+        ]
+
+        # --- Act ---
+        self.plugin.run()
+
+        # --- Assert ---
+        plugin_id, view, uuids = registry.record.call_args.args
+        self.assertEqual(uuids, {'kpc-10.0.0.1': 'uuid-new'})
+
+    def test_failed_reload_is_retried(self):
+        # --- Arrange ---
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([MockV1Node('node-1', '10.0.0.1')])
+        self.opnsense_client.get.return_value = {'rows': []}
+        def post(endpoint, data=None):
+            if endpoint.endswith('/reload'):
+                raise RuntimeError('500 Server Error')
+            return {'result': 'saved'}
+        self.opnsense_client.post.side_effect = post
+        self.plugin.run()
+        self.opnsense_client.post.reset_mock()
+        self.opnsense_client.post.side_effect = None
+        self.opnsense_client.get.return_value = {'rows': [
+            {'uuid': 'uuid-1', 'description': 'kpc-10.0.0.1', 'address': '10.0.0.1', 'peergroup': 'metallb', 'some_other_setting': 'value'},
+        ]}
+
+        # --- Act ---
+        # Nothing changed on the nodes, but the neighbor written by the last run is not live yet
+        self.plugin.run()
+
+        # --- Assert ---
+        self.opnsense_client.post.assert_called_once_with('/api/frr/service/reload')
+
+    def test_incremental_reconciliation(self):
+        # --- Arrange ---
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([MockV1Node('node-1', '10.0.0.1')])
+        self.opnsense_client.get.return_value = {'rows': []}
+        self.plugin.run()
+        self.opnsense_client.reset_mock()
+
+        # --- Act / Assert ---
+        # A node heartbeat without address changes touches nothing on OPNsense
+        self.plugin.run()
+        self.opnsense_client.get.assert_not_called()
+        self.opnsense_client.post.assert_not_called()
+
+        # A new node only adds its neighbor, existing neighbors are not rewritten
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([
+            MockV1Node('node-1', '10.0.0.1'),
+            MockV1Node('node-2', '10.0.0.2'),
+        ])
+        self.opnsense_client.get.return_value = {
+            'rows': [{'uuid': 'uuid-1', 'description': 'kpc-10.0.0.1', 'address': '10.0.0.1', 'peergroup': 'old-group'}]
+        }
+        self.plugin.run()
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertEqual(endpoints, ['/api/frr/settings/add_bgp_neighbor', '/api/frr/service/reload'])
+
+    def test_template_change_updates_existing_neighbors(self):
+        # --- Arrange ---
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([MockV1Node('node-1', '10.0.0.1')])
+        rows = {'rows': [{'uuid': 'uuid-1', 'description': 'kpc-10.0.0.1', 'address': '10.0.0.1', 'peergroup': 'metallb'}]}
+        self.opnsense_client.get.return_value = rows
+        self.plugin.run()
+        self.opnsense_client.post.assert_not_called()
+
+        # --- Act ---
+        self.config['options']['frr']['template']['peergroup'] = 'metallb-v2'
+        plugin = MetalLBPlugin(self.k8s_core_v1_api, self.opnsense_client, self.config)
+        plugin._partitions[0].node_index = self.plugin._partitions[0].node_index
+        plugin._partitions[0].applied_template_hash = self.plugin._partitions[0].applied_template_hash
+        plugin.run()
+
+        # --- Assert ---
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertEqual(endpoints, ['/api/frr/settings/set_bgp_neighbor/uuid-1', '/api/frr/service/reload'])
+
+    def test_drift_check_forces_full_reconcile(self):
+        # --- Arrange ---
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([MockV1Node('node-1', '10.0.0.1')])
+        rows = {'rows': [{'uuid': 'uuid-1', 'description': 'kpc-10.0.0.1', 'address': '10.0.0.1', 'peergroup': 'metallb'}]}
+        self.opnsense_client.get.return_value = rows
+        self.plugin.run()
+
+        # --- Act / Assert ---
+        # Unmanaged rows are not part of the baseline
+        self.opnsense_client.get.return_value = {'rows': rows['rows'] + [{'uuid': 'uuid-9', 'description': 'manual peer'}]}
+        self.assertFalse(self.plugin.check_drift())
+
+        # A manual edit of a managed neighbor is detected and repaired on the next run, despite unchanged nodes
+        self.opnsense_client.get.return_value = {
+            'rows': [{'uuid': 'uuid-1', 'description': 'kpc-10.0.0.1', 'address': '10.0.0.1', 'peergroup': 'edited'}]
+        }
+        self.assertTrue(self.plugin.check_drift())
+        # The search after the repair reports the rewritten row
+        self.opnsense_client.get.side_effect = [self.opnsense_client.get.return_value, rows]
+        self.plugin.run()
+        endpoints = [c.args[0] for c in self.opnsense_client.post.call_args_list]
+        self.assertEqual(endpoints, ['/api/frr/settings/set_bgp_neighbor/uuid-1', '/api/frr/service/reload'])
+
+        # Once repaired, the rows OPNsense reports become the new baseline
+        self.opnsense_client.get.side_effect = None
+        self.opnsense_client.get.return_value = rows
+        self.assertFalse(self.plugin.check_drift())
+
+    def test_event_to_apply_latency_is_recorded(self):
+        # --- Arrange ---
+        labels = {'resource': 'node', 'service': 'frr'}
+        before = REGISTRY.get_sample_value('opnsense_controller_event_to_apply_seconds_count', labels) or 0
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([MockV1Node('node-1', '10.0.0.1')])
+        self.opnsense_client.get.return_value = {'rows': []}
+        stamp = EventStamp('node', 'ADDED', None, 'node-1', '42')
+
+        # --- Act ---
+        self.plugin.run([stamp])
+
+        # --- Assert ---
+        self.assertEqual(REGISTRY.get_sample_value('opnsense_controller_event_to_apply_seconds_count', labels), before + 1)
+
+    def test_node_selectors_and_partitions(self):
+        # --- Arrange ---
+        self.config['nodeLabelSelector'] = {'bgp': 'enabled'}
+        self.config['partitions'] = [
+            {'name': 'rack-a', 'nodeLabelSelector': 'rack=a', 'template': {'peergroup': 'rack-a'}},
+            {'name': 'rack-b', 'nodeLabelSelector': 'rack=b', 'maxNodes': 1},
+        ]
+        plugin = MetalLBPlugin(self.k8s_core_v1_api, self.opnsense_client, self.config)
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([
+            MockV1Node('node-1', '10.0.0.1', {'rack': 'a'}),
+            MockV1Node('node-3', '10.0.0.3', {'rack': 'b'}),
+            MockV1Node('node-2', '10.0.0.2', {'rack': 'b'}),
+            MockV1Node('node-4', '10.0.0.4', {'rack': 'c'}),
+        ])
+        self.opnsense_client.get.return_value = {
+            'rows': [
+                {'uuid': 'uuid-a1', 'description': 'kpc-rack-a-10.0.0.1', 'address': '10.0.0.1', 'peergroup': 'rack-a'},
+                # Left over from before partitioning was enabled
+                {'uuid': 'uuid-old', 'description': 'kpc-10.0.0.9', 'address': '10.0.0.9'},
+                {'uuid': 'uuid-manual', 'description': 'manual peer', 'address': '10.9.9.9'},
+            ]
+        }
+
+        # --- Act ---
+        plugin.run()
+
+        # --- Assert ---
+        self.k8s_core_v1_api.list_node.assert_called_once_with(label_selector='bgp=enabled')
+        calls = self.opnsense_client.post.call_args_list
+        endpoints = [c.args[0] for c in calls]
+        self.assertEqual(sorted(endpoints), sorted([
+            '/api/frr/settings/add_bgp_neighbor',
+            '/api/frr/settings/del_bgp_neighbor/uuid-old',
+            '/api/frr/service/reload',
+        ]))
+        # rack-b is capped at one node, picked by name
+        add_call = next(c for c in calls if c.args[0] == '/api/frr/settings/add_bgp_neighbor')
+        self.assertEqual(add_call.args[1]['neighbor']['description'], 'kpc-rack-b-10.0.0.2')
+        self.assertEqual(add_call.args[1]['neighbor']['peergroup'], 'metallb')
+
+        # A change confined to rack-b leaves rack-a untouched
+        self.opnsense_client.reset_mock()
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([
+            MockV1Node('node-1', '10.0.0.1', {'rack': 'a'}),
+            MockV1Node('node-3', '10.0.0.3', {'rack': 'b'}),
+        ])
+        self.opnsense_client.get.return_value = {
+            'rows': [
+                {'uuid': 'uuid-a1', 'description': 'kpc-rack-a-10.0.0.1', 'address': '10.0.0.1', 'peergroup': 'old-group'},
+                {'uuid': 'uuid-b2', 'description': 'kpc-rack-b-10.0.0.2', 'address': '10.0.0.2', 'peergroup': 'metallb'},
+            ]
+        }
+        plugin.run()
+        endpoints = sorted(c.args[0] for c in self.opnsense_client.post.call_args_list)
+        self.assertEqual(endpoints, [
+            '/api/frr/service/reload',
+            '/api/frr/settings/add_bgp_neighbor',
+            '/api/frr/settings/del_bgp_neighbor/uuid-b2',
+        ])
+
+    def test_match_expressions_select_partition_nodes(self):
+        # --- Arrange ---
+        self.config['nodeLabelSelector'] = {'matchExpressions': [{'key': 'bgp', 'operator': 'Exists'}]}
+        self.config['partitions'] = [
+            {'name': 'edge', 'nodeLabelSelector': {'matchLabels': {'role': 'edge'}, 'matchExpressions': [{'key': 'rack', 'operator': 'In', 'values': ['a', 'b']}]}},
+            # Unsupported operators are skipped rather than treated as matching
+            {'name': 'broken', 'nodeLabelSelector': {'matchExpressions': [{'key': 'rack', 'operator': 'Gt', 'values': ['1']}]}},
+        ]
+        plugin = MetalLBPlugin(self.k8s_core_v1_api, self.opnsense_client, self.config)
+        self.k8s_core_v1_api.list_node.return_value = MockV1NodeList([
+            MockV1Node('node-1', '10.0.0.1', {'bgp': '', 'role': 'edge', 'rack': 'b'}),
+            MockV1Node('node-2', '10.0.0.2', {'bgp': '', 'role': 'edge', 'rack': 'c'}),
+        ])
+        self.opnsense_client.get.return_value = {'rows': []}
+
+        # --- Act ---
+        plugin.run()
+
+        # --- Assert ---
+        self.assertEqual([p.name for p in plugin._partitions], ['edge'])
+        self.k8s_core_v1_api.list_node.assert_called_once_with(label_selector='bgp')
+        adds = [c.args[1]['neighbor']['description'] for c in self.opnsense_client.post.call_args_list if c.args[0].endswith('/add_bgp_neighbor')]
+        self.assertEqual(adds, ['kpc-edge-10.0.0.1'])
+
+    def test_invalid_node_selector_disables_plugin(self):
+        # --- Arrange ---
+        for selector in (
+            {'matchExpressions': [{'key': 'rack', 'operator': 'Gt', 'values': ['1']}]},
+            {'matchExpressions': [{'key': 'rack', 'operator': 'In'}]},
+        ):
+            self.config['nodeLabelSelector'] = selector
+            self.k8s_core_v1_api.reset_mock()
+            self.opnsense_client.reset_mock()
+
+            # --- Act ---
+            with self.assertLogs(level='ERROR'):
+                plugin = MetalLBPlugin(self.k8s_core_v1_api, self.opnsense_client, self.config)
+            plugin.run()
+            drifted = plugin.check_drift()
+
+            # --- Assert ---
+            self.assertIsNotNone(plugin.config_error)
+            self.assertFalse(drifted)
+            self.k8s_core_v1_api.list_node.assert_not_called()
+            self.opnsense_client.get.assert_not_called()
+            self.opnsense_client.post.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY
+from src import metrics
+from src.workqueue import WorkQueue
+
+class TestMetrics(unittest.TestCase):
+
+    def _value(self, name, labels=None):
+        return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+    def test_endpoint_label_drops_parameters(self):
+        self.assertEqual(metrics.endpoint_label('/api/haproxy/settings/set_backend/uuid-1'), '/api/haproxy/settings/set_backend')
+        self.assertEqual(metrics.endpoint_label('/api/unbound/settings/search_host_override'), '/api/unbound/settings/search_host_override')
+
+    def test_record_opnsense_change_classifies_operations(self):
+        # --- Arrange ---
+        labels = {'module': 'frr', 'operation': 'update'}
+        before = self._value('opnsense_controller_opnsense_changes_total', labels)
+
+        # --- Act ---
+        metrics.record_opnsense_change('/api/frr/settings/set_bgp_neighbor/uuid-1')
+        metrics.record_opnsense_change('/api/frr/settings/search_bgp_neighbor')
+
+        # --- Assert ---
+        self.assertEqual(self._value('opnsense_controller_opnsense_changes_total', labels), before + 1)
+        self.assertEqual(self._value('opnsense_controller_opnsense_changes_total', {'module': 'frr', 'operation': 'reconfigure'}), 0)
+
+    def test_queue_and_cache_sizes_are_read_at_scrape_time(self):
+        # --- Arrange ---
+        queue = WorkQueue()
+        plugin = MagicMock(plugin_id='haproxy-declarative')
+        plugin.caches.return_value = {'parse': {'a': 1, 'b': 2, 'c': 3}}
+        metrics.track(queue=queue, plugins=[plugin])
+
+        # --- Act ---
+        queue.add('a')
+        queue.add('a')
+        queue.add('b')
+
+        # --- Assert ---
+        self.assertEqual(self._value('opnsense_controller_queue_depth'), 2)
+        self.assertEqual(self._value('opnsense_controller_queue_adds_total'), 3)
+        self.assertEqual(self._value('opnsense_controller_queue_coalesced_total'), 1)
+        self.assertEqual(self._value('opnsense_controller_cache_entries', {'cache': 'haproxy-declarative/parse'}), 3)
+
+if __name__ == '__main__':
+    unittest.main()
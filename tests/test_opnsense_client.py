@@ -1,7 +1,10 @@
+import os
 import unittest
 import requests
 from unittest.mock import patch, MagicMock
-from src.clients.opnsense import OpnSenseClient
+from prometheus_client import REGISTRY
+from src.clients.flow_control import CircuitOpenError
+from src.clients.opnsense import OpnSenseClient, targets_from_env
 
 class TestOpnSenseClient(unittest.TestCase):
 
@@ -63,5 +66,113 @@ class TestOpnSenseClient(unittest.TestCase):
         with self.assertRaises(requests.exceptions.HTTPError):
             self.client.get("/nonexistent")
 
+    @patch('requests.Session.get')
+    def test_change_token(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"items": [{"time": 1}]}
+        mock_get.return_value = mock_response
+
+        token = self.client.change_token()
+        # Calls within max_age share one request
+        self.assertEqual(self.client.change_token(), token)
+        self.assertEqual(mock_get.call_count, 1)
+
+        mock_response.json.return_value = {"items": [{"time": 2}]}
+        self.assertNotEqual(self.client.change_token(max_age=0), token)
+
+        # An unavailable endpoint yields no token
+        mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError("Not Found")
+        self.assertIsNone(self.client.change_token(max_age=0))
+
+    @patch('requests.Session.post')
+    def test_requests_are_recorded_in_metrics(self, mock_post):
+        # --- Arrange ---
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"result": "saved"}
+        mock_post.return_value = mock_response
+        endpoint = '/api/haproxy/settings/del_server'
+        latency = {'method': 'POST', 'endpoint': endpoint}
+        errors = {**latency, 'error': 'HTTPError'}
+        before_count = REGISTRY.get_sample_value('opnsense_controller_opnsense_request_duration_seconds_count', latency) or 0
+        before_errors = REGISTRY.get_sample_value('opnsense_controller_opnsense_request_errors_total', errors) or 0
+
+        # --- Act ---
+        self.client.post(f"{endpoint}/uuid-1")
+        mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError("Server Error")
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.client.post(f"{endpoint}/uuid-2")
+
+        # --- Assert ---
+        # Both requests share one label set, the UUID is not part of it
+        self.assertEqual(REGISTRY.get_sample_value('opnsense_controller_opnsense_request_duration_seconds_count', latency), before_count + 2)
+        self.assertEqual(REGISTRY.get_sample_value('opnsense_controller_opnsense_request_errors_total', errors), before_errors + 1)
+
+    def test_targets_from_env(self):
+        # --- Arrange ---
+        env = {
+            'OPNSENSE_TARGETS': 'fw-a, fw-b',
+            'OPNSENSE_API_KEY': 'shared-key',
+            'OPNSENSE_API_SECRET': 'shared-secret',
+            'OPNSENSE_FW_A_URL': 'https://fw-a',
+            'OPNSENSE_FW_B_URL': 'https://fw-b',
+            'OPNSENSE_FW_B_API_KEY': 'b-key',
+        }
+
+        # --- Act ---
+        with patch.dict(os.environ, env, clear=True):
+            clients = targets_from_env()
+
+        # --- Assert ---
+        self.assertEqual([(c.target, c.base_url, c.auth) for c in clients], [
+            ('fw-a', 'https://fw-a', ('shared-key', 'shared-secret')),
+            ('fw-b', 'https://fw-b', ('b-key', 'shared-secret')),
+        ])
+        # Every firewall gets its own connection pool
+        self.assertIsNot(clients[0].session, clients[1].session)
+
+        with patch.dict(os.environ, {'OPNSENSE_TARGETS': 'fw-c', 'OPNSENSE_API_KEY': 'k', 'OPNSENSE_API_SECRET': 's'}, clear=True):
+            with self.assertRaises(ValueError):
+                targets_from_env()
+
+        with patch.dict(os.environ, {'OPNSENSE_URL': 'https://fw', 'OPNSENSE_API_KEY': 'k', 'OPNSENSE_API_SECRET': 's'}, clear=True):
+            self.assertEqual([c.target for c in targets_from_env()], [None])
+
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_failing_firewall_pauses_writes(self, mock_get, mock_post):
+        # --- Arrange ---
+        mock_get.side_effect = requests.exceptions.ConnectionError("refused")
+        client = OpnSenseClient(self.base_url, self.api_key, self.api_secret, breaker_threshold=2, breaker_cooldown=60)
+
+        # --- Act ---
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.get("/api/unbound/settings/search_host_override")
+
+        # --- Assert ---
+        with self.assertRaises(CircuitOpenError):
+            client.post("/api/unbound/settings/add_host_override", {})
+        mock_post.assert_not_called()
+        # Reads still go through, they tell when the firewall is back
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.get("/api/unbound/settings/search_host_override")
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch('requests.Session.delete')
+    def test_client_errors_do_not_count_against_the_firewall(self, mock_delete):
+        # --- Arrange ---
+        mock_response = MagicMock()
+        mock_response.status_code = 404
+        mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=mock_response)
+        mock_delete.return_value = mock_response
+        client = OpnSenseClient(self.base_url, self.api_key, self.api_secret, breaker_threshold=1)
+
+        # --- Act ---
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.delete("/api/unbound/settings/del_host_override/1")
+
+        # --- Assert ---
+        self.assertEqual(client.breaker.state, client.breaker.CLOSED)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+from src import profiling, tracing
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        profiling._cache_owners.clear()
+
+    def tearDown(self):
+        profiling._cache_owners.clear()
+        for name in os.listdir(self.output_dir):
+            os.remove(os.path.join(self.output_dir, name))
+        os.rmdir(self.output_dir)
+
+    def test_deep_sizeof_counts_nested_objects_once(self):
+        shared = 'x' * 1000
+        flat = profiling.deep_sizeof({'a': 1})
+        nested = profiling.deep_sizeof({'a': [shared, shared], 'b': (shared,)})
+        self.assertGreater(nested, flat + 1000)
+        self.assertLess(nested, flat + 2000)
+
+    def test_cache_report(self):
+        # --- Arrange ---
+        plugin = MagicMock(plugin_id='haproxy-declarative')
+        plugin.caches.return_value = {'parse': {('default', 'decl', '1'): ({'type': 'backend'},)}}
+        registry = MagicMock(spec=['caches'])
+        registry.caches.return_value = {'registry': {'metallb': {}}}
+        profiling.track(plugin, None, registry)
+
+        # --- Act ---
+        report = profiling.cache_report()
+
+        # --- Assert ---
+        self.assertEqual(set(report), {'haproxy-declarative/parse', 'registry'})
+        self.assertEqual(report['haproxy-declarative/parse']['entries'], 1)
+        self.assertGreater(report['haproxy-declarative/parse']['bytes'], 0)
+
+    def test_profile_attributes_samples_to_plugins_and_phases(self):
+        # --- Arrange ---
+        stop = threading.Event()
+        started = threading.Event()
+
+        def busy_reconcile():
+            with tracing.trace('reconcile', plugin='metallb'):
+                started.set()
+                # Phases opened once the profile is running are attributed
+                while not stop.is_set():
+                    with tracing.span('fetch_opnsense'):
+                        sum(range(10000))
+        worker = threading.Thread(target=busy_reconcile)
+        worker.start()
+        started.wait(timeout=5)
+
+        # --- Act ---
+        try:
+            result = profiling.profile(seconds=0.2, interval=0.01, output_dir=self.output_dir)
+        finally:
+            stop.set()
+            worker.join(timeout=5)
+
+        # --- Assert ---
+        self.assertGreater(result['by_plugin'].get('metallb', 0), 0)
+        self.assertTrue(all(os.path.exists(path) for path in result['files']))
+        with open(result['files'][0]) as f:
+            self.assertIn('plugin:metallb;phase:fetch_opnsense;', f.read())
+        # Child spans are only recorded while a profile runs
+        self.assertFalse(tracing._profiling)
+
+    def test_only_one_profile_runs_at_a_time(self):
+        with profiling._profile_lock:
+            self.assertIsNone(profiling.profile(seconds=0.1, output_dir=self.output_dir))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from kubernetes import client
+from kubernetes.client import ApiException
+from kubernetes.watch.watch import _find_return_type
+from src.clients.rate_limit import LIST, REQUEST, WATCH, PriorityTokenBucket, RateLimitedApi
+
+class TestPriorityTokenBucket(unittest.TestCase):
+
+    def test_burst_is_sent_at_once_then_throttled(self):
+        # --- Arrange ---
+        bucket = PriorityTokenBucket(qps=50, burst=2)
+
+        # --- Act ---
+        waits = [bucket.acquire() for _ in range(3)]
+
+        # --- Assert ---
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertGreater(waits[2], 0.01)
+
+    def test_watches_are_served_before_lists(self):
+        # --- Arrange ---
+        bucket = PriorityTokenBucket(qps=20, burst=1)
+        bucket.acquire()
+        served = []
+
+        def request(priority):
+            bucket.acquire(priority)
+            served.append(priority)
+
+        # --- Act ---
+        threads = []
+        for priority in (LIST, REQUEST, WATCH):
+            threads.append(threading.Thread(target=request, args=(priority,)))
+            threads[-1].start()
+            # Queued one after the other, lowest priority first
+            while len(bucket._waiting) < len(threads):
+                time.sleep(0.001)
+        for t in threads:
+            t.join()
+
+        # --- Assert ---
+        self.assertEqual(served, [WATCH, REQUEST, LIST])
+
+    def test_pause_holds_back_requests(self):
+        # --- Arrange ---
+        bucket = PriorityTokenBucket(qps=1000, burst=10)
+
+        # --- Act ---
+        bucket.pause(0.05)
+        waited = bucket.acquire()
+
+        # --- Assert ---
+        self.assertGreater(waited, 0.04)
+
+class TestRateLimitedApi(unittest.TestCase):
+
+    def test_requests_are_classified_by_priority(self):
+        # --- Arrange ---
+        limiter = MagicMock()
+        limiter.acquire.return_value = 0
+        api = RateLimitedApi(MagicMock(), limiter)
+
+        # --- Act ---
+        api.list_node(watch=True)
+        api.read_namespaced_service('web', 'default')
+        api.list_node()
+
+        # --- Assert ---
+        self.assertEqual([c.args[0] for c in limiter.acquire.call_args_list], [WATCH, REQUEST, LIST])
+
+    def test_watch_can_still_read_the_object_type(self):
+        # --- Arrange ---
+        api = RateLimitedApi(client.CoreV1Api(), PriorityTokenBucket(qps=1, burst=1))
+
+        # --- Act ---
+        return_type = _find_return_type(api.list_service_for_all_namespaces)
+
+        # --- Assert ---
+        self.assertEqual(return_type, _find_return_type(client.CoreV1Api().list_service_for_all_namespaces))
+
+    def test_too_many_requests_pauses_the_limiter(self):
+        # --- Arrange ---
+        limiter = MagicMock()
+        limiter.acquire.return_value = 0
+        wrapped = MagicMock()
+        error = ApiException(status=429)
+        error.headers = {'Retry-After': '3'}
+        wrapped.list_node.side_effect = error
+        api = RateLimitedApi(wrapped, limiter)
+
+        # --- Act ---
+        with self.assertRaises(ApiException):
+            api.list_node()
+
+        # --- Assert ---
+        limiter.pause.assert_called_once_with(3.0)
+
+if __name__ == '__main__':
+    unittest.main()
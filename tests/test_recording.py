@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from src import recording
+from src.clients.opnsense import OpnSenseClient
+
+class TestRecording(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'recording.jsonl.gz')
+        recording.set_recorder(recording.Recorder(self.path))
+
+    def tearDown(self):
+        recording.close()
+        self.tmp.cleanup()
+
+    def test_events_are_recorded_in_order(self):
+        # --- Arrange ---
+        node = {'metadata': {'name': 'node-1', 'resourceVersion': '7'}}
+
+        # --- Act ---
+        recording.record_event('node', 'ADDED', node)
+        recording.record_event('node', 'DELETED', node)
+        recording.close()
+
+        # --- Assert ---
+        records = recording.load(self.path)
+        self.assertEqual([(r['kind'], r['type'], r['object']) for r in records], [('event', 'ADDED', node), ('event', 'DELETED', node)])
+        self.assertLessEqual(records[0]['t'], records[1]['t'])
+
+    @patch('requests.Session.post')
+    def test_opnsense_client_records_requests_and_responses(self, mock_post):
+        # --- Arrange ---
+        mock_response = MagicMock(status_code=200)
+        mock_response.json.return_value = {'result': 'saved', 'uuid': 'u1'}
+        mock_post.return_value = mock_response
+        client = OpnSenseClient('https://opnsense.test', 'key', 'secret')
+
+        # --- Act ---
+        client.post('/api/haproxy/settings/add_acl', {'acl': {'name': 'kic-a'}})
+        recording.close()
+
+        # --- Assert ---
+        [record] = recording.load(self.path)
+        self.assertEqual(record['kind'], 'opnsense')
+        self.assertEqual((record['method'], record['endpoint'], record['status']), ('POST', '/api/haproxy/settings/add_acl', 200))
+        self.assertEqual(record['request'], {'acl': {'name': 'kic-a'}})
+        self.assertEqual(record['response'], {'result': 'saved', 'uuid': 'u1'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+from kubernetes import client
+from src.registry import ConfigMapStore, FileStore, ManagedObjectRegistry
+
+class TestManagedObjectRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'registry.json')
+        self.registry = ManagedObjectRegistry(FileStore(self.path))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_diverged(self):
+        desired = {'a': {'ip': '1.1.1.1'}, 'b': {'ip': '2.2.2.2'}}
+
+        # Everything diverges before the first apply
+        self.assertEqual(self.registry.diverged('dns', desired), {'a', 'b'})
+
+        self.registry.record('dns', desired, {'a': 'uuid-a'})
+        self.assertEqual(self.registry.diverged('dns', desired), set())
+
+        # Changed, added and removed keys all count as diverged
+        desired = {'a': {'ip': '9.9.9.9'}, 'c': {'ip': '3.3.3.3'}}
+        self.assertEqual(self.registry.diverged('dns', desired), {'a', 'b', 'c'})
+
+    def test_survives_restart(self):
+        desired = {'a': {'ip': '1.1.1.1'}}
+        self.registry.record('dns', desired, {'a': 'uuid-a'})
+
+        restarted = ManagedObjectRegistry(FileStore(self.path))
+        restarted.load()
+        self.assertEqual(restarted.diverged('dns', desired), set())
+        self.assertEqual(restarted.get('dns')['a']['uuid'], 'uuid-a')
+
+        restarted.forget('dns')
+        restarted = ManagedObjectRegistry(FileStore(self.path))
+        restarted.load()
+        self.assertEqual(restarted.get('dns'), {})
+
+    def test_saves_reach_the_store_in_order(self):
+        # --- Arrange ---
+        written = []
+        first_write = threading.Event()
+        release = threading.Event()
+        store = MagicMock()
+        def write(data):
+            if not first_write.is_set():
+                first_write.set()
+                release.wait(5)
+            written.append(data)
+        store.write.side_effect = write
+        registry = ManagedObjectRegistry(store)
+
+        # --- Act ---
+        # The record's save is still in progress when the forget starts
+        recorder = threading.Thread(target=registry.record, args=('dns', {'a': {'ip': '1.1.1.1'}}))
+        recorder.start()
+        first_write.wait(5)
+        forgetter = threading.Thread(target=registry.forget, args=('dns',))
+        forgetter.start()
+        # Give the forget a chance to overtake the record's save
+        forgetter.join(0.1)
+        release.set()
+        recorder.join()
+        forgetter.join()
+
+        # --- Assert ---
+        self.assertEqual(written[-1], {})
+
+    def test_file_store_concurrent_saves(self):
+        # --- Act ---
+        threads = [threading.Thread(target=self.registry.record, args=(f"plugin-{n}", {'a': {'n': n}})) for n in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # --- Assert ---
+        restarted = ManagedObjectRegistry(FileStore(self.path))
+        restarted.load()
+        self.assertEqual(restarted.object_count(), 20)
+        self.assertEqual(os.listdir(self.tmpdir.name), ['registry.json'])
+
+    def test_configmap_store_creates_missing_configmap(self):
+        k8s_core_v1_api = MagicMock()
+        k8s_core_v1_api.read_namespaced_config_map.side_effect = client.ApiException(status=404)
+        k8s_core_v1_api.patch_namespaced_config_map.side_effect = client.ApiException(status=404)
+        registry = ManagedObjectRegistry(ConfigMapStore(k8s_core_v1_api, 'kube-system', 'koc-registry'))
+
+        registry.load()
+        registry.record('dns', {'a': {'ip': '1.1.1.1'}})
+
+        namespace, body = k8s_core_v1_api.create_namespaced_config_map.call_args.args
+        self.assertEqual(namespace, 'kube-system')
+        self.assertEqual(body['metadata']['name'], 'koc-registry')
+        self.assertEqual(len(body['binaryData']), 1)
+
+        # A restart reads back what was written
+        k8s_core_v1_api.read_namespaced_config_map.side_effect = None
+        k8s_core_v1_api.read_namespaced_config_map.return_value = MagicMock(binary_data=body['binaryData'])
+        restarted = ManagedObjectRegistry(ConfigMapStore(k8s_core_v1_api, 'kube-system', 'koc-registry'))
+        restarted.load()
+        self.assertEqual(restarted.diverged('dns', {'a': {'ip': '1.1.1.1'}}), set())
+
+    def test_configmap_store_patches_changed_plugins_only(self):
+        k8s_core_v1_api = MagicMock()
+        k8s_core_v1_api.read_namespaced_config_map.return_value = MagicMock(binary_data=None)
+        registry = ManagedObjectRegistry(ConfigMapStore(k8s_core_v1_api, 'kube-system', 'koc-registry'))
+        registry.load()
+        registry.record('dns', {'a': {'ip': '1.1.1.1'}})
+        registry.record('metallb@fw-a', {'node1': {'ip': '10.0.0.1'}})
+
+        name, namespace, body = k8s_core_v1_api.patch_namespaced_config_map.call_args.args
+        self.assertEqual(list(body['binaryData']), [ConfigMapStore._key('metallb@fw-a')])
+
+        registry.forget('dns')
+        name, namespace, body = k8s_core_v1_api.patch_namespaced_config_map.call_args.args
+        self.assertEqual(body['binaryData'], {ConfigMapStore._key('dns'): None})
+
+    def test_configmap_store_clears_registry_too_large_to_persist(self):
+        k8s_core_v1_api = MagicMock()
+        k8s_core_v1_api.read_namespaced_config_map.return_value = MagicMock(binary_data=None)
+        store = ConfigMapStore(k8s_core_v1_api, 'kube-system', 'koc-registry')
+        registry = ManagedObjectRegistry(store)
+        registry.load()
+        registry.record('dns', {'a': {'ip': '1.1.1.1'}})
+
+        store.MAX_BYTES = 10
+        registry.record('dns', {'a': {'ip': '2.2.2.2'}})
+
+        # The stale entries are removed, so a restart reconciles from scratch
+        name, namespace, body = k8s_core_v1_api.patch_namespaced_config_map.call_args.args
+        self.assertEqual(body['binaryData'], {ConfigMapStore._key('dns'): None})
+
+if __name__ == '__main__':
+    unittest.main()
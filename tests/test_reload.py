@@ -0,0 +1,110 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+from src.main import load_plugins
+from src.reload import PluginReloader
+from src.workqueue import WorkQueue
+
+class TestPluginReloader(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {
+            'metallb': {'enabled': True, 'nodeLabelSelector': 'a=b', 'bgp-implementation': 'frr'},
+            'haproxy-ingress-proxy': {'enabled': True, 'defaultBackend': 'pool'},
+            'opnsense-dns-haproxy-ingress-proxy': {'enabled': True},
+        }
+        build = lambda controller_config: load_plugins(controller_config, MagicMock(), MagicMock(), MagicMock())
+        self.plugins, self.watch_map = build(self.config)
+        self.plugin_locks = {p: threading.Lock() for p in self.plugins}
+        self.queue = WorkQueue()
+        self.on_reloaded = MagicMock()
+        self.reloader = PluginReloader(self.config, self.plugins, self.watch_map, self.plugin_locks, self.queue, build, self.on_reloaded)
+
+    def by_id(self):
+        return {p.plugin_id: p for p in self.plugins}
+
+    def drain(self):
+        items = []
+        while len(self.queue):
+            items.append(self.queue.get())
+            self.queue.done(items[-1])
+        return items
+
+    def test_unchanged_configuration_keeps_everything(self):
+        # --- Act ---
+        result = self.reloader.apply({k: dict(v) for k, v in self.config.items()})
+
+        # --- Assert ---
+        self.assertEqual(result, ([], [], []))
+        self.on_reloaded.assert_not_called()
+        self.assertEqual(len(self.queue), 0)
+
+    def test_runtime_options_are_applied_in_place(self):
+        # --- Arrange ---
+        before = self.by_id()
+        config = {**self.config, 'metallb': {**self.config['metallb'], 'resyncInterval': 60}}
+
+        # --- Act ---
+        rebuilt, retuned, removed = self.reloader.apply(config)
+
+        # --- Assert ---
+        self.assertEqual((rebuilt, retuned, removed), ([], ['metallb'], []))
+        self.assertIs(self.by_id()['metallb'], before['metallb'])
+        self.assertEqual(before['metallb'].config['resyncInterval'], 60)
+        # Nothing is queued, no reconcile is triggered by tuning
+        self.assertEqual(len(self.queue), 0)
+
+    def test_only_changed_plugins_are_rebuilt(self):
+        # --- Arrange ---
+        before = self.by_id()
+        lock = self.plugin_locks[before['metallb']]
+        config = {**self.config, 'metallb': {**self.config['metallb'], 'nodeLabelSelector': 'c=d'}}
+
+        # --- Act ---
+        rebuilt, retuned, removed = self.reloader.apply(config)
+
+        # --- Assert ---
+        self.assertEqual((rebuilt, retuned, removed), (['metallb'], [], []))
+        after = self.by_id()
+        self.assertIsNot(after['metallb'], before['metallb'])
+        self.assertEqual(after['metallb'].config['nodeLabelSelector'], 'c=d')
+        self.assertIs(after['haproxy-ingress-proxy'], before['haproxy-ingress-proxy'])
+        self.assertEqual(self.watch_map['node'], [after['metallb']])
+        self.assertEqual(self.drain(), [after['metallb']])
+        # The replacement shares the lock of the plugin it replaces, the old instance is retired
+        self.assertIs(self.plugin_locks[after['metallb']], lock)
+        self.assertNotIn(before['metallb'], self.plugin_locks)
+
+    def test_shared_sections_rebuild_their_dependents(self):
+        # --- Arrange ---
+        before = self.by_id()
+        config = {**self.config, 'haproxy-ingress-proxy': {'enabled': True, 'defaultBackend': 'other'}}
+
+        # --- Act ---
+        rebuilt, _, _ = self.reloader.apply(config)
+
+        # --- Assert ---
+        self.assertEqual(sorted(rebuilt), ['dns-haproxy-ingress-proxy', 'haproxy-ingress-proxy'])
+        self.assertIs(self.by_id()['metallb'], before['metallb'])
+        self.assertEqual(sorted(p.plugin_id for p in self.watch_map['ingress']), ['dns-haproxy-ingress-proxy', 'haproxy-ingress-proxy'])
+
+    def test_disabled_and_enabled_plugins(self):
+        # --- Arrange ---
+        before = self.by_id()
+        config = {**self.config, 'metallb': {'enabled': False}, 'opnsense-dns-services': {'enabled': True}}
+
+        # --- Act ---
+        rebuilt, retuned, removed = self.reloader.apply(config)
+
+        # --- Assert ---
+        self.assertEqual((rebuilt, removed), (['dns-services'], ['metallb']))
+        self.assertNotIn('metallb', self.by_id())
+        self.assertNotIn(before['metallb'], self.plugin_locks)
+        self.assertEqual(self.watch_map['node'], [])
+        self.assertEqual([p.plugin_id for p in self.watch_map['service']], ['dns-services'])
+        added, retired = self.on_reloaded.call_args.args
+        self.assertEqual([p.plugin_id for p in added], ['dns-services'])
+        self.assertEqual(retired, [before['metallb']])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+from src.sharding import Shard, from_env, shard_of
+
+class TestSharding(unittest.TestCase):
+
+    def test_every_namespace_belongs_to_exactly_one_shard(self):
+        # --- Arrange ---
+        shards = [Shard(i, 3) for i in range(3)]
+
+        # --- Act ---
+        owners = {f"ns-{n}": [s.index for s in shards if s.owns(f"ns-{n}")] for n in range(300)}
+
+        # --- Assert ---
+        self.assertTrue(all(len(o) == 1 for o in owners.values()))
+        # Rendezvous hashing spreads namespaces roughly evenly
+        counts = [sum(1 for o in owners.values() if o == [i]) for i in range(3)]
+        self.assertTrue(all(c > 60 for c in counts), counts)
+
+    def test_adding_a_shard_only_moves_namespaces_to_it(self):
+        # --- Act ---
+        moved = {ns: shard_of(ns, 4) for ns in (f"ns-{n}" for n in range(500)) if shard_of(ns, 3) != shard_of(ns, 4)}
+
+        # --- Assert ---
+        self.assertTrue(moved)
+        self.assertEqual(set(moved.values()), {3})
+
+    def test_owns_description(self):
+        # --- Arrange ---
+        namespace = next(f"ns-{n}" for n in range(100) if shard_of(f"ns-{n}", 2) == 1)
+        shard0, shard1 = Shard(0, 2), Shard(1, 2)
+        description = f"Managed by K8s Ingress {namespace}/app"
+
+        # --- Assert ---
+        self.assertTrue(shard1.owns_description(description))
+        self.assertFalse(shard0.owns_description(description))
+        self.assertTrue(shard1.owns_description(f"Alias: {description}"))
+        # Rows without an owner namespace go to shard 0
+        self.assertTrue(shard0.owns_description('Managed by K8s'))
+        self.assertFalse(shard1.owns_description(None))
+
+    def test_select(self):
+        # --- Arrange ---
+        shard = Shard(0, 2)
+        objects = [MagicMock(**{'metadata.namespace': f"ns-{n}"}) for n in range(20)]
+
+        # --- Act ---
+        selected = shard.select(objects)
+
+        # --- Assert ---
+        self.assertEqual(selected, [o for o in objects if shard_of(o.metadata.namespace, 2) == 0])
+
+    def test_from_env(self):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(from_env())
+
+        with patch.dict(os.environ, {'CONTROLLER_SHARD_COUNT': '3', 'POD_NAME': 'opnsense-controller-2'}, clear=True):
+            shard = from_env()
+            self.assertEqual((shard.index, shard.count), (2, 3))
+            self.assertEqual(str(shard), 'shard-2-of-3')
+
+        with patch.dict(os.environ, {'CONTROLLER_SHARD_COUNT': '3', 'CONTROLLER_SHARD_INDEX': '1', 'POD_NAME': 'x-2'}, clear=True):
+            self.assertEqual(from_env().index, 1)
+
+        with patch.dict(os.environ, {'CONTROLLER_SHARD_COUNT': '3', 'POD_NAME': 'opnsense-controller-abc12'}, clear=True):
+            with self.assertRaises(ValueError):
+                from_env()
+
+        with patch.dict(os.environ, {'CONTROLLER_SHARD_COUNT': '3', 'CONTROLLER_SHARD_INDEX': '3'}, clear=True):
+            with self.assertRaises(ValueError):
+                from_env()
+
+if __name__ == '__main__':
+    unittest.main()
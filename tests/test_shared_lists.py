@@ -0,0 +1,94 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from src.clients import shared_lists
+from src.clients.opnsense import OpnSenseClient
+from src.clients.shared_lists import SharedListApi
+from src.main import load_plugins
+
+class TestSharedListApi(unittest.TestCase):
+
+    def setUp(self):
+        self.api = MagicMock()
+        self.api.list_node.side_effect = lambda **kwargs: MagicMock(items=[])
+        self.shared = SharedListApi(self.api)
+
+    def test_results_are_shared_until_a_watch_event(self):
+        # --- Act ---
+        first = self.shared.list_node(label_selector='a=b')
+        second = self.shared.list_node(label_selector='a=b')
+        other_selector = self.shared.list_node(label_selector='c=d')
+        shared_lists.invalidate('node')
+        after_event = self.shared.list_node(label_selector='a=b')
+
+        # --- Assert ---
+        self.assertIs(first, second)
+        self.assertIsNot(first, other_selector)
+        self.assertIsNot(first, after_event)
+        self.assertEqual(self.api.list_node.call_count, 3)
+
+    def test_events_of_other_resource_types_keep_results(self):
+        # --- Act ---
+        first = self.shared.list_node()
+        shared_lists.invalidate('service')
+
+        # --- Assert ---
+        self.assertIs(self.shared.list_node(), first)
+
+    def test_results_expire(self):
+        # --- Arrange ---
+        shared = SharedListApi(self.api, max_age=0)
+
+        # --- Act / Assert ---
+        self.assertIsNot(shared.list_node(), shared.list_node())
+
+    def test_concurrent_calls_wait_for_one_request(self):
+        # --- Arrange ---
+        calls = []
+        def slow_list(**kwargs):
+            calls.append(kwargs)
+            time.sleep(0.05)
+            return object()
+        self.api.list_node.side_effect = slow_list
+        results = []
+
+        # --- Act ---
+        threads = [threading.Thread(target=lambda: results.append(self.shared.list_node())) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # --- Assert ---
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({id(r) for r in results}), 1)
+
+    def test_other_calls_pass_through(self):
+        # --- Act ---
+        self.shared.read_namespaced_service('svc', 'default')
+        self.shared.read_namespaced_service('svc', 'default')
+
+        # --- Assert ---
+        self.assertEqual(self.api.read_namespaced_service.call_count, 2)
+
+    def test_plugin_instances_per_target(self):
+        # --- Arrange ---
+        clients = [OpnSenseClient(f"https://{name}", 'k', 's', target=name) for name in ('fw-a', 'fw-b')]
+        config = {'metallb': {'enabled': True, 'bgp-implementation': 'frr'}, 'opnsense-dns-services': {'enabled': True}}
+
+        # --- Act ---
+        plugins, watch_map = load_plugins(config, self.shared, MagicMock(), clients)
+
+        # --- Assert ---
+        self.assertEqual([p.plugin_id for p in plugins], ['metallb@fw-a', 'metallb@fw-b', 'dns-services@fw-a', 'dns-services@fw-b'])
+        self.assertEqual([p.opnsense_client for p in watch_map['node']], clients)
+        # Registry entries are kept per firewall
+        self.assertEqual(plugins[2].registry_id, 'dns-services@fw-a:unbound')
+        # Both firewalls' MetalLB instances list the nodes once
+        plugins[0]._get_nodes()
+        plugins[1]._get_nodes()
+        self.assertEqual(self.api.list_node.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
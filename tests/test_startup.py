@@ -0,0 +1,119 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from kubernetes import client
+from src.main import list_resource_versions, load_plugins, watch_controller_config, watch_resources
+from src.plugins import CATALOG
+from src.startup import StartupTimer
+
+class StopWatching(BaseException):
+    """
+    Ends a watch loop in tests, which restarts on any Exception.
+    """
+
+class TestStartupTimer(unittest.TestCase):
+
+    def test_phases_add_up_to_the_total(self):
+        # --- Arrange ---
+        timer = StartupTimer()
+
+        # --- Act ---
+        timer.mark('clients')
+        sum(range(100000))
+        timer.mark('plugins')
+
+        # --- Assert ---
+        self.assertEqual([phase for phase, _, _ in timer.phases], ['clients', 'plugins'])
+        wall, cpu = timer.total()
+        self.assertAlmostEqual(sum(w for _, w, _ in timer.phases), wall)
+        self.assertAlmostEqual(sum(c for _, _, c in timer.phases), cpu)
+        self.assertIn('plugins', timer.summary())
+
+class TestLazyPluginLoading(unittest.TestCase):
+
+    def test_only_enabled_plugins_are_imported(self):
+        # --- Arrange ---
+        config = {'metallb': {'enabled': True}, 'opnsense-dns-services': {'enabled': False}}
+
+        # --- Act ---
+        with patch('src.plugins.importlib.import_module') as import_module:
+            plugins, watch_map = load_plugins(config, MagicMock(), MagicMock(), MagicMock())
+
+        # --- Assert ---
+        import_module.assert_called_once_with(CATALOG['metallb'].module)
+        self.assertEqual(len(plugins), 1)
+        self.assertEqual(watch_map, {'node': plugins})
+
+class TestWatchStart(unittest.TestCase):
+
+    def test_resource_versions_are_read_per_list(self):
+        # --- Arrange ---
+        nodes, services = MagicMock(), MagicMock(side_effect=Exception('forbidden'))
+        nodes.return_value.metadata.resource_version = '42'
+
+        # --- Act ---
+        resource_versions = list_resource_versions([nodes, services])
+
+        # --- Assert ---
+        nodes.assert_called_once_with(limit=1)
+        # A list that cannot be read falls back to a watch without a resourceVersion
+        self.assertEqual(resource_versions, ['42', None])
+
+    def test_watch_starts_from_the_resource_version(self):
+        # --- Arrange ---
+        list_func = MagicMock()
+
+        # --- Act ---
+        with patch('src.main.watch.Watch') as watch_class:
+            watch_class.return_value.stream.side_effect = [[], StopWatching(), [], StopWatching()]
+            watch_class.return_value.resource_version = None
+            for resource_version in ('42', None):
+                with self.assertRaises(StopWatching):
+                    watch_resources('node', list_func, {}, MagicMock(), resource_version=resource_version)
+
+        # --- Assert ---
+        stream = watch_class.return_value.stream
+        self.assertEqual(stream.call_args_list[0].kwargs, {'resource_version': '42'})
+        self.assertEqual(stream.call_args_list[2].kwargs, {})
+
+    def test_expired_watch_relists_and_queues_watchers(self):
+        # --- Arrange ---
+        list_func = MagicMock()
+        list_func.return_value.metadata.resource_version = '100'
+        plugin, queue = MagicMock(), MagicMock()
+
+        # --- Act ---
+        with patch('src.main.watch.Watch') as watch_class:
+            watch_class.return_value.stream.side_effect = [client.ApiException(status=410), StopWatching()]
+            with self.assertRaises(StopWatching):
+                watch_resources('node', list_func, {'node': [plugin]}, queue, resource_version='42')
+
+        # --- Assert ---
+        stream = watch_class.return_value.stream
+        self.assertEqual([c.kwargs for c in stream.call_args_list], [{'resource_version': '42'}, {'resource_version': '100'}])
+        list_func.assert_called_once_with(limit=1)
+        # Events may have been missed while the watch was gone
+        queue.add.assert_called_once_with(plugin)
+    def test_config_watch_survives_errors_and_expiry(self):
+        # --- Arrange ---
+        k8s_core_v1_api, reloader = MagicMock(), MagicMock()
+        reloader.apply.return_value = ([], [], [])
+        cm = MagicMock(data={'config': 'metallb:\n  enabled: true\n'})
+        k8s_core_v1_api.list_namespaced_config_map.return_value = MagicMock(items=[cm])
+        k8s_core_v1_api.list_namespaced_config_map.return_value.metadata.resource_version = '100'
+
+        # --- Act ---
+        with patch('src.main.watch.Watch') as watch_class, patch('src.main.time.sleep') as sleep:
+            watch_class.return_value.resource_version = '42'
+            watch_class.return_value.stream.side_effect = [ConnectionError('reset'), client.ApiException(status=410), StopWatching()]
+            with self.assertRaises(StopWatching):
+                watch_controller_config(k8s_core_v1_api, reloader)
+
+        # --- Assert ---
+        sleep.assert_called_once()
+        stream = watch_class.return_value.stream
+        self.assertEqual([c.kwargs.get('resource_version') for c in stream.call_args_list], [None, '42', '100'])
+        # The relisted ConfigMap is applied, it may have changed while the watch was gone
+        reloader.apply.assert_called_once_with({'metallb': {'enabled': True}})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from src import tracing
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        tracing.set_exporter(tracing.FileExporter(self.path))
+
+    def tearDown(self):
+        tracing.set_exporter(None)
+        os.remove(self.path)
+
+    def _exported_spans(self):
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        return [[span for scope in line['resourceSpans'][0]['scopeSpans'] for span in scope['spans']] for line in lines]
+
+    def test_trace_is_exported_as_one_otlp_line(self):
+        # --- Act ---
+        with tracing.trace('reconcile', plugin='metallb') as root:
+            with tracing.span('fetch_opnsense') as span:
+                span.set_attribute('count', 3)
+            with self.assertRaises(ValueError):
+                with tracing.span('mutate'):
+                    raise ValueError("boom")
+
+        # --- Assert ---
+        traces = self._exported_spans()
+        self.assertEqual(len(traces), 1)
+        spans = {span['name']: span for span in traces[0]}
+        self.assertEqual(set(spans), {'reconcile', 'fetch_opnsense', 'mutate'})
+        self.assertTrue(all(span['traceId'] == root.trace_id for span in spans.values()))
+        self.assertNotIn('parentSpanId', spans['reconcile'])
+        self.assertEqual(spans['fetch_opnsense']['parentSpanId'], root.span_id)
+        self.assertIn({'key': 'count', 'value': {'intValue': '3'}}, spans['fetch_opnsense']['attributes'])
+        self.assertEqual(spans['mutate']['status'], {'code': 'STATUS_CODE_ERROR', 'message': 'ValueError: boom'})
+
+    def test_spans_propagate_to_executor_threads(self):
+        # --- Act ---
+        with tracing.trace('reconcile') as root:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                def work(i):
+                    with tracing.span('opnsense.request', index=i):
+                        return tracing.current_trace_id()
+                trace_ids = list(executor.map(tracing.propagate(work), range(4)))
+
+        # --- Assert ---
+        self.assertEqual(trace_ids, [root.trace_id] * 4)
+        requests = [span for span in self._exported_spans()[0] if span['name'] == 'opnsense.request']
+        self.assertEqual(len(requests), 4)
+        self.assertTrue(all(span['parentSpanId'] == root.span_id for span in requests))
+
+    def test_child_spans_are_noops_without_exporter(self):
+        # --- Arrange ---
+        tracing.set_exporter(None)
+
+        # --- Act ---
+        with tracing.span('orphan') as orphan:
+            pass
+        with tracing.trace('reconcile') as root:
+            with tracing.span('fetch_opnsense') as child:
+                pass
+
+        # --- Assert ---
+        # The root still provides a trace ID for the logs
+        self.assertIs(orphan, child)
+        self.assertEqual(len(root.trace_id), 32)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_log_records_carry_the_trace_id(self):
+        # --- Arrange ---
+        previous = logging.getLogRecordFactory()
+        tracing.install_log_context()
+        try:
+            # --- Act ---
+            outside = logging.getLogRecordFactory()('root', logging.INFO, __file__, 1, 'outside', None, None)
+            with tracing.trace('reconcile') as root:
+                inside = logging.getLogRecordFactory()('root', logging.INFO, __file__, 1, 'inside', None, None)
+        finally:
+            logging.setLogRecordFactory(previous)
+
+        # --- Assert ---
+        self.assertEqual(outside.trace_id, '-')
+        self.assertEqual(inside.trace_id, root.trace_id)
+
+if __name__ == '__main__':
+    unittest.main()
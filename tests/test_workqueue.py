@@ -0,0 +1,90 @@
+import threading
+import unittest
+from src.workqueue import EventStamp, WorkQueue
+
+class TestWorkQueue(unittest.TestCase):
+
+    def test_pending_items_are_coalesced(self):
+        # --- Arrange ---
+        queue = WorkQueue()
+
+        # --- Act ---
+        queue.add('metallb')
+        queue.add('dns-services')
+        queue.add('metallb')
+
+        # --- Assert ---
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.coalesced, 1)
+        self.assertEqual(queue.get(), 'metallb')
+        self.assertEqual(queue.get(), 'dns-services')
+
+    def test_item_added_while_processing_is_requeued_after_done(self):
+        # --- Arrange ---
+        queue = WorkQueue()
+        queue.add('metallb')
+        item = queue.get()
+
+        # --- Act ---
+        queue.add('metallb')
+        queue.add('metallb')
+
+        # --- Assert ---
+        # Never handed out twice concurrently
+        self.assertEqual(len(queue), 0)
+        queue.done(item)
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.get(), 'metallb')
+
+    def test_event_stamps_follow_the_run_that_serves_them(self):
+        # --- Arrange ---
+        queue = WorkQueue()
+        first = EventStamp('ingress', 'ADDED', 'default', 'app', '1')
+        second = EventStamp('ingress', 'MODIFIED', 'default', 'app', '2')
+        third = EventStamp('ingress', 'MODIFIED', 'default', 'app', '3')
+
+        # --- Act ---
+        queue.add('dns-ingresses', first)
+        queue.add('dns-ingresses', second)
+        item = queue.get()
+        queue.add('dns-ingresses', third)
+
+        # --- Assert ---
+        # Coalesced events are all served by one run, an event arriving mid-run waits for the next one
+        self.assertEqual(queue.stamps(item), [first, second])
+        queue.done(item)
+        self.assertEqual(queue.stamps(item), [])
+        self.assertEqual(queue.stamps(queue.get()), [third])
+
+    def test_shutdown_releases_waiting_workers(self):
+        # --- Arrange ---
+        queue = WorkQueue()
+        results = []
+        worker = threading.Thread(target=lambda: results.append(queue.get()))
+        worker.start()
+
+        # --- Act ---
+        queue.shutdown()
+        worker.join(timeout=5)
+
+        # --- Assert ---
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(results, [None])
+
+    def test_wait_idle_returns_once_processing_is_done(self):
+        # --- Arrange ---
+        queue = WorkQueue()
+        queue.add('metallb')
+        item = queue.get()
+
+        # --- Act ---
+        busy = queue.wait_idle(timeout=0.01)
+        threading.Timer(0.05, queue.done, args=(item,)).start()
+        idle = queue.wait_idle(timeout=5)
+
+        # --- Assert ---
+        self.assertFalse(busy)
+        self.assertTrue(idle)
+
+if __name__ == '__main__':
+    unittest.main()